@@ -0,0 +1,323 @@
+from array import array
+
+TRADES = ('Trade', 'TradeCross')
+
+# column layout of the bar records, also registered with sinks.Dtypes
+BAR_FIELDS = [('Instrument', '<u8'), ('Bar', '<i8'), ('Start', '<f8'), ('End', '<f8'),
+              ('Open', '<f8'), ('High', '<f8'), ('Low', '<f8'), ('Close', '<f8'),
+              ('Volume', '<f8'), ('VWAP', '<f8'), ('Trades', '<u4')]
+
+
+class BarAggregator():
+    # OHLCV/VWAP bars per Instrument from Trade and TradeCross messages,
+    # every `interval` seconds of message Timestamp or, with `volume`, every
+    # `volume` traded quantity (a trade belongs to the bar its cumulative
+    # volume before it falls in). Open bars live in parallel arrays indexed
+    # by instrument slot; a finished bar goes to downstream.add() as a
+    # `name` record. Time bars of all instruments finish once any trade
+    # reaches a later interval; a late trade for a finished bar opens it
+    # again as a new record
+    def __init__(self, downstream, interval=60.0, volume=0, name=None):
+        self.downstream = downstream
+        self.interval = interval
+        self.volume = volume
+        self.name = name or ('VolumeBar' if volume else 'Bar')
+        self.slots = {}
+        self.instruments = array('Q')
+        self.bar = array('q')
+        self.start = array('d')
+        self.end = array('d')
+        self.open = array('d')
+        self.high = array('d')
+        self.low = array('d')
+        self.close_ = array('d')
+        self.size = array('d')
+        self.notional = array('d')
+        self.trades = array('I')
+        self.cumulative = array('d')
+        self.latest = None
+        self.emitted = 0
+
+    def slot(self, instrument):
+        i = self.slots.get(instrument)
+        if i is None:
+            i = self.slots[instrument] = len(self.instruments)
+            self.instruments.append(instrument)
+            self.bar.append(-1)
+            for a in (self.start, self.end, self.open, self.high, self.low, self.close_,
+                      self.size, self.notional, self.cumulative):
+                a.append(0.0)
+            self.trades.append(0)
+        return i
+
+    def bar_id(self, i, t, before):
+        if self.volume:
+            return int(before // self.volume)
+        return int(t // self.interval)
+
+    def merge(self, i, bar, start, end, o, h, l, c, size, notional, trades):
+        # folds a trade into instrument slot i
+        if self.bar[i] != bar:
+            if self.trades[i]:
+                self.emit(i)
+            self.bar[i] = bar
+            self.start[i] = start
+            self.open[i] = o
+            self.high[i] = h
+            self.low[i] = l
+            self.size[i] = 0.0
+            self.notional[i] = 0.0
+            self.trades[i] = 0
+        else:
+            if h > self.high[i]:
+                self.high[i] = h
+            if l < self.low[i]:
+                self.low[i] = l
+        self.end[i] = end
+        self.close_[i] = c
+        self.size[i] += size
+        self.notional[i] += notional
+        self.trades[i] += trades
+        if not self.volume and (self.latest is None or bar > self.latest):
+            self.latest = bar
+            self.emit_before(bar)
+
+    def emit(self, i):
+        size = self.size[i]
+        self.downstream.add(self.name, {
+            'Instrument': self.instruments[i], 'Bar': self.bar[i],
+            'Start': self.start[i], 'End': self.end[i],
+            'Open': self.open[i], 'High': self.high[i], 'Low': self.low[i], 'Close': self.close_[i],
+            'Volume': size, 'VWAP': self.notional[i] / size if size else None,
+            'Trades': self.trades[i], 'MsgTypeName': self.name})
+        self.bar[i] = -1
+        self.trades[i] = 0
+        self.emitted += 1
+
+    def emit_before(self, bar):
+        trades = self.trades
+        for i in range(len(trades)):
+            if trades[i] and self.bar[i] < bar:
+                self.emit(i)
+
+    def add(self, name, data):
+        if name in TRADES:
+            self.trade(data['Instrument'], data['Price'], data['ExecutedSize'], data['Timestamp'])
+
+    def trade(self, instrument, price, size, t):
+        if not size:
+            return
+        i = self.slot(instrument)
+        before = self.cumulative[i]
+        self.cumulative[i] = before + size
+        self.merge(i, self.bar_id(i, t, before), t, t, price, price, price, price,
+                   size, price * size, 1)
+
+    def write_batch(self, columns):
+        trades = batch_trades(columns)
+        if trades is not None:
+            for position, own, i, bar in self.fold(trades):
+                self.downstream.add(self.name, bar)
+
+    def fold(self, trades):
+        # trade() of every batch_trades() trade at once with numpy, returning
+        # the finished bars as (position of the trade at which trade() emits
+        # it, 0 if that trade's own instrument or 1 if emit_before(), slot,
+        # record) in emission order and leaving the open bars, float sums
+        # included, bit for bit as trade() would
+        import numpy as np
+        instrument, price, size, t = trades
+        n = len(t)
+        known, first = np.unique(instrument, return_index=True)
+        for x in known[np.argsort(first)].tolist():
+            self.slot(x)
+        slot = np.array([self.slots[x] for x in known.tolist()])[np.searchsorted(known, instrument)]
+        bars, starts, ends, opens, highs, lows, closes, sizes, notionals, counts, cumulative = [
+            np.frombuffer(a, dtype) for a, dtype in (
+                (self.bar, np.int64), (self.start, np.float64), (self.end, np.float64),
+                (self.open, np.float64), (self.high, np.float64), (self.low, np.float64),
+                (self.close_, np.float64), (self.size, np.float64), (self.notional, np.float64),
+                (self.trades, np.uint32), (self.cumulative, np.float64))]
+        # trades grouped by slot, each group in arrival order
+        order = np.argsort(slot, kind='stable')
+        sslot, sprice, ssize, st = slot[order], price[order], size[order], t[order]
+        head = np.r_[True, sslot[1:] != sslot[:-1]]
+        heads = np.flatnonzero(head)
+        group = sslot[heads]
+        # volume before each trade, added up one trade at a time like trade()
+        before = np.empty(n)
+        for lo, hi, i in zip(heads.tolist(), np.r_[heads[1:], n].tolist(), group.tolist()):
+            c = np.cumsum(np.r_[cumulative[i], ssize[lo:hi]])
+            before[lo:hi] = c[:-1]
+            cumulative[i] = c[-1]
+        if self.volume:
+            sbar = (before // self.volume).astype(np.int64)
+            raises = np.empty(0, np.int64)
+        else:
+            bar = (t // self.interval).astype(np.int64)
+            sbar = bar[order]
+            # latest bar before each trade and after the last one; a trade
+            # raising it finishes every older open bar
+            latest = np.iinfo(np.int64).min if self.latest is None else self.latest
+            level = np.maximum.accumulate(np.r_[latest, bar])
+            raises = np.flatnonzero(bar > level[:-1])
+            slevel = level[1:][order]
+        # runs of trades of one slot in one bar with no emit_before() between
+        # them; a group's first run continues the slot's open bar if nothing
+        # finished it first
+        new = head | np.r_[True, sbar[1:] != sbar[:-1]]
+        continues = (counts[group] > 0) & (bars[group] == sbar[heads])
+        if not self.volume:
+            new |= np.r_[True, slevel[1:] != slevel[:-1]]
+            continues &= level[:-1][order[heads]] == latest
+        run = np.cumsum(new) - 1
+        rstart = np.flatnonzero(new)
+        rend = np.r_[rstart[1:], n] - 1
+        rslot = sslot[rstart]
+        carried = run[heads[continues]]
+        cslot = rslot[carried]
+        start, end, o, c = st[rstart], st[rend], sprice[rstart], sprice[rend]
+        h, l = np.maximum.reduceat(sprice, rstart), np.minimum.reduceat(sprice, rstart)
+        count = (rend - rstart + 1).astype(np.int64)
+        # bincount adds the weights into each bin in the order given, so the
+        # open bars' sums followed by the trades in arrival order add up as
+        # in trade()
+        arrival = np.empty(n, np.int64)
+        arrival[order] = run
+        bins = np.r_[carried, arrival]
+        volume = np.bincount(bins, np.r_[sizes[cslot], size], len(rstart))
+        notional = np.bincount(bins, np.r_[notionals[cslot], price * size], len(rstart))
+        start[carried], o[carried] = starts[cslot], opens[cslot]
+        h[carried] = np.maximum(h[carried], highs[cslot])
+        l[carried] = np.minimum(l[carried], lows[cslot])
+        count[carried] += counts[cslot]
+        # a run finishes at its slot's next run or at the first raise after
+        # it, whichever comes first; open bars not continued likewise from
+        # the start of the batch
+        never = n
+        rfirst, rlast = order[rstart], order[rend]
+        last = np.r_[rslot[1:] != rslot[:-1], True]
+        following = np.full(len(rstart), never)
+        following[:-1][~last[:-1]] = rfirst[1:][~last[:-1]]
+        k = np.searchsorted(raises, rlast, 'right')
+        finish = np.minimum(following, np.r_[raises, never][k])
+        stale = np.flatnonzero(counts > 0)
+        stale = stale[~np.isin(stale, cslot)]
+        firsts = np.full(len(counts), never)
+        firsts[group] = order[heads]
+        sfinish = np.minimum(firsts[stale], raises[0] if len(raises) else never)
+        done = np.flatnonzero(finish < never)
+        sdone = stale[sfinish < never]
+        finished = []
+        instruments, name = self.instruments, self.name
+        for at, own, i, b, t0, t1, a, hi, lo, z, v, x, m in zip(
+                np.r_[sfinish[sfinish < never], finish[done]].tolist(),
+                np.r_[sfinish[sfinish < never] != firsts[sdone],
+                      finish[done] != following[done]].astype(int).tolist(),
+                np.r_[sdone, rslot[done]].tolist(), np.r_[bars[sdone], sbar[rstart][done]].tolist(),
+                np.r_[starts[sdone], start[done]].tolist(), np.r_[ends[sdone], end[done]].tolist(),
+                np.r_[opens[sdone], o[done]].tolist(), np.r_[highs[sdone], h[done]].tolist(),
+                np.r_[lows[sdone], l[done]].tolist(), np.r_[closes[sdone], c[done]].tolist(),
+                np.r_[sizes[sdone], volume[done]].tolist(),
+                np.r_[notionals[sdone], notional[done]].tolist(),
+                np.r_[counts[sdone], count[done]].tolist()):
+            finished.append((at, own, i, {
+                'Instrument': instruments[i], 'Bar': b, 'Start': t0, 'End': t1,
+                'Open': a, 'High': hi, 'Low': lo, 'Close': z,
+                'Volume': v, 'VWAP': x / v if v else None,
+                'Trades': m, 'MsgTypeName': name}))
+        finished.sort(key=lambda f: f[:3])
+        self.emitted += len(finished)
+        # each slot keeps its last run, open unless it finished
+        bars[sdone] = -1
+        counts[sdone] = 0
+        tail = np.flatnonzero(last)
+        i = rslot[tail]
+        bars[i], starts[i], ends[i], opens[i], highs[i], lows[i], closes[i] = (
+            sbar[rstart][tail], start[tail], end[tail], o[tail], h[tail], l[tail], c[tail])
+        sizes[i], notionals[i], counts[i] = volume[tail], notional[tail], count[tail]
+        closed = rslot[tail[finish[tail] < never]]
+        bars[closed] = -1
+        counts[closed] = 0
+        if not self.volume:
+            self.latest = int(level[-1])
+        return finished
+
+    def position(self):
+        # JSON-able open bars for a session checkpoint, put back by seek()
+        return {'columns': [a.tolist() for a in self.columns()],
+                'latest': self.latest, 'emitted': self.emitted}
+
+    def seek(self, position):
+        for a, values in zip(self.columns(), position['columns']):
+            del a[:]
+            a.extend(values)
+        self.slots = {instrument: i for i, instrument in enumerate(self.instruments)}
+        self.latest = position['latest']
+        self.emitted = position['emitted']
+
+    def columns(self):
+        return (self.instruments, self.bar, self.start, self.end, self.open, self.high, self.low,
+                self.close_, self.size, self.notional, self.trades, self.cumulative)
+
+    def close(self):
+        for i in range(len(self.trades)):
+            if self.trades[i]:
+                self.emit(i)
+
+
+def batch_trades(columns):
+    # Instrument, Price, ExecutedSize and Timestamp arrays of the trades with
+    # a size in batch_decode columns, in arrival order (capture time, then
+    # Sequence) as BarAggregator.fold() takes them, or None
+    import numpy as np
+    parts = [columns[n] for n in TRADES if n in columns and len(columns[n])]
+    if not parts:
+        return None
+    instrument, price, size, t, time, sequence = [
+        np.concatenate([a[f] for a in parts])
+        for f in ('Instrument', 'Price', 'ExecutedSize', 'Timestamp', 'EventName', 'Sequence')]
+    if len(parts) > 1:
+        order = np.lexsort((sequence, time))
+        instrument, price, size, t = instrument[order], price[order], size[order], t[order]
+    traded = size != 0
+    if not traded.all():
+        instrument, price, size, t = instrument[traded], price[traded], size[traded], t[traded]
+    if not len(t):
+        return None
+    return (instrument.astype(np.uint64), price.astype(np.float64), size.astype(np.float64),
+            t.astype(np.float64))
+
+
+class BarAggregators():
+    # several BarAggregators as one sink that hands each trade to all of
+    # them in turn, also from column batches, so that their bars interleave
+    # on a shared downstream as they do per message
+    def __init__(self, aggregators):
+        self.aggregators = aggregators
+
+    def add(self, name, data):
+        for a in self.aggregators:
+            a.add(name, data)
+
+    def write_batch(self, columns):
+        # per trade, the aggregators' bars come out in the aggregators' order
+        trades = batch_trades(columns)
+        if trades is None:
+            return
+        finished = [(at, k, own, i, a, bar) for k, a in enumerate(self.aggregators)
+                    for at, own, i, bar in a.fold(trades)]
+        finished.sort(key=lambda f: f[:4])
+        for at, k, own, i, a, bar in finished:
+            a.downstream.add(a.name, bar)
+
+    def position(self):
+        return [a.position() for a in self.aggregators]
+
+    def seek(self, position):
+        for a, p in zip(self.aggregators, position):
+            a.seek(p)
+
+    def close(self):
+        for a in self.aggregators:
+            a.close()
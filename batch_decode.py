@@ -0,0 +1,187 @@
+from array import array
+import numpy as np
+
+from gtp_parse import Decoders
+from pcap_reader import UDPPacket, PcapReader
+
+# struct format characters used in serializer.py -> numpy dtypes
+FMT_DTYPES = {'c': 'S1', 'b': 'i1', 'B': 'u1', 'h': '<i2', 'H': '<u2',
+              'l': '<i4', 'L': '<u4', 'q': '<i8', 'Q': '<u8'}
+
+EXTRA_COLUMNS = [('InstrumentLong', '<u8'), ('EventName', '<f8'),
+                 ('MarketDataGroup', 'S1'), ('Sequence', '<u8'),
+                 ('latency', '<f8')]
+
+
+def wire_dtype(decoder):
+    s = decoder.struct
+    fields = []
+    for f, fmt in zip(decoder.fields, split_format(s.format)):
+        if fmt.endswith('s'):
+            fields.append((f, 'S' + fmt[:-1]))
+        else:
+            fields.append((f, FMT_DTYPES[fmt]))
+    dtype = np.dtype(fields)
+    if dtype.itemsize != s.size:
+        raise Exception('dtype does not match struct for [' + decoder.name + ']')
+    return dtype
+
+
+def split_format(fmt):
+    out = []
+    num = ''
+    for ch in fmt.lstrip('<'):
+        if ch.isdigit():
+            num += ch
+        else:
+            out.append(num + ch)
+            num = ''
+    return out
+
+
+def column_dtype(decoder, wire):
+    # Timestamp and PriceFlds become float columns, Instrument the short
+    # symbol with the raw value kept in InstrumentLong as decode() does
+    fields = []
+    for f in wire.names:
+        if f == 'Timestamp' or decoder.fields.index(f) in decoder.prices:
+            fields.append((f, '<f8'))
+        elif f == 'Instrument':
+            fields.append((f, '<u4'))
+        else:
+            fields.append((f, wire.fields[f][0]))
+    for f, t in EXTRA_COLUMNS:
+        if f not in wire.names:
+            fields.append((f, t))
+    return np.dtype(fields)
+
+
+class TypeBatch():
+    def __init__(self, decoder):
+        self.decoder = decoder
+        self.wire = wire_dtype(decoder)
+        self.dtype = column_dtype(decoder, self.wire)
+        self.size = decoder.struct.size
+        self.clear()
+
+    def clear(self):
+        self.data = bytearray()
+        self.packet = array('I')
+        self.index = array('H')
+
+    def __len__(self):
+        return len(self.packet)
+
+    def columns(self, pkt_time, pkt_group, pkt_seq):
+        raw = np.frombuffer(self.data, dtype=self.wire)
+        pidx = np.frombuffer(self.packet, dtype=np.uint32)
+        out = np.empty(len(raw), dtype=self.dtype)
+        for f in self.wire.names:
+            out[f] = raw[f]
+        if 'Timestamp' in raw.dtype.names:
+            # seconds and fraction separately so the float64 seconds round
+            # like decode()'s int / 10**9; converting the ns count to float64
+            # first rounds twice (nanoseconds are lost either way)
+            ts = raw['Timestamp']
+            out['Timestamp'] = ts // 10**9 + (ts % 10**9) / 10**9
+        for i in self.decoder.prices:
+            f = self.decoder.fields[i]
+            out[f] = raw[f] / 10**8
+        if 'Instrument' in raw.dtype.names:
+            out['InstrumentLong'] = raw['Instrument']
+            out['Instrument'] = raw['Instrument'] & 0xffffff
+        else:
+            out['InstrumentLong'] = 0
+        out['EventName'] = pkt_time[pidx]
+        out['MarketDataGroup'] = pkt_group[pidx]
+        out['Sequence'] = pkt_seq[pidx] + np.frombuffer(self.index, dtype=np.uint16)
+        if 'Timestamp' in raw.dtype.names:
+            out['latency'] = out['EventName'] - out['Timestamp']
+        else:
+            out['latency'] = np.nan
+        return out
+
+
+class BatchDecoder():
+    def __init__(self, sequencer=None, msgfilter=None):
+        self.sequencer = sequencer
+        self.msgfilter = msgfilter
+        self.types = {t: TypeBatch(d) for t, d in Decoders.items()}
+        self.unknown = 0
+        self.truncated = 0
+        self.clear()
+
+    def clear(self):
+        self.pkt_time = array('d')
+        self.pkt_group = bytearray()
+        self.pkt_seq = array('Q')
+        self.messages = 0
+        for b in self.types.values():
+            b.clear()
+
+    def add(self, x, time=0.0):
+        # x is a UDPPacket from pcap_reader or a raw GTP block
+        if type(x) is UDPPacket:
+            time = x.time
+            x = x.load
+        count = x[2]
+        seq = x[4] | (x[5] << 8) | (x[6] << 16) | (x[7] << 24)
+        mask = -1
+        if self.sequencer is not None:
+            mask = self.sequencer.accept(chr(x[3]), seq, count, time)
+        if not count or not mask:
+            return
+        msgfilter = self.msgfilter
+        if msgfilter is not None and not msgfilter.accept_block(x, time):
+            return
+        p = len(self.pkt_seq)
+        self.pkt_time.append(time)
+        self.pkt_group.append(x[3])
+        self.pkt_seq.append(seq)
+
+        types = self.types
+        end = len(x)
+        off = 8
+        for j in range(count):
+            b = types.get(x[off + 2])
+            if not (mask >> j) & 1 or (msgfilter is not None and not msgfilter.accept(x, off)):
+                pass
+            elif b is None:
+                self.unknown += 1
+            elif off + b.size > end:
+                self.truncated += 1
+            else:
+                b.data += x[off:off + b.size]
+                b.packet.append(p)
+                b.index.append(j)
+            off += x[off] | (x[off + 1] << 8)
+        self.messages += count
+
+    def decode(self):
+        # one vectorized pass per message type over everything added since
+        # the last call; returns {MsgTypeName: structured array}
+        pkt_time = np.frombuffer(self.pkt_time, dtype=np.float64)
+        pkt_group = np.frombuffer(bytes(self.pkt_group), dtype='S1')
+        pkt_seq = np.frombuffer(self.pkt_seq, dtype=np.uint64)
+        out = {}
+        for b in self.types.values():
+            if len(b):
+                out[b.decoder.name] = b.columns(pkt_time, pkt_group, pkt_seq)
+        self.clear()
+        return out
+
+
+def decode_batches(packets, batch_size=100000, sequencer=None, msgfilter=None):
+    batch = BatchDecoder(sequencer, msgfilter)
+    for pk in packets:
+        batch.add(pk)
+        if batch.messages >= batch_size:
+            yield batch.decode()
+    if batch.messages:
+        yield batch.decode()
+
+
+def decode_capture(path, batch_size=100000, sequencer=None, msgfilter=None):
+    with PcapReader(path) as reader:
+        for columns in decode_batches(reader, batch_size, sequencer, msgfilter):
+            yield columns
@@ -0,0 +1,176 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import tracemalloc
+
+from gtp_parse import decode, read_capture
+from pcap_reader import PcapReader
+from synthetic import generate_blocks, write_pcap, parse_mix, DEFAULT_MIX
+
+
+class CountSink():
+    def __init__(self):
+        self.count = 0
+
+    def add(self, name, data):
+        self.count += 1
+
+
+class NullWriter():
+    def write(self, text):
+        return len(text)
+
+
+# decode paths: fn(packets, path, args) -> messages decoded. packets is the
+# capture held in memory, path the same capture on disk
+
+def bench_decode(packets, path, args):
+    sink = CountSink()
+    for pk in packets:
+        decode(pk, sink)
+    return sink.count
+
+
+def bench_views(packets, path, args):
+    from views import read_views
+    n = 0
+    for pk in packets:
+        for v in read_views(pk):
+            getattr(v, 'Instrument', None)
+            n += 1
+    return n
+
+
+def bench_records(packets, path, args):
+    from records import read_records
+    n = 0
+    for pk in packets:
+        for r in read_records(pk):
+            n += 1
+    return n
+
+
+def bench_batch(packets, path, args):
+    from batch_decode import decode_batches
+    n = 0
+    for columns in decode_batches(packets, args.batch):
+        n += sum(len(a) for a in columns.values())
+    return n
+
+
+def bench_pipeline(packets, path, args):
+    from pipeline import run_pipeline
+    return run_pipeline(packets, [CountSink()])['messages']
+
+
+def bench_capture(packets, path, args):
+    sink = CountSink()
+    read_capture(path, sink=sink)
+    return sink.count
+
+
+def bench_parallel(packets, path, args):
+    # counted from the packets; peak memory covers the parent process only
+    from parallel import decode_parallel
+    decode_parallel(path, args.jobs, args.chunk_size * 2**20, out=NullWriter())
+    return sum(pk.load[2] for pk in packets)
+
+
+PATHS = {'decode': bench_decode, 'views': bench_views, 'records': bench_records, 'batch': bench_batch,
+         'pipeline': bench_pipeline, 'capture': bench_capture, 'parallel': bench_parallel}
+IN_MEMORY = ['decode', 'views', 'records', 'batch']
+
+
+def load_packets(path):
+    # loads copied out of the mapping so the list outlives the reader
+    with PcapReader(path) as reader:
+        return [p._replace(load=bytes(p.load)) for p in reader]
+
+
+def measure(fn, packets, path, args):
+    # best of args.repeat timed runs, then one more under tracemalloc
+    best = None
+    for i in range(args.repeat):
+        started = time.perf_counter()
+        messages = fn(packets, path, args)
+        elapsed = time.perf_counter() - started
+        if best is None or elapsed < best:
+            best = elapsed
+    tracemalloc.start()
+    try:
+        fn(packets, path, args)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {'messages': messages, 'seconds': round(best, 6),
+            'msgs_per_sec': round(messages / best) if best else None,
+            'ns_per_msg': round(best * 10**9 / messages, 1) if messages else None,
+            'peak_bytes': peak}
+
+
+def run(path, paths, args, out=sys.stdout):
+    packets = load_packets(path)
+    for name in paths:
+        try:
+            result = measure(PATHS[name], packets, path, args)
+        except ImportError as e:
+            sys.stderr.write('%s skipped: %s\n' % (name, e))
+            continue
+        out.write(json.dumps(dict({'path': name, 'packets': len(packets)}, **result)) + '\n')
+
+
+def run_per_type(mix, paths, args, directory, out=sys.stdout):
+    # one single-type capture per message type through the in-memory paths
+    for t in mix:
+        path = os.path.join(directory, t + '.pcap')
+        write_pcap(path, generate_blocks(args.per_type, {t: 1}, seed=args.seed))
+        packets = load_packets(path)
+        for name in paths:
+            if name not in IN_MEMORY:
+                continue
+            try:
+                result = measure(PATHS[name], packets, path, args)
+            except ImportError:
+                continue
+            out.write(json.dumps({'path': name, 'type': t, 'messages': result['messages'],
+                                  'ns_per_msg': result['ns_per_msg'],
+                                  'peak_bytes': result['peak_bytes']}) + '\n')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the GTP decode paths')
+    parser.add_argument('capture', nargs='?', help='benchmark this capture instead of a synthetic one')
+    parser.add_argument('--packets', type=int, default=20000, help='synthetic capture packets')
+    parser.add_argument('--mix', help='message type weights, e.g. AddOrder=5,Trade=1 (default: all types)')
+    parser.add_argument('--paths', default=','.join(PATHS),
+                        help='comma separated decode paths out of ' + ','.join(PATHS))
+    parser.add_argument('--per-type', type=int, default=2000, metavar='PACKETS',
+                        help='packets per single-type capture for ns/message per type, 0 to skip')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per path, best is reported')
+    parser.add_argument('--batch', type=int, default=100000, help='messages per batch')
+    parser.add_argument('--jobs', type=int, default=None, help='parallel worker processes')
+    parser.add_argument('--chunk-size', type=int, default=1, metavar='MB', help='parallel shard size')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    paths = args.paths.split(',')
+    for name in paths:
+        if name not in PATHS:
+            parser.error('unknown decode path ' + name)
+    mix = parse_mix(args.mix) if args.mix else DEFAULT_MIX
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = args.capture
+        if path is None:
+            path = os.path.join(directory, 'synthetic.pcap')
+            write_pcap(path, generate_blocks(args.packets, mix, seed=args.seed))
+        run(path, paths, args)
+        if args.per_type:
+            run_per_type(mix, paths, args, directory)
+
+
+if __name__ == '__main__':
+    main()
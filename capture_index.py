@@ -0,0 +1,250 @@
+import os
+import sys
+import argparse
+from struct import Struct
+
+import numpy as np
+
+from gtp_parse import decode
+from pcap_reader import PcapReader, is_compressed
+from filters import InstrumentOffsets, MessageFilter, parse_time
+from parallel import capture_files
+
+SUFFIX = '.gtpidx'
+BUCKET = 1.0
+VERSION = 1
+
+instrument_field = Struct('<Q')
+
+BLOCK_DTYPE = np.dtype([('offset', '<u8'), ('time', '<f8'), ('group', 'u1'),
+                        ('count', 'u1'), ('sequence', '<u4')])
+
+
+def index_path(path):
+    return path + SUFFIX
+
+
+def block_instruments(x):
+    # the symbols (as decode() reports them) of the messages in block x
+    symbols = set()
+    end = len(x)
+    off = 8
+    for j in range(x[2]):
+        if off + 3 > end:
+            break
+        o = InstrumentOffsets.get(x[off + 2])
+        if o is not None and off + o + 8 <= end:
+            symbols.add(instrument_field.unpack_from(x, off + o)[0] & 0xffffff)
+        length = x[off] | (x[off + 1] << 8)
+        if not length:
+            break
+        off += length
+    return symbols
+
+
+class CaptureIndex():
+    # block level index of one capture file: per GTP block its record offset,
+    # capture time, MarketDataGroup, MessageCount and SequenceNumber, plus
+    #   buckets      first and last block of every `bucket` seconds of
+    #                capture time, so time ranges slice instead of scanning
+    #   instruments  sorted symbols with the blocks containing each (CSR)
+    #   by_sequence  block numbers ordered by (group, SequenceNumber)
+    # Saved with numpy next to the capture as <capture>.gtpidx
+    def __init__(self, path, blocks, bucket, bucket_ids, bucket_first, bucket_last,
+                 symbols, postings_start, postings, size):
+        self.path = path
+        self.blocks = blocks
+        self.bucket = bucket
+        self.bucket_ids = bucket_ids
+        self.bucket_first = bucket_first
+        self.bucket_last = bucket_last
+        self.symbols = symbols
+        self.postings_start = postings_start
+        self.postings = postings
+        self.size = size
+        self.by_sequence = np.lexsort((blocks['sequence'], blocks['group']))
+
+    @classmethod
+    def build(cls, path, bucket=BUCKET):
+        # queries seek to record offsets, which a compressed stream cannot do
+        if is_compressed(path):
+            raise Exception('Cannot index a compressed capture, decompress it first [' + path + ']')
+        rows = []
+        posting = {}
+        with PcapReader(path) as reader:
+            for p in reader:
+                x = p.load
+                if len(x) < 8:
+                    continue
+                n = len(rows)
+                rows.append((p.offset, p.time, x[3], x[2],
+                             x[4] | (x[5] << 8) | (x[6] << 16) | (x[7] << 24)))
+                for s in block_instruments(x):
+                    posting.setdefault(s, []).append(n)
+        blocks = np.array(rows, dtype=BLOCK_DTYPE)
+
+        ids = np.floor(blocks['time'] / bucket).astype(np.int64)
+        bucket_ids = np.unique(ids)
+        first = np.full(len(bucket_ids), len(blocks), dtype=np.int64)
+        last = np.zeros(len(bucket_ids), dtype=np.int64)
+        k = np.searchsorted(bucket_ids, ids)
+        n = np.arange(len(blocks))
+        np.minimum.at(first, k, n)
+        np.maximum.at(last, k, n)
+
+        symbols = np.array(sorted(posting), dtype=np.uint32)
+        counts = np.array([len(posting[s]) for s in symbols], dtype=np.int64)
+        start = np.zeros(len(symbols) + 1, dtype=np.int64)
+        np.cumsum(counts, out=start[1:])
+        postings = np.array([b for s in symbols for b in posting[s]], dtype=np.uint32)
+        return cls(path, blocks, bucket, bucket_ids, first, last, symbols, start, postings,
+                   os.path.getsize(path))
+
+    def save(self, path=None):
+        path = path or index_path(self.path)
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            np.savez_compressed(f, version=VERSION, blocks=self.blocks, bucket=self.bucket,
+                                bucket_ids=self.bucket_ids, bucket_first=self.bucket_first,
+                                bucket_last=self.bucket_last, symbols=self.symbols,
+                                postings_start=self.postings_start, postings=self.postings,
+                                size=self.size)
+        os.replace(tmp, path)
+        return path
+
+    @classmethod
+    def load(cls, path, index=None):
+        # raises if the index is missing or was built from a different file
+        with np.load(index or index_path(path)) as z:
+            if int(z['version']) != VERSION:
+                raise Exception('Unsupported index version [' + (index or index_path(path)) + ']')
+            if int(z['size']) != os.path.getsize(path):
+                raise Exception('Stale index for [' + path + ']')
+            return cls(path, z['blocks'], float(z['bucket']), z['bucket_ids'], z['bucket_first'],
+                       z['bucket_last'], z['symbols'], z['postings_start'], z['postings'],
+                       int(z['size']))
+
+    def instrument_blocks(self, symbol):
+        i = np.searchsorted(self.symbols, symbol)
+        if i == len(self.symbols) or self.symbols[i] != symbol:
+            return np.zeros(0, dtype=np.int64)
+        return self.postings[self.postings_start[i]:self.postings_start[i + 1]].astype(np.int64)
+
+    def time_blocks(self, start=None, end=None):
+        lo = 0 if start is None else np.searchsorted(self.bucket_ids, int(np.floor(start / self.bucket)))
+        hi = len(self.bucket_ids) if end is None else \
+            np.searchsorted(self.bucket_ids, int(np.floor(end / self.bucket)), side='right')
+        if lo >= hi:
+            return np.zeros(0, dtype=np.int64)
+        n = np.arange(self.bucket_first[lo:hi].min(), self.bucket_last[lo:hi].max() + 1)
+        t = self.blocks['time'][n]
+        keep = np.ones(len(n), dtype=bool)
+        if start is not None:
+            keep &= t >= start
+        if end is not None:
+            keep &= t < end
+        return n[keep]
+
+    def sequence_blocks(self, group, sequence):
+        # the block(s) carrying message `sequence` of the group
+        order = self.by_sequence
+        b = self.blocks[order]
+        g = ord(group) if isinstance(group, str) else group
+        lo = np.searchsorted(b['group'], g)
+        hi = np.searchsorted(b['group'], g, side='right')
+        seq = b['sequence'][lo:hi]
+        i = np.searchsorted(seq, sequence, side='right')
+        n = order[lo:lo + i]
+        n = n[(b['sequence'][lo:lo + i] + b['count'][lo:lo + i]) > sequence]
+        return np.sort(n)
+
+    def select(self, instruments=None, start=None, end=None, groups=None, sequence=None):
+        # sorted numbers of the blocks matching every given criterion
+        n = None
+        if instruments:
+            n = np.unique(np.concatenate([self.instrument_blocks(s) for s in instruments]))
+        if start is not None or end is not None:
+            t = self.time_blocks(start, end)
+            n = t if n is None else np.intersect1d(n, t)
+        if sequence is not None:
+            group, seq = sequence
+            s = self.sequence_blocks(group, seq)
+            n = s if n is None else np.intersect1d(n, s)
+        if n is None:
+            n = np.arange(len(self.blocks))
+        if groups:
+            g = [ord(x) if isinstance(x, str) else x for x in groups]
+            n = n[np.isin(self.blocks['group'][n], g)]
+        return n
+
+    def packets(self, blocks):
+        # seeks to the records of the given (sorted) blocks; runs of
+        # consecutive blocks are read as one byte range
+        offsets = self.blocks['offset']
+        with PcapReader(self.path) as reader:
+            i = 0
+            while i < len(blocks):
+                j = i
+                while j + 1 < len(blocks) and blocks[j + 1] == blocks[j] + 1:
+                    j += 1
+                stop = int(offsets[blocks[j]]) + 1
+                for p in reader.range(int(offsets[blocks[i]]), stop):
+                    yield p
+                i = j + 1
+
+
+def build(path, bucket=BUCKET):
+    for f in capture_files(path):
+        index = CaptureIndex.build(f, bucket)
+        sys.stderr.write('%s: %d blocks, %d instruments\n'
+                         % (index.save(), len(index.blocks), len(index.symbols)))
+
+
+def query(path, instruments=None, start=None, end=None, groups=None, sequence=None,
+          types=None, sink=None):
+    # decodes only the indexed blocks that can match, then drops the other
+    # messages in them with a MessageFilter
+    msgfilter = MessageFilter(types, instruments, groups, start, end)
+    for f in capture_files(path):
+        index = CaptureIndex.load(f)
+        blocks = index.select(instruments, start, end, groups, sequence)
+        for p in index.packets(blocks):
+            decode(p, sink, None, msgfilter)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Index GTP captures and decode only the blocks a query needs')
+    sub = parser.add_subparsers(dest='command')
+    b = sub.add_parser('build', help='write <capture>' + SUFFIX + ' for a capture or each capture of a directory')
+    b.add_argument('path')
+    b.add_argument('--bucket', type=float, default=BUCKET, help='time bucket in seconds')
+    q = sub.add_parser('query', help='decode the messages matching the criteria')
+    q.add_argument('path')
+    q.add_argument('--instrument', help='comma separated instrument symbols')
+    q.add_argument('--start', help='epoch seconds or ISO time (UTC)')
+    q.add_argument('--end', help='epoch seconds or ISO time (UTC)')
+    q.add_argument('--group', help='comma separated MarketDataGroups')
+    q.add_argument('--sequence', metavar='GROUP:SEQ', help='the block carrying this message')
+    q.add_argument('--types', help='comma separated message types')
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        build(args.path, args.bucket)
+    elif args.command == 'query':
+        sequence = None
+        if args.sequence:
+            group, seq = args.sequence.split(':')
+            sequence = (group, int(seq))
+        query(args.path,
+              [int(i) for i in args.instrument.split(',')] if args.instrument else None,
+              parse_time(args.start) if args.start else None,
+              parse_time(args.end) if args.end else None,
+              args.group.split(',') if args.group else None,
+              sequence,
+              args.types.split(',') if args.types else None)
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+class Conflator():
+    # keeps the latest best bid/offer per (Instrument, OrderBookType), from
+    # TopOfBook messages and/or the books of an attached OrderBooks, and
+    # hands `downstream` one 'BBO' record per changed book every `interval`
+    # seconds of capture time, or sooner once `max_updates` updates are
+    # pending. Updates replaced before publication are counted as conflated
+    def __init__(self, downstream, interval=0.1, max_updates=0):
+        self.downstream = downstream
+        self.interval = interval
+        self.max_updates = max_updates
+        self.latest = {}
+        self.published = {}
+        self.pending = {}
+        self.waiting = 0
+        self.next = None
+        self.updates = 0
+        self.publications = 0
+        self.unchanged = 0
+
+    def attach(self, books):
+        # BBO from order books reconstructed by order_book.OrderBooks
+        books.on_update(self.book_update)
+        return self
+
+    def update(self, key, bbo, timestamp, time, source):
+        self.updates += 1
+        self.latest[key] = (bbo, timestamp, time, source)
+        self.pending[key] = self.pending.get(key, 0) + 1
+        if time is not None:
+            if self.next is None:
+                self.next = time + self.interval
+            elif time >= self.next:
+                self.publish()
+                self.next = time + self.interval
+                return
+        self.waiting += 1
+        if self.max_updates and self.waiting >= self.max_updates:
+            self.publish()
+
+    def add(self, name, data):
+        if name != 'TopOfBook':
+            return
+        bbo = (data['BidLimitPrice'] or None, data['BidLimitSize'] or None,
+               data['OfferLimitPrice'] or None, data['OfferLimitSize'] or None)
+        self.update((data['Instrument'], data['OrderBookType']), bbo,
+                    data.get('Timestamp'), data.get('EventName'), name)
+
+    def book_update(self, book, name, data):
+        bid = book.best_bid() or (None, None)
+        ask = book.best_ask() or (None, None)
+        self.update((book.instrument, book.book_type), bid + ask, book.timestamp,
+                    data.get('EventName'), 'OrderBook')
+
+    def publish(self):
+        add = self.downstream.add
+        for key, n in self.pending.items():
+            bbo, timestamp, time, source = self.latest[key]
+            if self.published.get(key) == bbo:
+                self.unchanged += 1
+                continue
+            self.published[key] = bbo
+            self.publications += 1
+            add('BBO', {'Instrument': key[0], 'OrderBookType': key[1],
+                        'BidPrice': bbo[0], 'BidSize': bbo[1],
+                        'AskPrice': bbo[2], 'AskSize': bbo[3],
+                        'Timestamp': timestamp, 'EventName': time,
+                        'Updates': n, 'Source': source})
+        self.pending = {}
+        self.waiting = 0
+
+    def stats(self):
+        return {'Updates': self.updates, 'Published': self.publications,
+                'Conflated': self.updates - self.publications - self.unchanged,
+                'Unchanged': self.unchanged, 'Instruments': len(self.latest)}
+
+    def flush(self):
+        # pending updates stay pending: publishing here would make a
+        # session checkpoint change the output
+        if hasattr(self.downstream, 'flush'):
+            self.downstream.flush()
+
+    def position(self):
+        # JSON-able state for a session checkpoint, put back by seek()
+        return {'latest': [[k[0], k[1], list(bbo), ts, t, source]
+                           for k, (bbo, ts, t, source) in self.latest.items()],
+                'published': [[k[0], k[1], list(bbo)] for k, bbo in self.published.items()],
+                'pending': [[k[0], k[1], n] for k, n in self.pending.items()],
+                'waiting': self.waiting, 'next': self.next,
+                'counts': [self.updates, self.publications, self.unchanged]}
+
+    def seek(self, position):
+        self.latest = {(i, b): (tuple(bbo), ts, t, source)
+                       for i, b, bbo, ts, t, source in position['latest']}
+        self.published = {(i, b): tuple(bbo) for i, b, bbo in position['published']}
+        self.pending = {(i, b): n for i, b, n in position['pending']}
+        self.waiting = position['waiting']
+        self.next = position['next']
+        self.updates, self.publications, self.unchanged = position['counts']
+
+    def close(self):
+        self.publish()
+        if hasattr(self.downstream, 'close'):
+            self.downstream.close()
@@ -0,0 +1,106 @@
+from struct import Struct
+
+import serializer
+from gtp_parse import MsgTypes
+
+BLOCK_HEADER = Struct('<HBcI')
+MTU_PAYLOAD = 1472
+
+
+def field_default(fmt):
+    if fmt.endswith('s'):
+        return b''
+    if fmt == 'c':
+        return b'\x00'
+    return 0
+
+
+class MessageEncoder():
+    # packs one message type straight into a caller's buffer with the
+    # serializer's Struct. Values are lists in field order (index maps a
+    # field name to its position); Length and MessageType come prefilled
+    def __init__(self, cls, tag=None):
+        s = cls()
+        self.name = cls.__name__
+        self.tag = (tag or s.tag).encode()
+        self.fields = [f['name'] for f in s.fields]
+        self.index = {name: i for i, name in enumerate(self.fields)}
+        self.struct = Struct(s.format)
+        self.size = self.struct.size
+        self.pack_into = self.struct.pack_into
+        self.defaults = [field_default(f['fmt']) for f in s.fields]
+        self.defaults[self.index['Length']] = self.size
+        self.defaults[self.index['MessageType']] = self.tag
+
+    def values(self, **fields):
+        # a fresh value list, strings encoded like Serializer.populate()
+        values = list(self.defaults)
+        index = self.index
+        for name, value in fields.items():
+            if name not in index:
+                raise Exception('Invalid field [' + name + ']')
+            if type(value) is str:
+                value = value.encode('utf-8')
+            values[index[name]] = value
+        return values
+
+    def encode_into(self, buf, offset, values):
+        # returns the offset just past the message
+        self.pack_into(buf, offset, *values)
+        return offset + self.size
+
+    def encode(self, values):
+        return self.struct.pack(*values)
+
+
+# keyed by MsgTypeName, tags from MsgTypes like the decoder registry
+Encoders = {name: MessageEncoder(getattr(serializer, name), tag)
+            for tag, name in MsgTypes.items() if hasattr(serializer, name)}
+
+
+class BlockEncoder():
+    # assembles GTP blocks for one MarketDataGroup in a preallocated buffer:
+    # messages are packed in after the 8 byte header until the next one
+    # would not fit in `size` bytes or MessageCount reaches 255, then
+    # block() fills in the header and returns the packet payload. The
+    # SequenceNumber carries on from block to block
+    def __init__(self, group, sequence=1, size=MTU_PAYLOAD):
+        self.group = group.encode() if type(group) is str else group
+        self.sequence = sequence
+        self.buf = bytearray(size)
+        self.view = memoryview(self.buf)
+        self.offset = 8
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def fits(self, size):
+        return self.count < 255 and self.offset + size <= len(self.buf)
+
+    def add(self, encoder, values):
+        # False, and nothing written, when the block is full
+        if not self.fits(encoder.size):
+            return False
+        encoder.pack_into(self.buf, self.offset, *values)
+        self.offset += encoder.size
+        self.count += 1
+        return True
+
+    def add_bytes(self, message):
+        # an already encoded message
+        n = len(message)
+        if not self.fits(n):
+            return False
+        self.view[self.offset:self.offset + n] = message
+        self.offset += n
+        self.count += 1
+        return True
+
+    def block(self):
+        BLOCK_HEADER.pack_into(self.buf, 0, self.offset, self.count, self.group, self.sequence)
+        data = bytes(self.view[:self.offset])
+        self.sequence += self.count
+        self.offset = 8
+        self.count = 0
+        return data
@@ -0,0 +1,96 @@
+import datetime
+from struct import Struct
+
+import serializer
+from gtp_parse import MsgTypes, Decoders
+
+instrument_field = Struct('<Q')
+
+
+def instrument_offset(decoder):
+    # byte offset of the Instrument field within the message, None if absent
+    if decoder.instrument is None:
+        return None
+    specs = getattr(serializer, decoder.name)().fields
+    return Struct('<' + ''.join(f['fmt'] for f in specs[:decoder.instrument])).size
+
+
+InstrumentOffsets = {t: instrument_offset(d) for t, d in Decoders.items()}
+
+
+def parse_time(value):
+    # epoch seconds or an ISO date/time taken as UTC
+    try:
+        return float(value)
+    except ValueError:
+        t = datetime.datetime.fromisoformat(value)
+        if t.tzinfo is None:
+            t = t.replace(tzinfo=datetime.timezone.utc)
+        return t.timestamp()
+
+
+def type_byte(t):
+    # a MessageType character ('P') or MsgTypeName ('Trade')
+    if len(t) == 1:
+        return ord(t)
+    for tag, name in MsgTypes.items():
+        if name == t:
+            return ord(tag)
+    raise Exception('Invalid message type [' + t + ']')
+
+
+class MessageFilter():
+    # predicates checked on raw block bytes before anything is unpacked:
+    # MarketDataGroup and capture time once per block, then the MessageType
+    # byte and the Instrument field at its fixed offset per message.
+    # Instruments are symbols as decode() reports them (low three bytes of
+    # the Instrument field); with an instrument set, messages without an
+    # Instrument field are dropped
+    def __init__(self, types=None, instruments=None, groups=None, start=None, end=None):
+        self.types = set(type_byte(t) if isinstance(t, str) else t for t in types) if types else None
+        self.instruments = set(instruments) if instruments else None
+        self.groups = set(ord(g) if isinstance(g, str) else g for g in groups) if groups else None
+        self.start = start
+        self.end = end
+        # per MessageType byte: None to keep without looking at the
+        # instrument, else the Instrument offset to check
+        self.plan = {}
+        for t, d in Decoders.items():
+            if self.types is not None and t not in self.types:
+                continue
+            if self.instruments is None:
+                self.plan[t] = None
+            elif InstrumentOffsets[t] is not None:
+                self.plan[t] = InstrumentOffsets[t]
+        self.skipped = 0
+
+    def accept_block(self, x, time=None):
+        if self.groups is not None and x[3] not in self.groups:
+            return False
+        if time is not None:
+            if self.start is not None and time < self.start:
+                return False
+            if self.end is not None and time >= self.end:
+                return False
+        return True
+
+    def accept(self, x, off):
+        # off is the offset of the message in block x
+        plan = self.plan
+        t = x[off + 2]
+        if t in plan:
+            o = plan[t]
+            if o is None or instrument_field.unpack_from(x, off + o)[0] & 0xffffff in self.instruments:
+                return True
+        self.skipped += 1
+        return False
+
+
+def filter_from_args(args):
+    if not (args.types or args.instrument or args.group or args.start or args.end):
+        return None
+    return MessageFilter(args.types.split(',') if args.types else None,
+                         [int(i) for i in args.instrument.split(',')] if args.instrument else None,
+                         args.group.split(',') if args.group else None,
+                         parse_time(args.start) if args.start else None,
+                         parse_time(args.end) if args.end else None)
@@ -2,11 +2,23 @@
 from struct import Struct
 from collections import namedtuple
 from functools import partial
-from scapy.all import *
 import datetime
 import sys
 import json 
+import argparse
+import signal
+import os
+import serializer
+import profiling
+import pcap_reader
 from serializer import *
+from pcap_reader import UDPPacket, PcapReader, is_capture
+
+try:
+    from scapy.all import sniff, UDP, IP
+except ImportError:
+    # scapy is only needed for live capture and the dissection fallback
+    sniff=None
 
 
 # Ether.payload_guess = [({"type": 0x800}, IP)]
@@ -66,118 +78,499 @@ class msg():
         return Class._make(self.unpack(data))
 
     def print(self):
-        x={}
-        for f in self.data.keys():
-            if type(self.data[f])==bytes:
-                x[f]=self.data[f].decode('utf-8')
-            else:
-                x[f]=self.data[f]
+        print(to_json(self.data))
+
+def to_json(data):
+    x={}
+    for f in data.keys():
+        if type(data[f])==bytes:
+            x[f]=data[f].decode('utf-8')
+        else:
+            x[f]=data[f]
+    return json.dumps(x)
+
+class PrintSink():
+    # the default output of decode() as a sink, for chaining behind others
+    def add(self, name, data):
+        print(to_json(data))
 
-        print(json.dumps(x))
+class Tee():
+    # hands every decoded message (or column batch) to several sinks
+    def __init__(self, sinks):
+        self.sinks=sinks
+
+    def add(self, name, data):
+        for s in self.sinks:
+            s.add(name,data)
+
+    def write_batch(self, columns):
+        for s in self.sinks:
+            s.write_batch(columns)
+
+    def close(self):
+        for s in self.sinks:
+            if hasattr(s,'close'):
+                s.close()
                    
 
 def lse_bin_symbol(i):
+    # the symbol is the low three bytes of the Instrument field
     if i:
-        hex = i.to_bytes(((i.bit_length() + 7) // 8),"big").hex()
-        s=str('0x'+hex[-6:])
-        return int(s,base=16)
+        return i & 0xffffff
     else:
         return 0
 
 TCP_field_names = ['sport', 'dport', 'len', 'chksum']
 IP_field_names=['len', 'src', 'dst']
 
-def read_block(x):
+PriceFlds=['PreviousPrice','BidLimitSize','BidLimitPrice',
+           'OfferLimitPrice','OfferLimitSize',
+           'BidMarketSize','OfferMarketSize',
+           'PreviousQuantity','Size','Price','Quantity',
+           'TotalExecutedQuantity','TotalHiddenExecutedQuantity',
+           'DeletedOrderQuantity','ExecutedSize']
+
+# compiled once per message type: the per-message work in decode() is a
+# table lookup on the MessageType byte plus unpack_from on the block buffer
+Decoder=namedtuple('Decoder',['name','tag','struct','unpack_from','fields',
+                              'instrument','timestamp','prices'])
+
+def compile_decoder(tag,name):
+    Class=getattr(serializer,name)()
+    fields=tuple(f['name'] for f in Class.fields)
+    s=Struct(Class.format)
+    return Decoder(name,tag,s,s.unpack_from,fields,
+                   fields.index('Instrument') if 'Instrument' in fields else None,
+                   fields.index('Timestamp') if 'Timestamp' in fields else None,
+                   tuple(i for i,f in enumerate(fields) if f in PriceFlds))
+
+Decoders={ord(tag):compile_decoder(tag,name) for tag,name in MsgTypes.items()
+          if hasattr(serializer,name)}
+
+def read_block(x,sequencer=None,msgfilter=None):
     m=msg()
-    try:
-        m.UDPHeader={name:str(getattr(x[UDP],name)) for name in TCP_field_names}
-        m.IPHeader={name:str(getattr(x[IP],name)) for name in IP_field_names}
-        m.IPHeader['time']=float(x.time)
+    if type(x) is UDPPacket:
+        m.UDPHeader={'sport':str(x.sport),'dport':str(x.dport),
+                     'len':str(len(x.load)+8),'chksum':str(x.chksum)}
+        m.IPHeader={'len':str(x.len),'src':x.src,'dst':x.dst,'time':x.time}
         x=x.load
-    except:
-        pass
+    else:
+        try:
+            m.UDPHeader={name:str(getattr(x[UDP],name)) for name in TCP_field_names}
+            m.IPHeader={name:str(getattr(x[IP],name)) for name in IP_field_names}
+            m.IPHeader['time']=float(x.time)
+            x=x.load
+        except:
+            pass
     
     m.BlockLength=int.from_bytes(x[0:2],byteorder='little')
     m.MessageCount =int.from_bytes(x[2:3],byteorder='little')
     m.MarketDataGroup=chr(int.from_bytes(x[3:4],byteorder='little'))
     m.SequenceNumber=int.from_bytes(x[4:8],byteorder='little')
+    m.Block=x
     
     firstbytes=8
-    l=[]
+    mask=-1
+    time=m.IPHeader['time'] if hasattr(m,'IPHeader') else None
+    if sequencer is not None:
+        # only sequence numbers not already delivered from another line
+        mask=sequencer.accept(m.MarketDataGroup,m.SequenceNumber,m.MessageCount,time or 0.0)
+        if not mask:
+            return
+    if msgfilter is not None and not msgfilter.accept_block(x,time):
+        return
     
     for j in range(m.MessageCount):
+        if not (mask>>j)&1 or (msgfilter is not None and not msgfilter.accept(x,firstbytes)):
+            firstbytes=firstbytes+(x[firstbytes]|(x[firstbytes+1]<<8))
+            continue
         m.i=j
-        m.MsgLength=int.from_bytes(x[firstbytes:firstbytes+2], byteorder='little')
-        m.Payload=x[firstbytes:firstbytes+m.MsgLength]
-        m.MsgType=chr(int.from_bytes(m.Payload[2:3],byteorder='little'))
+        m.Offset=firstbytes
+        m.MsgLength=x[firstbytes]|(x[firstbytes+1]<<8)
+        m.MsgTypeByte=x[firstbytes+2]
+        m.MsgType=chr(m.MsgTypeByte)
         m.SequenceMsg=m.SequenceNumber+j
         firstbytes=firstbytes+m.MsgLength        
         yield m    
         
-def parse_gtp(pk):
+def parse_gtp(pk,sink=None,sequencer=None,msgfilter=None):
     data=None
-    if pk.getlayer('UDP'):
+    p=profiling.profiler
+    if p is not None:
+        p.begin()
+    if type(pk) is UDPPacket or pk.getlayer('UDP'):
         if pk.load:
             try:
-                decode(pk)
+                decode(pk,sink,sequencer,msgfilter)
             except Exception as e:
 #                 raise e
                 pk.show()
                 print('exception parse_gtp',e)
+    if p is not None:
+        p.end()
 
-def decode(x):
-    for m in read_block(x):
+def decode(x,sink=None,sequencer=None,msgfilter=None):
+    p=profiling.profiler
+    if p is not None:
+        if not p.active:
+            p=None
+        else:
+            t=profiling.perf_counter_ns()
+    for m in read_block(x,sequencer,msgfilter):
         if m.MsgType:
-            m.MsgTypeName=MsgTypes[m.MsgType]
-            Class=globals()[MsgTypes[m.MsgType]]() #calls class function
-            m.classname=MsgTypes[m.MsgType]
+            d=Decoders[m.MsgTypeByte]
+            m.MsgTypeName=d.name
+            m.classname=d.name
+            if p is not None:
+                t=p.lap('block',d.name,t)
 
-            val=list(struct.unpack(Class.format,m.Payload))
-
-            fld=[n['name'] for n in Class.fields]
-            Message=dict(zip(fld,val))
+            val=d.unpack_from(m.Block,m.Offset)
+            Message=dict(zip(d.fields,val))
             m.data=Message
-            m.data['InstrumentLong']=Message.get('Instrument',None)
-            m.data['Instrument']=lse_bin_symbol(Message.get('Instrument',None))
+            if p is not None:
+                t=p.lap('unpack',d.name,t)
+            if d.instrument is None:
+                Message['InstrumentLong']=None
+                Message['Instrument']=0
+            else:
+                Message['InstrumentLong']=val[d.instrument]
+                Message['Instrument']=lse_bin_symbol(val[d.instrument])
             
-            m.data['EventName']=m.IPHeader['time']
-            m.data['src']=m.IPHeader['src']
-            m.data['dst']=m.IPHeader['dst']
-            m.data['len']=m.IPHeader['len']
+            Message['EventName']=m.IPHeader['time']
+            Message['src']=m.IPHeader['src']
+            Message['dst']=m.IPHeader['dst']
+            Message['len']=m.IPHeader['len']
             
-            m.data['MsgTypeName']=MsgTypes[m.MsgType]
-            m.data['Sequence']=m.SequenceMsg
-            m.data['MarketDataGroup']=m.MarketDataGroup
+            Message['MsgTypeName']=d.name
+            Message['Sequence']=m.SequenceMsg
+            Message['MarketDataGroup']=m.MarketDataGroup
+            if p is not None:
+                t=p.lap('fields',d.name,t)
             
-            if m.data.get('Timestamp'):m.data['Timestamp']=m.data['Timestamp']/10**9
+            if d.timestamp is not None and val[d.timestamp]:
+                Message['Timestamp']=val[d.timestamp]/10**9
          
-            PriceFlds=['PreviousPrice','BidLimitSize','BidLimitPrice',
-                       'OfferLimitPrice','OfferLimitSize',
-                       'BidMarketSize','OfferMarketSize',
-                       'PreviousQuantity','Size','Price','Quantity',
-                       'TotalExecutedQuantity','TotalHiddenExecutedQuantity',
-                       'DeletedOrderQuantity','ExecutedSize']
-            
-            for fld in PriceFlds:
-                if m.data.get(fld):m.data[fld]=m.data[fld]/10**8
+            for i in d.prices:
+                if val[i]:Message[d.fields[i]]=val[i]/10**8
             
             try:
-                tm=m.data.get('Timestamp',None)
-                m.data['latency']=m.IPHeader['time']-float(tm) 
+                tm=Message.get('Timestamp',None)
+                Message['latency']=m.IPHeader['time']-float(tm) 
             except: 
                 pass 
+            if p is not None:
+                t=p.lap('scale',d.name,t)
             
 #             m.IPHeader['time']
             
 #             m.print_market_data()
-            m.print()
+            if sink is None:
+                m.print()
+            else:
+                sink.add(d.name,Message)
+            if p is not None:
+                t=p.lap('output',d.name,t)
             
         else:print("heartbeat")
 
-# path=sys.argv[1]
 seq_num=0
 
-# path="c:\\Dev\\lse_gatelab.pcap"
-path=r'c:\Dev\lse_all_G_1_udp_20200828_tshark_00020_20200828153002.pcap'
-sniff(offline=path, store=False, prn=parse_gtp, count=100)
-# sniff(iface='etg',store=False, prn=parse_gtp, filter='udp and host 194.169.4.55')   
+def read_capture(path,count=0,use_scapy=False,sink=None,sequencer=None,msgfilter=None):
+    if use_scapy or not is_capture(path):
+        if sniff is None:
+            raise Exception("scapy is required to read [" + path + "]")
+        sniff(offline=path, store=False, prn=partial(parse_gtp,sink=sink,sequencer=sequencer,msgfilter=msgfilter), count=count)
+        return
+    with PcapReader(path) as reader:
+        for n,pk in enumerate(reader,1):
+            parse_gtp(pk,sink,sequencer,msgfilter)
+            if n==count:
+                break
+
+def read_live(groups,iface='0.0.0.0',count=0,sink=None,sequencer=None,msgfilter=None):
+    from udp_receiver import MulticastReceiver
+    n=0
+    with MulticastReceiver(groups,iface) as receiver:
+        try:
+            while True:
+                for pk in receiver.receive():
+                    parse_gtp(pk,sink,sequencer,msgfilter)
+                    n+=1
+                    if n==count:
+                        return
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if receiver.truncated:
+                sys.stderr.write(json.dumps({'Truncated':receiver.truncated})+'\n')
+
+def main(argv=None):
+    parser=argparse.ArgumentParser(description='Decode LSE GTP market data from pcap/pcapng captures')
+    parser.add_argument('path',nargs='?',help='capture file (or directory of captures with --jobs)')
+    parser.add_argument('--live',metavar='GROUP:PORT[,...]',
+                        help='receive from UDP multicast groups instead of reading a capture')
+    parser.add_argument('--iface',default='0.0.0.0',help='local interface address for --live')
+    parser.add_argument('--count',type=int,default=0,help='stop after this many packets')
+    parser.add_argument('--scapy',action='store_true',help='dissect packets with scapy instead of the native reader')
+    parser.add_argument('--batch',type=int,default=0,metavar='N',
+                        help='decode into numpy column batches of about N messages')
+    parser.add_argument('--output',metavar='DIR',help='write one columnar file per message type into DIR (numbered part files per checkpoint with --checkpoint/--snapshot)')
+    parser.add_argument('--format',choices=['parquet','arrow','npz'],
+                        help='columnar output format (default parquet, npz without pyarrow)')
+    parser.add_argument('--row-group',type=int,default=100000,help='rows per written row group')
+    parser.add_argument('--books',type=int,default=0,metavar='DEPTH',
+                        help='build order books and print their final DEPTH level snapshots')
+    parser.add_argument('--conflate',type=float,default=0,metavar='SECS',
+                        help='print conflated best bid/offer per instrument every SECS of capture time instead of messages (from TopOfBook, and from the books with --books)')
+    parser.add_argument('--conflate-updates',type=int,default=0,metavar='N',
+                        help='also publish after N updates')
+    parser.add_argument('--bars',type=float,default=0,metavar='SECS',
+                        help='aggregate Trade/TradeCross into OHLCV/VWAP bars per instrument every SECS of Timestamp, printed instead of messages (or written to --output as Bar)')
+    parser.add_argument('--volume-bars',type=float,default=0,metavar='QTY',
+                        help='also aggregate bars every QTY traded per instrument (VolumeBar)')
+    parser.add_argument('--latency',type=float,default=0,metavar='SECS',
+                        help='keep latency histograms per message type and group, report them on stderr every SECS of capture time')
+    parser.add_argument('--latency-window',type=float,default=60.0,metavar='SECS',
+                        help='rolling window of the --latency reports')
+    parser.add_argument('--profile',type=int,default=0,metavar='N',
+                        help='time the decode stages of every Nth packet, report on stderr at exit (and on SIGUSR1)')
+    parser.add_argument('--types',help='comma separated message types to decode (MsgTypeName or type character)')
+    parser.add_argument('--instrument',help='comma separated instrument symbols to decode')
+    parser.add_argument('--group',help='comma separated MarketDataGroups to decode')
+    parser.add_argument('--start',help='skip packets captured before this time (epoch seconds or ISO, UTC)')
+    parser.add_argument('--end',help='skip packets captured at or after this time')
+    parser.add_argument('--instruments',metavar='FILE',
+                        help='instrument reference cache, loaded at start and saved at exit')
+    parser.add_argument('--isin',help='comma separated ISINs to keep')
+    parser.add_argument('--currency',help='comma separated currencies to keep')
+    parser.add_argument('--arbitrate',action='store_true',
+                        help='deliver each sequence number once across A/B lines and report gaps on stderr')
+    parser.add_argument('--pipeline',action='store_true',
+                        help='run source, decoder and sinks as asyncio stages with bounded queues')
+    parser.add_argument('--tcp',metavar='HOST:PORT',help='also stream JSON lines to a TCP consumer (--pipeline)')
+    parser.add_argument('--queue-size',type=int,default=64,help='batches buffered between pipeline stages')
+    parser.add_argument('--pipeline-batch',type=int,default=256,help='packets/messages per pipeline batch')
+    parser.add_argument('--metrics',type=float,default=0,metavar='SECS',
+                        help='report pipeline queue depths on stderr every SECS')
+    parser.add_argument('--session',action='store_true',
+                        help='decode a directory or glob of rotated captures as one stream, prefetching the next file')
+    parser.add_argument('--checkpoint',metavar='FILE',
+                        help='record the session position in FILE and resume from it if it exists (implies --session)')
+    parser.add_argument('--snapshot',metavar='FILE',
+                        help='save order books, instrument cache, latest statistics and the session position to FILE at every checkpoint, and restore from it if it exists (implies --session)')
+    parser.add_argument('--checkpoint-every',type=int,default=100000,metavar='N',
+                        help='packets between checkpoints')
+    parser.add_argument('--jobs',type=int,default=0,help='decode in N worker processes')
+    parser.add_argument('--chunk-size',type=int,default=256,metavar='MB',
+                        help='byte range of a capture handed to one worker')
+    parser.add_argument('--json-out',metavar='DEST',
+                        help='write the JSON lines to a file or named pipe, or tcp:HOST:PORT, instead of stdout')
+    parser.add_argument('--json-fields',metavar='LIST',
+                        help='comma separated enrichment fields to include (InstrumentLong,EventName,src,dst,len,MsgTypeName,Sequence,MarketDataGroup,latency; default all, empty for none)')
+    parser.add_argument('--json-buffer',type=int,default=1024,metavar='KB',
+                        help='JSON output buffered between writes')
+    parser.add_argument('--orjson',action='store_true',help='encode JSON with orjson (compact)')
+    parser.add_argument('--read-ahead',type=int,default=32,metavar='MB',
+                        help='decompressed data buffered ahead of the decoder for .gz/.zst captures')
+    args=parser.parse_args(argv)
+
+    if not args.path and not args.live:
+        parser.error('a capture path or --live is required')
+    if args.live and (args.jobs or args.batch):
+        parser.error('--live decodes per message and cannot be used with --jobs or --batch')
+    select=args.instruments or args.isin or args.currency
+    if select and (args.jobs or args.batch):
+        parser.error('--instruments/--isin/--currency apply to per-message decoding only')
+    if args.arbitrate and args.jobs:
+        parser.error('--arbitrate needs a single ordered stream and cannot be used with --jobs')
+    if (args.books or args.conflate) and (args.jobs or args.batch):
+        parser.error('--books/--conflate need per-message decoding and cannot be used with --jobs or --batch')
+    if (args.pipeline or args.tcp) and (args.jobs or args.batch):
+        parser.error('--pipeline/--tcp decode per message and cannot be used with --jobs or --batch')
+    if args.tcp and not args.pipeline:
+        parser.error('--tcp needs --pipeline')
+    if args.checkpoint or args.snapshot:
+        args.session=True
+    if args.session and (args.live or args.jobs):
+        parser.error('--session reads capture files in order and cannot be used with --live or --jobs')
+    if (args.checkpoint or args.snapshot) and (args.batch or args.pipeline):
+        parser.error('--checkpoint/--snapshot need per message decoding without --batch or --pipeline')
+    if args.checkpoint and not args.snapshot and (args.books or select):
+        # a checkpoint carries bars, conflation and latency state, the books
+        # and instrument cache only go into a snapshot
+        parser.error('--books/--instruments/--isin/--currency need --snapshot to resume')
+    if args.profile and (args.jobs or args.batch):
+        parser.error('--profile times per message decoding and cannot be used with --jobs or --batch')
+
+    pcap_reader.READ_AHEAD=args.read_ahead*2**20
+
+    if args.profile:
+        profiler=profiling.enable(args.profile)
+        if hasattr(signal,'SIGUSR1'):
+            signal.signal(signal.SIGUSR1,lambda signum,frame:profiler.dump())
+
+    from filters import filter_from_args
+    msgfilter=filter_from_args(args)
+
+    sequencer=None
+    if args.arbitrate:
+        from sequencer import Sequencer, print_gap
+        sequencer=Sequencer()
+        sequencer.on_gap(print_gap)
+
+    from jsonl import JsonLinesSink, open_output
+    fields=args.json_fields.split(',') if args.json_fields else [] if args.json_fields is not None else None
+    # the JSON lines output, also behind the sinks that print
+    # a resumed session keeps what it wrote before the checkpoint
+    resume=any(f and os.path.exists(f) for f in (args.checkpoint,args.snapshot))
+    printer=JsonLinesSink(open_output(args.json_out,resume),fields,args.json_buffer*1024,args.orjson)
+
+    sinks=[]
+    books=None
+    if args.books:
+        from order_book import OrderBooks
+        books=OrderBooks()
+        sinks.append(books)
+    conflator=None
+    if args.conflate:
+        from conflate import Conflator
+        conflator=Conflator(printer,args.conflate,args.conflate_updates)
+        if books is not None:
+            conflator.attach(books)
+        sinks.append(conflator)
+    if args.latency:
+        from latency import LatencyMonitor
+        monitor=LatencyMonitor(args.latency,max(1,int(round(args.latency_window/args.latency))),sys.stderr)
+        sinks.append(monitor)
+    output=None
+    if args.output:
+        from sinks import open_sink
+        output=open_sink(args.output,args.format,args.row_group,parts=bool(args.checkpoint or args.snapshot))
+    bars=None
+    if args.bars or args.volume_bars:
+        # ahead of the output so that the bars still open at the end reach it
+        from bars import BarAggregator, BarAggregators
+        aggregators=[]
+        if args.bars:
+            aggregators.append(BarAggregator(output or printer,args.bars))
+        if args.volume_bars:
+            aggregators.append(BarAggregator(output or printer,volume=args.volume_bars))
+        bars=aggregators[0] if len(aggregators)==1 else BarAggregators(aggregators)
+        sinks.append(bars)
+    if output is not None:
+        sinks.append(output)
+    if args.tcp:
+        from pipeline import SocketSink
+        host,port=args.tcp.rsplit(':',1)
+        from jsonl import JsonEncoder
+        sinks.append(SocketSink(host,int(port),JsonEncoder(fields,args.orjson)))
+    statistics=None
+    if args.snapshot:
+        # tracked alongside whatever the output is, stdout by default
+        from snapshot import LatestStatistics
+        statistics=LatestStatistics()
+        if not sinks:
+            sinks.append(printer)
+        sinks.append(statistics)
+    cache=None
+    if select:
+        from instruments import InstrumentCache
+        cache=InstrumentCache(None,
+                              args.isin.split(',') if args.isin else None,
+                              args.currency.split(',') if args.currency else None)
+        if args.instruments and os.path.exists(args.instruments):
+            cache.load(args.instruments)
+
+    if args.pipeline:
+        from pipeline import run_pipeline
+        # every pipeline sink runs on its own thread: sinks that feed each
+        # other (books into the conflator, bars into the output or the
+        # printer the conflator writes to) run as one
+        coupled=[s for s in sinks if s is books or s is conflator or s is bars
+                 or (bars is not None and s is output)]
+        if len(coupled)>1:
+            first=sinks.index(coupled[0])
+            sinks=[s for s in sinks if not any(s is c for c in coupled)]
+            sinks.insert(first,Tee(coupled))
+        if args.live:
+            from udp_receiver import MulticastReceiver, parse_groups
+            source=MulticastReceiver(parse_groups(args.live),args.iface)
+        elif args.session:
+            from session import Session, session_files
+            source=Session(session_files(args.path))
+        else:
+            source=PcapReader(args.path)
+        try:
+            run_pipeline(source,sinks or [printer],
+                         enrichers=[cache.process] if cache else [],sequencer=sequencer,msgfilter=msgfilter,
+                         queue_size=args.queue_size,batch_size=args.pipeline_batch,
+                         report_interval=args.metrics)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if hasattr(source,'close'):
+                source.close()
+        sink=None
+    else:
+        sink=None if not sinks else sinks[0] if len(sinks)==1 else Tee(sinks)
+        if cache is not None:
+            cache.downstream=sink if sink is not None else printer
+            sink=cache
+        elif sink is None and not args.batch:
+            sink=printer
+    try:
+        if args.pipeline:
+            pass
+        elif args.jobs:
+            from parallel import decode_parallel
+            decode_parallel(args.path,args.jobs,args.chunk_size*2**20,args.batch,
+                            None if sink is printer else sink,printer,msgfilter=msgfilter)
+        elif args.batch:
+            from batch_decode import decode_capture, decode_batches
+            if args.session:
+                from session import Session, session_files
+                batches=decode_batches(Session(session_files(args.path)),args.batch,sequencer,msgfilter)
+            else:
+                batches=decode_capture(args.path,args.batch,sequencer,msgfilter)
+            for columns in batches:
+                if sink is None:
+                    print(json.dumps({name:len(a) for name,a in columns.items()}))
+                else:
+                    sink.write_batch(columns)
+        elif args.live:
+            from udp_receiver import parse_groups
+            read_live(parse_groups(args.live),args.iface,args.count,sink,sequencer,msgfilter)
+        elif args.session:
+            from session import Session, session_files
+            session=Session(session_files(args.path),args.checkpoint,sequencer,args.checkpoint_every,sinks+[printer])
+            if args.snapshot:
+                from snapshot import Snapshotter
+                Snapshotter(args.snapshot,books,cache,statistics).attach(session)
+            for n,pk in enumerate(session,1):
+                parse_gtp(pk,sink,sequencer,msgfilter)
+                if n==args.count:
+                    break
+        else:
+            read_capture(args.path,args.count,args.scapy,sink,sequencer,msgfilter)
+    finally:
+        if hasattr(sink,'close'):
+            sink.close()
+        printer.close()
+    if select and args.instruments:
+        cache.save(args.instruments)
+    if sequencer is not None:
+        for gap in sequencer.open_gaps():
+            print_gap(gap)
+        sys.stderr.write(json.dumps(sequencer.stats())+'\n')
+    if conflator is not None:
+        sys.stderr.write(json.dumps(conflator.stats())+'\n')
+    if args.profile:
+        profiling.disable().dump()
+    if args.latency:
+        monitor.dump(sys.stdout,lifetime=True)
+    if args.books:
+        for snapshot in books.snapshots(args.books):
+            print(json.dumps(snapshot))
+
+if __name__=='__main__':
+    main()
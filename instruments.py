@@ -0,0 +1,111 @@
+import os
+import json
+
+# InstrumentDirectory fields kept as reference data, bytes decoded and
+# stripped of their null/space padding
+REFERENCE_FIELDS = ['ISIN', 'Currency', 'TickID', 'GroupID', 'SourceVenue',
+                    'VenueInstrumentID', 'UnderlyingISINCode', 'AllowedBookTypes',
+                    'AverageDailyTurnover', 'Flags']
+ENRICH_FIELDS = ['ISIN', 'Currency']
+
+
+def text(value):
+    if type(value) is bytes:
+        return value.rstrip(b'\x00 ').decode('utf-8', 'replace')
+    return value
+
+
+class InstrumentCache():
+    # reference data keyed by Instrument symbol, fed from InstrumentDirectory
+    # ('p') messages. Used as a decode() sink it enriches every message with
+    # ISIN/Currency, optionally drops instruments outside the isins/currencies
+    # selection and forwards the rest to `downstream`
+    def __init__(self, downstream=None, isins=None, currencies=None, enrich=True):
+        self.instruments = {}
+        self.by_isin = {}
+        self.downstream = downstream
+        self.isins = set(isins) if isins else None
+        self.currencies = set(currencies) if currencies else None
+        self.enrich = enrich
+        self.selected = set()
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self.instruments)
+
+    def __contains__(self, instrument):
+        return instrument in self.instruments
+
+    def get(self, instrument):
+        return self.instruments.get(instrument)
+
+    def lookup_isin(self, isin):
+        return self.by_isin.get(isin)
+
+    def filtering(self):
+        return self.isins is not None or self.currencies is not None
+
+    def matches(self, ref):
+        return (self.isins is None or ref['ISIN'] in self.isins) and \
+               (self.currencies is None or ref['Currency'] in self.currencies)
+
+    def update(self, instrument, ref):
+        self.instruments[instrument] = ref
+        self.by_isin[ref['ISIN']] = instrument
+        if self.matches(ref):
+            self.selected.add(instrument)
+        else:
+            self.selected.discard(instrument)
+
+    def ingest(self, data):
+        ref = {f: text(data[f]) for f in REFERENCE_FIELDS}
+        ref['Timestamp'] = data.get('Timestamp')
+        self.update(data['Instrument'], ref)
+
+    def process(self, name, data):
+        # enriches one message; None when the selection filters it out
+        if name == 'InstrumentDirectory':
+            self.ingest(data)
+        instrument = data.get('Instrument')
+        if instrument:
+            if self.filtering() and instrument not in self.selected:
+                self.dropped += 1
+                return None
+            if self.enrich:
+                ref = self.instruments.get(instrument)
+                for f in ENRICH_FIELDS:
+                    data[f] = ref[f] if ref else None
+        return data
+
+    def add(self, name, data):
+        data = self.process(name, data)
+        if data is not None and self.downstream is not None:
+            self.downstream.add(name, data)
+
+    def close(self):
+        if self.downstream is not None and hasattr(self.downstream, 'close'):
+            self.downstream.close()
+
+    def save(self, path):
+        # one JSON object per line so the file can be inspected and appended to
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            for instrument, ref in self.instruments.items():
+                f.write(json.dumps(dict(ref, Instrument=instrument)) + '\n')
+        os.replace(tmp, path)
+
+    def state(self):
+        return {'instruments': dict(self.instruments), 'dropped': self.dropped}
+
+    def restore(self, state):
+        for instrument, ref in state['instruments'].items():
+            self.update(instrument, ref)
+        self.dropped = state['dropped']
+        return self
+
+    def load(self, path):
+        with open(path) as f:
+            for line in f:
+                ref = json.loads(line)
+                self.update(ref.pop('Instrument'), ref)
+        return self
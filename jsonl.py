@@ -0,0 +1,214 @@
+import io
+import os
+import sys
+import json
+import socket
+from math import isfinite
+from operator import itemgetter
+from json.encoder import encode_basestring_ascii
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# the fields decode() adds to the wire fields of every message
+ENRICHMENT = ['InstrumentLong', 'EventName', 'src', 'dst', 'len', 'MsgTypeName',
+              'Sequence', 'MarketDataGroup', 'latency']
+BUFFER = 2**20
+
+# JSON text of the values that are not numbers, as json.dumps writes them;
+# bytes as decoded text
+ENCODERS = {
+    str: encode_basestring_ascii,
+    bytes: lambda v: encode_basestring_ascii(v.decode('utf-8')),
+    bool: lambda v: 'true' if v else 'false',
+    type(None): lambda v: 'null',
+}
+
+
+def orjson_default(v):
+    if type(v) is bytes:
+        return v.decode('utf-8')
+    raise TypeError
+
+
+class Template():
+    # the keys of one message shape, fetched together by an itemgetter, and
+    # per combination of value types a format string with the '{"Key": '
+    # prefixes encoded once. Numbers are formatted with %r, which is how
+    # json.dumps writes ints and finite floats, the rest through ENCODERS.
+    # A message of `size` keys that has all of them is formatted by one %;
+    # one with a NaN or infinite float is left to json.dumps
+    def __init__(self, keys, size):
+        self.keys = keys
+        self.size = size
+        self.get = itemgetter(*keys)
+        self.formats = {}
+
+    def format(self, types):
+        parts = []
+        strings = []
+        floats = []
+        for i, (k, t) in enumerate(zip(self.keys, types)):
+            prefix = ((', ' if i else '{') + encode_basestring_ascii(k) + ': ').replace('%', '%%')
+            if t is int or t is float:
+                parts.append(prefix + '%r')
+                if t is float:
+                    floats.append(i)
+            elif t in ENCODERS:
+                parts.append(prefix + '%s')
+                strings.append((i, ENCODERS[t]))
+            else:
+                return None
+        return (''.join(parts) + '}\n', strings, floats)
+
+    def encode(self, data):
+        # None if data does not fit the template
+        try:
+            values = self.get(data)
+        except KeyError:
+            return None
+        types = tuple(map(type, values))
+        try:
+            f = self.formats[types]
+        except KeyError:
+            f = self.formats[types] = self.format(types)
+        if f is None:
+            return None
+        fmt, strings, floats = f
+        for i in floats:
+            if not isfinite(values[i]):
+                return None
+        if strings:
+            values = list(values)
+            for i, enc in strings:
+                values[i] = enc(values[i])
+            values = tuple(values)
+        return fmt % values
+
+
+class JsonEncoder():
+    # decode() message dicts as JSON lines, the same text to_json() gives,
+    # from a Template per MsgTypeName, or with orjson (compact separators,
+    # UTF-8 instead of \u escapes). Enrichment fields not in `fields` are
+    # left out; fields=None keeps them all
+    def __init__(self, fields=None, use_orjson=False):
+        if use_orjson and orjson is None:
+            raise Exception('orjson is required for --orjson')
+        self.use_orjson = use_orjson
+        self.fields = fields
+        self.dropped = frozenset(ENRICHMENT) - frozenset(fields) if fields is not None else frozenset()
+        self.templates = {}
+
+    def generic(self, data):
+        return json.dumps({k: v.decode('utf-8') if type(v) is bytes else v
+                           for k, v in data.items() if k not in self.dropped}) + '\n'
+
+    def line(self, name, data):
+        # str, or bytes with orjson
+        if self.use_orjson:
+            if self.dropped:
+                data = {k: v for k, v in data.items() if k not in self.dropped}
+            return orjson.dumps(data, default=orjson_default, option=orjson.OPT_APPEND_NEWLINE)
+        t = self.templates.get(name)
+        if t is None:
+            keys = [k for k in data if k not in self.dropped]
+            t = self.templates[name] = Template(keys, len(data)) if len(keys) > 1 else None
+        if t is not None and len(data) == t.size:
+            s = t.encode(data)
+            if s is not None:
+                return s
+        return self.generic(data)
+
+    def encode(self, batch):
+        # bytes of the lines of a list of (name, data)
+        lines = [self.line(name, data) for name, data in batch]
+        return b''.join(lines) if self.use_orjson else ''.join(lines).encode('utf-8')
+
+
+def open_output(spec, append=False):
+    # '-' (or None) for stdout, tcp:HOST:PORT for a TCP consumer, otherwise
+    # a file or named pipe. With `append` an existing file is kept, for a
+    # resumed session to seek back to its checkpoint position
+    if spec in (None, '-'):
+        return sys.stdout
+    if spec.startswith('tcp:'):
+        host, port = spec[4:].rsplit(':', 1)
+        sock = socket.create_connection((host, int(port)))
+        f = sock.makefile('wb')
+        sock.close()  # the connection closes with f
+        return f
+    if append and os.path.isfile(spec):
+        f = open(spec, 'r+b')
+        f.seek(0, os.SEEK_END)
+        return f
+    return open(spec, 'wb')
+
+
+class JsonLinesSink():
+    # decode() sink writing JSON lines to a text or binary stream (stdout by
+    # default) in writes of about `buffer_size` bytes instead of one print()
+    # per message. Streams other than stdout/stderr are closed with the sink
+    def __init__(self, out=None, fields=None, buffer_size=BUFFER, use_orjson=False):
+        self.out = sys.stdout if out is None else out
+        self.encoder = JsonEncoder(fields, use_orjson)
+        self.buffer_size = buffer_size
+        self.text = isinstance(self.out, io.TextIOBase)
+        self.lines = []
+        self.size = 0
+        self.messages = 0
+        self.closed = False
+
+    def add(self, name, data):
+        line = self.encoder.line(name, data)
+        self.lines.append(line)
+        self.size += len(line)
+        self.messages += 1
+        if self.size >= self.buffer_size:
+            self.flush()
+
+    def write(self, data):
+        out = self.out
+        if self.text and type(data) is bytes:
+            if hasattr(out, 'buffer'):
+                out.flush()
+                out.buffer.write(data)
+            else:
+                out.write(data.decode('utf-8'))
+        elif not self.text and type(data) is str:
+            out.write(data.encode('utf-8'))
+        else:
+            out.write(data)
+
+    def flush(self):
+        if self.lines:
+            self.write(b''.join(self.lines) if self.encoder.use_orjson else ''.join(self.lines))
+            self.lines = []
+            self.size = 0
+        self.out.flush()
+
+    def position(self):
+        # after flush(), at a checkpoint: the size of a file output, None for
+        # stdout, pipes and sockets, which a resume cannot cut back
+        if self.out in (sys.stdout, sys.stderr):
+            return None
+        try:
+            return self.out.tell() if self.out.seekable() else None
+        except (AttributeError, OSError, ValueError):
+            return None
+
+    def seek(self, position):
+        # on a resume: drops the lines written after the checkpoint
+        if self.out.seek(0, os.SEEK_END) < position:
+            raise Exception('Output is shorter than its checkpoint position [' + str(self.out.name) + ']')
+        self.out.seek(position)
+        self.out.truncate()
+
+    def close(self):
+        if self.closed:
+            return
+        self.flush()
+        self.closed = True
+        if self.out not in (sys.stdout, sys.stderr):
+            self.out.close()
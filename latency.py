@@ -0,0 +1,248 @@
+import sys
+import json
+from collections import deque
+
+# log-linear buckets: exact below 2**SUB_BITS ns, then 2**(SUB_BITS-1)
+# buckets per power of two, i.e. under 1% relative error at any magnitude
+SUB_BITS = 8
+HALF = 1 << (SUB_BITS - 1)
+PERCENTILES = (('p50', 0.5), ('p99', 0.99), ('p99.9', 0.999))
+
+
+def bucket(ns):
+    shift = ns.bit_length() - SUB_BITS
+    if shift < 0:
+        shift = 0
+    return shift * HALF + (ns >> shift)
+
+
+def bucket_high(i):
+    # the highest value counted in bucket i
+    if i < 2 * HALF:
+        return i
+    shift = i // HALF - 1
+    return ((i - shift * HALF + 1) << shift) - 1
+
+
+class Histogram():
+    # fixed bucket latency histogram over integer nanoseconds; counts are
+    # kept sparse by bucket index. Negative latencies (capture clock behind
+    # the exchange) count as 0 and are tallied in `negative`
+    __slots__ = ('counts', 'count', 'total', 'min', 'max', 'negative')
+
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+        self.negative = 0
+
+    def record(self, ns):
+        if ns < 0:
+            self.negative += 1
+            ns = 0
+        i = bucket(ns)
+        counts = self.counts
+        counts[i] = counts.get(i, 0) + 1
+        self.count += 1
+        self.total += ns
+        if self.max is None or ns > self.max:
+            self.max = ns
+        if self.min is None or ns < self.min:
+            self.min = ns
+
+    def record_many(self, ns):
+        # ns is a numpy integer array
+        import numpy as np
+        if not len(ns):
+            return
+        negative = ns < 0
+        self.negative += int(negative.sum())
+        ns = np.where(negative, 0, ns).astype(np.int64)
+        shift = np.maximum(np.frexp(ns.astype(np.float64))[1] - SUB_BITS, 0)
+        index, n = np.unique(shift * HALF + (ns >> shift), return_counts=True)
+        counts = self.counts
+        for i, c in zip(index.tolist(), n.tolist()):
+            counts[i] = counts.get(i, 0) + c
+        self.count += len(ns)
+        self.total += int(ns.sum())
+        low, high = int(ns.min()), int(ns.max())
+        if self.max is None or high > self.max:
+            self.max = high
+        if self.min is None or low < self.min:
+            self.min = low
+
+    def state(self):
+        # JSON-able, for restore()
+        return [list(self.counts.items()), self.count, self.total, self.min, self.max, self.negative]
+
+    def restore(self, state):
+        counts, self.count, self.total, self.min, self.max, self.negative = state
+        self.counts = dict(counts)
+        return self
+
+    def merge(self, other):
+        counts = self.counts
+        for i, c in other.counts.items():
+            counts[i] = counts.get(i, 0) + c
+        self.count += other.count
+        self.total += other.total
+        self.negative += other.negative
+        if other.count:
+            self.max = other.max if self.max is None else max(self.max, other.max)
+            self.min = other.min if self.min is None else min(self.min, other.min)
+        return self
+
+    def percentile(self, p):
+        if not self.count:
+            return None
+        rank = p * self.count
+        seen = 0
+        for i in sorted(self.counts):
+            seen += self.counts[i]
+            if seen >= rank:
+                return min(bucket_high(i), self.max)
+        return self.max
+
+    def summary(self):
+        # seconds, like decode()'s latency field
+        s = {'count': self.count, 'negative': self.negative,
+             'min': None if self.min is None else self.min / 10**9,
+             'mean': self.total / self.count / 10**9 if self.count else None}
+        for name, p in PERCENTILES:
+            v = self.percentile(p)
+            s[name] = None if v is None else v / 10**9
+        s['max'] = None if self.max is None else self.max / 10**9
+        return s
+
+
+class LatencyMonitor():
+    # sink recording decode()'s latency into a Histogram per (MsgTypeName,
+    # MarketDataGroup). Capture time is cut into slots of `interval` seconds
+    # and the rolling window is the last `slots` of them; older slots are
+    # folded into the lifetime totals. With `out`, the window ending with a
+    # slot is written there as JSON lines when that slot closes
+    def __init__(self, interval=10.0, slots=6, out=None):
+        self.interval = interval
+        self.slots = slots
+        self.out = out
+        self.slot = None
+        self.current = {}
+        self.history = deque()
+        self.lifetime = {}
+
+    def rotate(self, time):
+        self.rotate_to(int(time // self.interval))
+
+    def rotate_to(self, slot):
+        if self.slot is None:
+            self.slot = slot
+        if slot <= self.slot:
+            # late packets are counted in the current slot
+            return
+        if self.out is not None:
+            # history and the closing slot are the last `slots` slots
+            self.dump(self.out)
+        self.history.append((self.slot, self.current))
+        self.current = {}
+        self.slot = slot
+        while self.history and self.history[0][0] <= slot - self.slots:
+            merge_into(self.lifetime, self.history.popleft()[1])
+
+    def position(self):
+        # JSON-able state for a session checkpoint, put back by seek()
+        return {'slot': self.slot, 'current': histograms_state(self.current),
+                'history': [[slot, histograms_state(h)] for slot, h in self.history],
+                'lifetime': histograms_state(self.lifetime)}
+
+    def seek(self, position):
+        self.slot = position['slot']
+        self.current = histograms_restore(position['current'])
+        self.history = deque((slot, histograms_restore(h)) for slot, h in position['history'])
+        self.lifetime = histograms_restore(position['lifetime'])
+
+    def histogram(self, key):
+        h = self.current.get(key)
+        if h is None:
+            h = self.current[key] = Histogram()
+        return h
+
+    def add(self, name, data):
+        latency = data.get('latency')
+        if latency is None:
+            return
+        if data.get('EventName') is not None:
+            self.rotate(data['EventName'])
+        self.histogram((name, data.get('MarketDataGroup'))).record(int(round(latency * 10**9)))
+
+    def write_batch(self, columns):
+        # batch_decode columns: slot by slot over all message types, so that
+        # the window rotates once per slot as it does per message, with one
+        # record_many per type and group in each
+        import numpy as np
+        parts = []
+        for name, a in columns.items():
+            a = a[~np.isnan(a['latency'])]
+            if len(a):
+                slots = (a['EventName'] // self.interval).astype(np.int64)
+                order = np.argsort(slots, kind='stable')
+                parts.append((name, a[order], slots[order]))
+        if not parts:
+            return
+        for slot in np.unique(np.concatenate([slots for name, a, slots in parts])).tolist():
+            self.rotate_to(slot)
+            for name, a, slots in parts:
+                lo, hi = np.searchsorted(slots, (slot, slot + 1))
+                if lo == hi:
+                    continue
+                s = a[lo:hi]
+                for group in np.unique(s['MarketDataGroup']):
+                    g = s[s['MarketDataGroup'] == group]
+                    key = (name, group.decode() if isinstance(group, bytes) else group)
+                    self.histogram(key).record_many(np.rint(g['latency'] * 10**9).astype(np.int64))
+
+    def window(self):
+        # {key: Histogram} over the rolling window
+        out = {}
+        for slot, histograms in self.history:
+            merge_into(out, histograms)
+        return merge_into(out, self.current)
+
+    def totals(self):
+        # {key: Histogram} since the start
+        return merge_into(merge_into({}, self.lifetime), self.window())
+
+    def query(self, name=None, group=None, lifetime=False):
+        # one Histogram over the keys matching MsgTypeName and/or group
+        h = Histogram()
+        for (n, g), v in (self.totals() if lifetime else self.window()).items():
+            if (name is None or n == name) and (group is None or g == group):
+                h.merge(v)
+        return h
+
+    def report(self, lifetime=False):
+        histograms = self.totals() if lifetime else self.window()
+        return [dict({'MsgTypeName': name, 'MarketDataGroup': group}, **histograms[name, group].summary())
+                for name, group in sorted(histograms, key=lambda k: (k[0], k[1] or ''))]
+
+    def dump(self, out=sys.stderr, lifetime=False):
+        for line in self.report(lifetime):
+            out.write(json.dumps(line) + '\n')
+
+
+def histograms_state(histograms):
+    return [[name, group, h.state()] for (name, group), h in histograms.items()]
+
+
+def histograms_restore(state):
+    return {(name, group): Histogram().restore(h) for name, group, h in state}
+
+
+def merge_into(target, histograms):
+    for key, h in histograms.items():
+        t = target.get(key)
+        if t is None:
+            t = target[key] = Histogram()
+        t.merge(h)
+    return target
@@ -0,0 +1,366 @@
+from array import array
+from heapq import heappush, heappop, heapify, nsmallest, nlargest
+
+BID = b'B'
+ASK = b'S'
+
+
+class Levels():
+    # aggregated price levels of one side in parallel arrays of price, size
+    # and order count indexed by a level slot, with a dict from price to
+    # slot, a free list of emptied slots and a heap of the prices (negated
+    # on the bid side) for the best level. A new level is one heappush,
+    # O(log n); an emptied level only gives back its slot and its heap entry
+    # is popped once it reaches the top, so updates are O(log n) amortized
+    # and the best level O(1) amortized. Levels deeper than the best are
+    # sorted on demand by levels()
+    __slots__ = ('sign', 'index', 'prices', 'sizes', 'counts', 'free', 'heap')
+
+    def __init__(self, descending=False):
+        self.sign = -1.0 if descending else 1.0
+        self.index = {}
+        self.prices = array('d')
+        self.sizes = array('d')
+        self.counts = array('I')
+        self.free = array('I')
+        self.heap = []
+
+    def __len__(self):
+        return len(self.index)
+
+    def add(self, price, size):
+        i = self.index.get(price)
+        if i is not None:
+            self.sizes[i] += size
+            self.counts[i] += 1
+            return
+        if self.free:
+            i = self.free.pop()
+            self.prices[i] = price
+            self.sizes[i] = size
+            self.counts[i] = 1
+        else:
+            i = len(self.prices)
+            self.prices.append(price)
+            self.sizes.append(size)
+            self.counts.append(1)
+        self.index[price] = i
+        heappush(self.heap, self.sign * price)
+
+    def remove(self, price, size):
+        i = self.index.get(price)
+        if i is None:
+            return
+        if self.counts[i] <= 1:
+            del self.index[price]
+            self.free.append(i)
+            # entries of removed levels are dropped lazily; rebuild once they
+            # outnumber the live ones
+            if len(self.heap) > 2 * len(self.index) + 64:
+                self.heap = [self.sign * p for p in self.index]
+                heapify(self.heap)
+        else:
+            self.sizes[i] -= size
+            self.counts[i] -= 1
+
+    def resize(self, price, delta):
+        i = self.index.get(price)
+        if i is not None:
+            self.sizes[i] += delta
+
+    def best(self):
+        # (price, size) of the best level, None if the side is empty
+        heap = self.heap
+        index = self.index
+        while heap:
+            price = heap[0] * self.sign
+            i = index.get(price)
+            if i is not None:
+                return price, self.sizes[i]
+            heappop(heap)
+        return None
+
+    def clear(self):
+        self.index.clear()
+        for a in (self.prices, self.sizes, self.counts, self.free):
+            del a[:]
+        del self.heap[:]
+
+    def state(self):
+        # ascending price, size and count arrays
+        slots = [self.index[p] for p in sorted(self.index)]
+        prices = array('d', [self.prices[i] for i in slots])
+        sizes = array('d', [self.sizes[i] for i in slots])
+        counts = array('I', [self.counts[i] for i in slots])
+        return (prices.tobytes(), sizes.tobytes(), counts.tobytes())
+
+    def restore(self, state):
+        self.prices, self.sizes, self.counts = array('d'), array('d'), array('I')
+        self.prices.frombytes(state[0])
+        self.sizes.frombytes(state[1])
+        self.counts.frombytes(state[2])
+        self.free = array('I')
+        self.index = {p: i for i, p in enumerate(self.prices)}
+        self.heap = [self.sign * p for p in self.prices]
+        heapify(self.heap)
+
+    def levels(self, depth, descending):
+        index = self.index
+        prices = (nlargest if descending else nsmallest)(depth, index)
+        return [[p, self.sizes[index[p]], self.counts[index[p]]] for p in prices]
+
+
+class Orders():
+    # resting orders in parallel arrays of OrderID, book number, side (1 for
+    # bids), price and size indexed by an order slot taken from a free list,
+    # with `slots` mapping OrderID to slot. The orders of each book form a
+    # list through the next/prev slot arrays starting at heads[book], so a
+    # book is cleared by walking its own orders. An order costs 37 bytes of
+    # arrays plus its `slots` entry
+    def __init__(self):
+        self.slots = {}
+        self.ids = array('Q')
+        self.book = array('I')
+        self.bid = bytearray()
+        self.price = array('d')
+        self.size = array('d')
+        self.next = array('i')
+        self.prev = array('i')
+        self.free = array('I')
+        self.heads = array('i')
+
+    def __len__(self):
+        return len(self.slots)
+
+    def __contains__(self, oid):
+        return oid in self.slots
+
+    def __iter__(self):
+        return iter(self.slots)
+
+    def new_book(self):
+        self.heads.append(-1)
+        return len(self.heads) - 1
+
+    def add(self, oid, book, bid, price, size):
+        head = self.heads[book]
+        if self.free:
+            i = self.free.pop()
+            self.ids[i] = oid
+            self.book[i] = book
+            self.bid[i] = bid
+            self.price[i] = price
+            self.size[i] = size
+            self.next[i] = head
+            self.prev[i] = -1
+        else:
+            i = len(self.ids)
+            self.ids.append(oid)
+            self.book.append(book)
+            self.bid.append(bid)
+            self.price.append(price)
+            self.size.append(size)
+            self.next.append(head)
+            self.prev.append(-1)
+        if head >= 0:
+            self.prev[head] = i
+        self.heads[book] = i
+        self.slots[oid] = i
+        return i
+
+    def remove(self, i):
+        n, p = self.next[i], self.prev[i]
+        if p >= 0:
+            self.next[p] = n
+        else:
+            self.heads[self.book[i]] = n
+        if n >= 0:
+            self.prev[n] = p
+        del self.slots[self.ids[i]]
+        self.free.append(i)
+
+    def clear_book(self, book):
+        slots = self.slots
+        i = self.heads[book]
+        while i >= 0:
+            del slots[self.ids[i]]
+            self.free.append(i)
+            i = self.next[i]
+        self.heads[book] = -1
+
+
+class OrderBook():
+    # number is the book's position in OrderBooks.numbered and its orders'
+    # book in Orders
+    __slots__ = ('instrument', 'book_type', 'number', 'bids', 'asks', 'timestamp')
+
+    def __init__(self, instrument, book_type, number=0):
+        self.instrument = instrument
+        self.book_type = book_type
+        self.number = number
+        self.bids = Levels(descending=True)
+        self.asks = Levels()
+        self.timestamp = 0
+
+    def side(self, side):
+        return self.bids if side == BID else self.asks
+
+    def best_bid(self):
+        return self.bids.best()
+
+    def best_ask(self):
+        return self.asks.best()
+
+    def snapshot(self, depth=10):
+        return {'Instrument': self.instrument,
+                'OrderBookType': self.book_type,
+                'Timestamp': self.timestamp,
+                'Bids': self.bids.levels(depth, True),
+                'Asks': self.asks.levels(depth, False)}
+
+
+class OrderBooks():
+    # full depth books per (Instrument, OrderBookType) built from decode()
+    # message dicts; usable directly as the sink argument of decode()
+    def __init__(self):
+        self.books = {}
+        self.numbered = []
+        self.orders = Orders()
+        self.callbacks = []
+        self.unplaced = 0
+        self.handlers = {'AddOrder': self.add_order,
+                         'AddOrderShort': self.add_order,
+                         'AddOrderIncremental': self.add_order,
+                         'ModifyOrder': self.modify_order,
+                         'DeleteOrder': self.delete_order,
+                         'OrderBookClear': self.clear_book}
+
+    def on_update(self, callback):
+        # callback(book, MsgTypeName, data) after every change to a book
+        self.callbacks.append(callback)
+
+    def book(self, instrument, book_type=1):
+        key = (instrument, book_type)
+        book = self.books.get(key)
+        if book is None:
+            book = self.books[key] = OrderBook(instrument, book_type, self.orders.new_book())
+            self.numbered.append(book)
+        return book
+
+    def add(self, name, data):
+        handler = self.handlers.get(name)
+        if handler is None:
+            return
+        book = handler(data)
+        if book is not None:
+            book.timestamp = data.get('Timestamp', book.timestamp)
+            for callback in self.callbacks:
+                callback(book, name, data)
+
+    def levels_of(self, i):
+        # the book and side Levels of order slot i
+        orders = self.orders
+        book = self.numbered[orders.book[i]]
+        return book, book.bids if orders.bid[i] else book.asks
+
+    def add_order(self, data):
+        # AddOrderShort carries neither Instrument nor Side: counted, not placed
+        if 'Side' not in data:
+            self.unplaced += 1
+            return None
+        book = self.book(data['Instrument'], data['OrderBookType'])
+        bid = data['Side'] == BID
+        price = data['Price']
+        size = data['Size']
+        orders = self.orders
+        i = orders.slots.get(data['OrderID'])
+        if i is not None:
+            self.levels_of(i)[1].remove(orders.price[i], orders.size[i])
+            orders.remove(i)
+        (book.bids if bid else book.asks).add(price, size)
+        orders.add(data['OrderID'], book.number, bid, price, size)
+        return book
+
+    def modify_order(self, data):
+        orders = self.orders
+        i = orders.slots.get(data['OrderID'])
+        price = data['Price']
+        size = data['Quantity']
+        if i is None:
+            book = self.book(data['Instrument'], data['OrderBookType'])
+            bid = data['Side'] == BID
+            (book.bids if bid else book.asks).add(price, size)
+            orders.add(data['OrderID'], book.number, bid, price, size)
+            return book
+        book, levels = self.levels_of(i)
+        if orders.price[i] == price:
+            levels.resize(price, size - orders.size[i])
+        else:
+            levels.remove(orders.price[i], orders.size[i])
+            levels.add(price, size)
+            orders.price[i] = price
+        orders.size[i] = size
+        return book
+
+    def delete_order(self, data):
+        orders = self.orders
+        i = orders.slots.get(data['OrderID'])
+        if i is None:
+            return None
+        book, levels = self.levels_of(i)
+        levels.remove(orders.price[i], orders.size[i])
+        orders.remove(i)
+        return book
+
+    def clear_book(self, data):
+        book = self.books.get((data['Instrument'], data['OrderBookType']))
+        if book is None:
+            return None
+        if not book.bids and not book.asks:
+            return book
+        book.bids.clear()
+        book.asks.clear()
+        self.orders.clear_book(book.number)
+        return book
+
+    def snapshot(self, instrument, book_type=1, depth=10):
+        book = self.books.get((instrument, book_type))
+        return None if book is None else book.snapshot(depth)
+
+    def snapshots(self, depth=10):
+        return [book.snapshot(depth) for book in self.books.values()]
+
+    def state(self):
+        # compact form for snapshots: levels and resting orders as array
+        # bytes, orders referring to their book by position
+        orders = self.orders
+        slots = array('I', orders.slots.values())
+        ids = array('Q', orders.slots)
+        book = array('I', [orders.book[i] for i in slots])
+        sides = bytes(BID[0] if orders.bid[i] else ASK[0] for i in slots)
+        prices = array('d', [orders.price[i] for i in slots])
+        sizes = array('d', [orders.size[i] for i in slots])
+        return {'books': [(b.instrument, b.book_type, b.timestamp, b.bids.state(), b.asks.state())
+                          for b in self.numbered],
+                'orders': (ids.tobytes(), book.tobytes(), sides, prices.tobytes(), sizes.tobytes()),
+                'unplaced': self.unplaced}
+
+    def restore(self, state):
+        self.books = {}
+        self.numbered = []
+        self.orders = orders = Orders()
+        for instrument, book_type, timestamp, bids, asks in state['books']:
+            b = self.book(instrument, book_type)
+            b.timestamp = timestamp
+            b.bids.restore(bids)
+            b.asks.restore(asks)
+        ids, book, prices, sizes = array('Q'), array('I'), array('d'), array('d')
+        ids.frombytes(state['orders'][0])
+        book.frombytes(state['orders'][1])
+        sides = state['orders'][2]
+        prices.frombytes(state['orders'][3])
+        sizes.frombytes(state['orders'][4])
+        for i, oid in enumerate(ids):
+            orders.add(oid, book[i], sides[i] == BID[0], prices[i], sizes[i])
+        self.unplaced = state['unplaced']
+        return self
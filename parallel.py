@@ -0,0 +1,105 @@
+import os
+import io
+import sys
+import json
+import contextlib
+from collections import deque
+from functools import partial
+from multiprocessing import Pool
+
+import gtp_parse
+from pcap_reader import PcapReader, is_capture, is_compressed
+from jsonl import JsonLinesSink
+
+CHUNK_SIZE = 256 * 2**20
+
+
+def capture_files(path):
+    # a directory of rotated captures is decoded in file name order, which
+    # for tshark ring buffers (..._00020_<timestamp>.pcap) is capture order
+    if os.path.isdir(path):
+        files = [os.path.join(path, f) for f in sorted(os.listdir(path))]
+        return [f for f in files if os.path.isfile(f) and is_capture(f)]
+    return [path]
+
+
+def plan_shards(files, chunk_size=CHUNK_SIZE):
+    # (path, start, stop) byte ranges; readers resync to the first record
+    # starting inside their range so consecutive shards neither overlap nor
+    # leave gaps
+    shards = []
+    for f in files:
+        if is_compressed(f):
+            # no random access into a compressed stream: one shard per file
+            shards.append((f, 0, None))
+            continue
+        size = os.path.getsize(f)
+        for start in range(0, max(size, 1), chunk_size):
+            stop = start + chunk_size if start + chunk_size < size else None
+            shards.append((f, start, stop))
+    return shards
+
+
+def decode_shard(shard, msgfilter=None, fields=None, use_orjson=False):
+    # serial decode of one shard, returning exactly what it would have printed
+    path, start, stop = shard
+    out = io.StringIO()
+    sink = JsonLinesSink(out, fields, use_orjson=use_orjson)
+    with contextlib.redirect_stdout(out), PcapReader(path, start, stop) as reader:
+        for pk in reader:
+            gtp_parse.parse_gtp(pk, sink, None, msgfilter)
+        sink.flush()
+    return out.getvalue()
+
+
+def decode_shard_batch(shard, batch_size, msgfilter=None):
+    from batch_decode import decode_batches
+    path, start, stop = shard
+    with PcapReader(path, start, stop) as reader:
+        return list(decode_batches(reader, batch_size, None, msgfilter))
+
+
+def ordered_map(pool, fn, items, ahead):
+    # like pool.imap but keeps at most `ahead` results in flight so that a
+    # slow consumer does not buffer the decoded output of the whole day
+    pending = deque()
+    items = iter(items)
+    for item in items:
+        pending.append(pool.apply_async(fn, (item,)))
+        if len(pending) >= ahead:
+            break
+    while pending:
+        result = pending.popleft().get()
+        for item in items:
+            pending.append(pool.apply_async(fn, (item,)))
+            break
+        yield result
+
+
+def decode_parallel(path, jobs=None, chunk_size=CHUNK_SIZE, batch=0, sink=None, out=None,
+                    msgfilter=None):
+    # shards are contiguous record ranges taken in file and offset order, so
+    # emitting results in shard order reproduces the serial output: blocks
+    # stay in capture order, i.e. (MarketDataGroup, SequenceNumber) order
+    # within each group
+    # out is a stream or a JsonLinesSink, whose fields and encoder the
+    # workers then use
+    if out is None:
+        out = sys.stdout
+    jobs = jobs or os.cpu_count()
+    shards = plan_shards(capture_files(path), chunk_size)
+    with Pool(jobs) as pool:
+        if sink is None and not batch:
+            fn = partial(decode_shard, msgfilter=msgfilter)
+            if isinstance(out, JsonLinesSink):
+                fn = partial(fn, fields=out.encoder.fields, use_orjson=out.encoder.use_orjson)
+            for text in ordered_map(pool, fn, shards, 2 * jobs):
+                out.write(text)
+            return
+        fn = partial(decode_shard_batch, batch_size=batch or 100000, msgfilter=msgfilter)
+        for batches in ordered_map(pool, fn, shards, 2 * jobs):
+            for columns in batches:
+                if sink is None:
+                    out.write(json.dumps({name: len(a) for name, a in columns.items()}) + '\n')
+                else:
+                    sink.write_batch(columns)
@@ -0,0 +1,569 @@
+import mmap
+import queue
+import socket
+import threading
+from struct import Struct, error as struct_error
+from collections import namedtuple
+
+# classic pcap magic -> (byte order, timestamp divisor)
+PCAP_MAGIC = {
+    b'\xd4\xc3\xb2\xa1': ('<', 10**6),
+    b'\xa1\xb2\xc3\xd4': ('>', 10**6),
+    b'\x4d\x3c\xb2\xa1': ('<', 10**9),
+    b'\xa1\xb2\x3c\x4d': ('>', 10**9),
+}
+PCAPNG_SHB = b'\x0a\x0d\x0d\x0a'
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+# decompressed bytes per buffer, and buffered ahead of the reader in total
+CHUNK = 4 * 2**20
+READ_AHEAD = 32 * 2**20
+
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_LINUX_SLL2 = 276
+
+ETH_P_IP = 0x0800
+ETH_P_8021Q = 0x8100
+ETH_P_8021AD = 0x88a8
+IPPROTO_UDP = 17
+
+ethertype = Struct('!H')
+ipv4_header = Struct('!BBHHHBBH4s4s')
+udp_header = Struct('!HHHH')
+
+UDPFields = ['time', 'src', 'dst', 'sport', 'dport', 'len', 'chksum', 'load', 'offset', 'end']
+
+
+class UDPPacket(namedtuple('UDPPacket', UDPFields, defaults=(None,))):
+    # time is the capture timestamp, len the IP total length and load a
+    # zero-copy memoryview of the UDP payload; offset is the file offset of
+    # the capture record the packet came from and end that of the record
+    # after it (None for packets not read from a capture)
+    __slots__ = ()
+
+    def show(self):
+        print('UDPPacket %s:%d > %s:%d len=%d time=%f'
+              % (self.src, self.sport, self.dst, self.dport, self.len, self.time))
+
+
+addresses = {}
+
+def ip_address(raw):
+    try:
+        return addresses[raw]
+    except KeyError:
+        addresses[raw] = a = socket.inet_ntoa(raw)
+        return a
+
+
+def ip_offset(frame, linktype):
+    # offset of the IPv4 header inside a link layer frame, None if not IPv4
+    if linktype == LINKTYPE_ETHERNET:
+        off = 12
+        etype = ethertype.unpack_from(frame, off)[0]
+        while etype in (ETH_P_8021Q, ETH_P_8021AD):
+            off += 4
+            etype = ethertype.unpack_from(frame, off)[0]
+        off += 2
+    elif linktype == LINKTYPE_LINUX_SLL:
+        etype = ethertype.unpack_from(frame, 14)[0]
+        off = 16
+    elif linktype == LINKTYPE_LINUX_SLL2:
+        etype = ethertype.unpack_from(frame, 0)[0]
+        off = 20
+    elif linktype == LINKTYPE_RAW:
+        etype = ETH_P_IP if frame[0] >> 4 == 4 else 0
+        off = 0
+    elif linktype == LINKTYPE_NULL:
+        etype = ETH_P_IP if frame[0] == 2 or frame[3] == 2 else 0
+        off = 4
+    else:
+        raise ValueError('Unsupported link type [' + str(linktype) + ']')
+    if etype != ETH_P_IP:
+        return None
+    return off
+
+
+def udp_packet(frame, linktype, time, offset, end=None):
+    try:
+        off = ip_offset(frame, linktype)
+        if off is None:
+            return None
+        vihl, tos, iplen, ident, frag, ttl, proto, chksum, src, dst = \
+            ipv4_header.unpack_from(frame, off)
+    except (IndexError, struct_error):
+        return None
+    # only unfragmented (or first fragment) UDP datagrams carry a UDP header
+    if proto != IPPROTO_UDP or frag & 0x1fff:
+        return None
+    off += (vihl & 0x0f) * 4
+    if off + 8 > len(frame):
+        return None
+    sport, dport, ulen, uchksum = udp_header.unpack_from(frame, off)
+    stop = min(off + ulen, len(frame))
+    return UDPPacket(time, ip_address(src), ip_address(dst), sport, dport,
+                     iplen, uchksum, frame[off + 8:stop], offset, end)
+
+
+def iter_pcap(buf, start=0, stop=None, exact=False):
+    # yields the UDP packets of records starting in [start, stop); start is
+    # resynced to the next record unless `exact` says it is a record offset
+    order, divisor = PCAP_MAGIC[bytes(buf[0:4])]
+    snaplen, linktype = Struct(order + 'II').unpack_from(buf, 16)
+    linktype &= 0x0fffffff
+    record = Struct(order + 'IIII')
+    unpack_from = record.unpack_from
+    end = len(buf)
+    stop = end if stop is None else min(stop, end)
+    if exact:
+        off = max(start, 24)
+    elif start > 24 and end >= 40:
+        first = unpack_from(buf, 24)[0]
+        off = pcap_resync(buf, start, record, divisor, snaplen, first)
+    else:
+        off = 24
+    while off + 16 <= end and off < stop:
+        sec, frac, incl_len, orig_len = unpack_from(buf, off)
+        start = off + 16
+        if start + incl_len > end:
+            break
+        p = udp_packet(buf[start:start + incl_len], linktype,
+                       sec + frac / divisor, off, start + incl_len)
+        if p is not None:
+            yield p
+        off = start + incl_len
+
+
+def pcap_resync(buf, start, record, divisor, snaplen, first, chain=4):
+    # classic pcap has no sync marker: find the first offset from which
+    # `chain` consecutive record headers are plausible, i.e. non-empty,
+    # within the snap length and timestamped within a week of the first
+    # record of the file
+    end = len(buf)
+    limit = max(snaplen, 262144)
+    unpack_from = record.unpack_from
+
+    def plausible(off):
+        if off + 16 > end:
+            return None
+        sec, frac, incl_len, orig_len = unpack_from(buf, off)
+        if frac >= divisor or not 0 < incl_len <= orig_len <= limit \
+           or abs(sec - first) > 7 * 86400 or off + 16 + incl_len > end:
+            return None
+        return off + 16 + incl_len
+
+    for off in range(start, end - 15):
+        nxt = plausible(off)
+        n = 1
+        while nxt is not None and n < chain and nxt < end:
+            nxt = plausible(nxt)
+            n += 1
+        if nxt is not None:
+            return off
+    return end
+
+
+PCAPNG_TYPES = (1, 2, 3, 4, 5, 6, 0x0a0d0d0a)
+
+def pcapng_resync(buf, start, order):
+    length = Struct(order + 'I')
+    header = Struct(order + 'II')
+    end = len(buf)
+    for off in range(start + (-start % 4), end - 11, 4):
+        btype, blen = header.unpack_from(buf, off)
+        if btype in PCAPNG_TYPES and blen >= 12 and blen % 4 == 0 \
+           and off + blen <= end and length.unpack_from(buf, off + blen - 4)[0] == blen:
+            return off
+    return end
+
+
+def iter_pcapng(buf, start=0, stop=None, exact=False):
+    # the section and interface blocks at the head of the file are always
+    # read; packets are yielded for blocks starting in [start, stop)
+    end = len(buf)
+    stop = end if stop is None else min(stop, end)
+    off = 0
+    order = '<'
+    interfaces = []
+    resync = start > 0
+    while off + 12 <= end and off < stop:
+        if bytes(buf[off:off + 4]) == PCAPNG_SHB:
+            order = '<' if bytes(buf[off + 8:off + 12]) == b'\x4d\x3c\x2b\x1a' else '>'
+            interfaces = []
+        btype, blen = Struct(order + 'II').unpack_from(buf, off)
+        if blen < 12 or off + blen > end:
+            break
+        if resync and btype in (3, 6):
+            resync = False
+            if start > off:
+                off = start if exact else pcapng_resync(buf, start, order)
+                continue
+        if btype == 1:
+            linktype = Struct(order + 'H').unpack_from(buf, off + 8)[0]
+            interfaces.append((linktype, if_tsresol(buf, off + 16, off + blen - 4, order)))
+        elif btype == 6:
+            iface, hi, lo, caplen, origlen = Struct(order + 'IIIII').unpack_from(buf, off + 8)
+            linktype, divisor = interfaces[iface]
+            start = off + 28
+            p = udp_packet(buf[start:start + caplen], linktype,
+                           ((hi << 32) | lo) / divisor, off, off + blen)
+            if p is not None:
+                yield p
+        elif btype == 3:
+            linktype, divisor = interfaces[0]
+            origlen = Struct(order + 'I').unpack_from(buf, off + 8)[0]
+            start = off + 12
+            caplen = min(origlen, blen - 16)
+            p = udp_packet(buf[start:start + caplen], linktype, 0.0, off, off + blen)
+            if p is not None:
+                yield p
+        off += blen
+
+
+def if_tsresol(buf, off, end, order):
+    option = Struct(order + 'HH')
+    while off + 4 <= end:
+        code, length = option.unpack_from(buf, off)
+        if code == 0:
+            break
+        if code == 9:
+            v = buf[off + 4]
+            return 2 ** (v & 0x7f) if v & 0x80 else 10 ** v
+        off += 4 + ((length + 3) & ~3)
+    return 10**6
+
+
+def iter_pcap_stream(cursor, start=0, stop=None, exact=False):
+    # iter_pcap over a ChunkCursor; offsets are those of the decompressed
+    # stream, and records before start are read and skipped, so start is
+    # always exact
+    head = cursor.read(24)
+    if head is None:
+        return
+    order, divisor = PCAP_MAGIC[bytes(head[0:4])]
+    snaplen, linktype = Struct(order + 'II').unpack_from(head, 16)
+    linktype &= 0x0fffffff
+    unpack_from = Struct(order + 'IIII').unpack_from
+    read = cursor.read
+    while True:
+        off = cursor.tell()
+        if stop is not None and off >= stop:
+            break
+        h = read(16)
+        if h is None:
+            break
+        sec, frac, incl_len, orig_len = unpack_from(h)
+        frame = read(incl_len)
+        if frame is None:
+            break
+        if off < start:
+            continue
+        p = udp_packet(frame, linktype, sec + frac / divisor, off, off + 16 + incl_len)
+        if p is not None:
+            yield p
+
+
+def iter_pcapng_stream(cursor, start=0, stop=None, exact=False):
+    # iter_pcapng over a ChunkCursor: every block is read as its first 12
+    # bytes (type, length and the section byte order magic or the first
+    # body word) and the rest
+    order = '<'
+    interfaces = []
+    while True:
+        off = cursor.tell()
+        if stop is not None and off >= stop:
+            break
+        h = cursor.read(12)
+        if h is None:
+            break
+        if bytes(h[0:4]) == PCAPNG_SHB:
+            order = '<' if bytes(h[8:12]) == b'\x4d\x3c\x2b\x1a' else '>'
+            interfaces = []
+        btype, blen = Struct(order + 'II').unpack_from(h, 0)
+        if blen < 12:
+            break
+        rest = cursor.read(blen - 12)
+        if rest is None:
+            break
+        if btype == 1:
+            linktype = Struct(order + 'H').unpack_from(h, 8)[0]
+            interfaces.append((linktype, if_tsresol(rest, 4, blen - 16, order)))
+        elif off < start:
+            continue
+        elif btype == 6:
+            iface = Struct(order + 'I').unpack_from(h, 8)[0]
+            hi, lo, caplen, origlen = Struct(order + 'IIII').unpack_from(rest, 0)
+            linktype, divisor = interfaces[iface]
+            p = udp_packet(rest[16:16 + caplen], linktype, ((hi << 32) | lo) / divisor, off, off + blen)
+            if p is not None:
+                yield p
+        elif btype == 3:
+            linktype, divisor = interfaces[0]
+            origlen = Struct(order + 'I').unpack_from(h, 8)[0]
+            p = udp_packet(rest[0:min(origlen, blen - 16)], linktype, 0.0, off, off + blen)
+            if p is not None:
+                yield p
+
+
+def compression(magic):
+    if magic[:2] == GZIP_MAGIC:
+        return 'gzip'
+    if magic == ZSTD_MAGIC:
+        return 'zstd'
+    return None
+
+
+def open_decompressed(path, kind):
+    if kind == 'gzip':
+        import gzip
+        return gzip.open(path, 'rb')
+    try:
+        import zstandard
+    except ImportError:
+        raise Exception('zstandard is required to read [' + path + ']')
+    return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), read_size=2**20,
+                                                      read_across_frames=True, closefd=True)
+
+
+class Decompressor(threading.Thread):
+    # decompresses a gzip or zstd file in the background into `chunk` sized
+    # buffers, up to `depth` of them ahead of the reader. Buffers handed back
+    # with recycle() are refilled instead of allocating new ones
+    def __init__(self, path, kind, chunk=CHUNK, depth=8):
+        threading.Thread.__init__(self, daemon=True)
+        self.path = path
+        self.kind = kind
+        self.chunk = chunk
+        self.full = queue.Queue(depth)
+        self.free = queue.Queue()
+        self.error = None
+        self.stopped = False
+        self.start()
+
+    def run(self):
+        try:
+            with open_decompressed(self.path, self.kind) as f:
+                while not self.stopped:
+                    try:
+                        buf = self.free.get_nowait()
+                    except queue.Empty:
+                        buf = bytearray(self.chunk)
+                    n = 0
+                    with memoryview(buf) as view:
+                        while n < len(buf):
+                            k = f.readinto(view[n:])
+                            if not k:
+                                break
+                            n += k
+                    if not n:
+                        break
+                    self.put((buf, n))
+        except Exception as e:
+            self.error = e
+        self.put(None)
+
+    def put(self, item):
+        while not self.stopped:
+            try:
+                self.full.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def chunks(self):
+        # (buffer, length) in stream order
+        while True:
+            item = self.full.get()
+            if item is None:
+                if self.error is not None:
+                    raise self.error
+                return
+            yield item
+
+    def recycle(self, buf):
+        self.free.put(buf)
+
+    def stop(self):
+        self.stopped = True
+        self.join()
+
+
+class ChunkCursor():
+    # sequential reads over the buffers of a Decompressor. A read inside the
+    # current buffer is a view of it; only reads spanning two buffers are
+    # copied. A finished buffer is recycled once no packet views of it are
+    # left, which shows as a bytearray that can be resized again; buffers
+    # still referenced after `retire` more are dropped to the garbage collector
+    def __init__(self, source, retire=4):
+        self.source = source
+        self.chunks = source.chunks()
+        self.buf = None
+        self.view = memoryview(b'')
+        self.pos = 0
+        self.base = 0
+        self.retire = retire
+        self.retired = []
+
+    def advance(self):
+        self.base += len(self.view)
+        self.view.release()
+        if self.buf is not None:
+            self.retired.append(self.buf)
+            self.recycle()
+        item = next(self.chunks, None)
+        if item is None:
+            self.buf = None
+            self.view = memoryview(b'')
+            self.pos = 0
+            return False
+        self.buf, n = item
+        self.view = memoryview(self.buf)[:n]
+        self.pos = 0
+        return True
+
+    def recycle(self):
+        kept = []
+        for buf in self.retired:
+            try:
+                buf.append(0)
+                buf.pop()
+                self.source.recycle(buf)
+            except BufferError:
+                kept.append(buf)
+        self.retired = kept[-self.retire:]
+
+    def tell(self):
+        return self.base + self.pos
+
+    def peek(self, n):
+        # bytes at the current position without consuming them
+        while self.pos >= len(self.view):
+            if not self.advance():
+                return b''
+        return bytes(self.view[self.pos:self.pos + n])
+
+    def read(self, n):
+        # n bytes as a memoryview, None at the end of the stream
+        while self.pos >= len(self.view) and n:
+            if not self.advance():
+                return None
+        end = self.pos + n
+        if end <= len(self.view):
+            v = self.view[self.pos:end]
+            self.pos = end
+            return v
+        part = bytearray(self.view[self.pos:])
+        while len(part) < n:
+            if not self.advance():
+                return None
+            k = min(n - len(part), len(self.view))
+            part += self.view[:k]
+            self.pos = k
+        return memoryview(part)
+
+
+def is_compressed(path):
+    with open(path, 'rb') as f:
+        return compression(f.read(4)) is not None
+
+
+def is_capture(path):
+    # pcap or pcapng, also when gzip or zstd compressed
+    with open(path, 'rb') as f:
+        magic = f.read(4)
+    kind = compression(magic)
+    if kind is not None:
+        try:
+            with open_decompressed(path, kind) as f:
+                magic = f.read(4)
+        except Exception:
+            return False
+    return magic in PCAP_MAGIC or magic == PCAPNG_SHB
+
+
+class PcapReader():
+    # start/stop restrict the reader to records starting in that byte range.
+    # gzip and zstd compressed captures are decompressed by a background
+    # thread keeping up to read_ahead bytes (READ_AHEAD by default) ahead of
+    # the reader; their offsets are those of the decompressed stream and they
+    # cannot be read by range(). With `exact`, start is the offset of a
+    # record (a packet's end) and is not resynced
+    def __init__(self, path, start=0, stop=None, read_ahead=None, exact=False):
+        self.path = path
+        self.file = open(path, 'rb')
+        self.map = None
+        self.buf = memoryview(b'')
+        self.stream = None
+        kind = compression(self.file.read(4))
+        if kind is not None:
+            read_ahead = read_ahead or READ_AHEAD
+            chunk = min(CHUNK, read_ahead)
+            self.stream = Decompressor(path, kind, chunk, max(1, read_ahead // chunk))
+            cursor = ChunkCursor(self.stream)
+            magic = cursor.peek(4)
+            if magic in PCAP_MAGIC:
+                self.packets = iter_pcap_stream(cursor, start, stop)
+            elif magic == PCAPNG_SHB:
+                self.packets = iter_pcapng_stream(cursor, start, stop)
+            elif not magic:
+                self.packets = iter(())
+            else:
+                self.close()
+                raise ValueError('Not a compressed pcap/pcapng file [' + path + ']')
+            return
+        try:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.buf = memoryview(self.map)
+        except ValueError:
+            pass  # empty file
+
+        magic = bytes(self.buf[0:4])
+        if magic in PCAP_MAGIC:
+            self.iterate = iter_pcap
+        elif magic == PCAPNG_SHB:
+            self.iterate = iter_pcapng
+        elif not magic:
+            self.iterate = lambda buf, start, stop, exact=False: iter(())
+        else:
+            self.close()
+            raise ValueError('Not a pcap/pcapng file [' + path + ']')
+        self.packets = self.iterate(self.buf, start, stop, exact)
+
+    def __iter__(self):
+        return self.packets
+
+    def range(self, start, stop=None):
+        # the packets of records starting in [start, stop) of the same file
+        if self.stream is not None:
+            raise Exception('Random access needs an uncompressed capture [' + self.path + ']')
+        return self.iterate(self.buf, start, stop)
+
+    def close(self):
+        if self.stream is not None:
+            self.stream.stop()
+        # payload views handed out must be released before the map can close
+        try:
+            self.buf.release()
+            if self.map is not None:
+                self.map.close()
+        except BufferError:
+            pass
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_pcap(path, count=0):
+    with PcapReader(path) as reader:
+        for n, p in enumerate(reader, 1):
+            yield p
+            if n == count:
+                break
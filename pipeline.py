@@ -0,0 +1,203 @@
+import sys
+import json
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from gtp_parse import parse_gtp
+from jsonl import JsonEncoder
+
+END = None
+
+
+class Collector():
+    # decode() sink gathering (MsgTypeName, data) pairs of a batch
+    def __init__(self):
+        self.messages = []
+
+    def add(self, name, data):
+        self.messages.append((name, data))
+
+
+def add_batch(sink, batch):
+    add = sink.add
+    for name, data in batch:
+        add(name, data)
+
+
+class Stage():
+    def __init__(self, name, queue_size):
+        self.name = name
+        self.queue = asyncio.Queue(queue_size)
+        self.items = 0
+        self.high = 0
+
+    async def put(self, batch):
+        await self.queue.put(batch)
+        depth = self.queue.qsize()
+        if depth > self.high:
+            self.high = depth
+        # a put into a queue with room does not yield; do it here so the
+        # consumers and the metrics reporter get to run
+        await asyncio.sleep(0)
+
+    def metrics(self):
+        return {'depth': self.queue.qsize(), 'max': self.queue.maxsize,
+                'high': self.high, 'items': self.items}
+
+
+class SocketSink():
+    # newline delimited JSON to a TCP consumer; send() awaits drain() so a
+    # slow reader pushes back on its queue instead of buffering without bound
+    def __init__(self, host, port, encoder=None):
+        self.host = host
+        self.port = port
+        self.encoder = encoder or JsonEncoder()
+        self.writer = None
+
+    async def send(self, batch):
+        if self.writer is None:
+            reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.writer.write(self.encoder.encode(batch))
+        await self.writer.drain()
+
+    async def aclose(self):
+        if self.writer is not None:
+            self.writer.close()
+            await self.writer.wait_closed()
+
+
+class Pipeline():
+    # source -> block splitter/decoder -> enrichers -> one bounded queue per
+    # sink. Work moves in lists of up to batch_size packets or messages and
+    # every queue holds at most queue_size batches, so the slowest sink
+    # throttles decoding and decoding throttles the source.
+    #
+    # source is an iterable of packets (PcapReader, a list of UDPPackets...)
+    # or a MulticastReceiver, which is polled from a worker thread.
+    # enrichers are callables (name, data) -> data, or None to drop.
+    # sinks have add(name, data) like decode() sinks, or a coroutine
+    # send(batch) taking a list of (name, data)
+    def __init__(self, source, sinks, enrichers=(), sequencer=None, msgfilter=None,
+                 queue_size=64, batch_size=256):
+        self.source = source
+        self.sinks = list(sinks)
+        self.enrichers = list(enrichers)
+        self.sequencer = sequencer
+        self.msgfilter = msgfilter
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.packets = 0
+        self.messages = 0
+        self.dropped = 0
+        self.started = None
+
+    def metrics(self):
+        elapsed = time.time() - self.started if self.started else 0.0
+        return {'packets': self.packets, 'messages': self.messages,
+                'dropped': self.dropped, 'elapsed': elapsed,
+                'queues': {s.name: s.metrics() for s in [self.blocks] + self.outputs}}
+
+    async def read_source(self):
+        batch = []
+        if hasattr(self.source, 'receive'):
+            # live receiver: block in a thread, copy loads out of its ring
+            # since the queues may hold more packets than the ring has slots
+            loop = asyncio.get_running_loop()
+            while True:
+                packets = await loop.run_in_executor(None, self.source.receive, 0.1)
+                if packets:
+                    await self.blocks.put([p._replace(load=bytes(p.load)) for p in packets])
+        else:
+            for p in self.source:
+                batch.append(p)
+                if len(batch) >= self.batch_size:
+                    await self.blocks.put(batch)
+                    batch = []
+            if batch:
+                await self.blocks.put(batch)
+        await self.blocks.put(END)
+
+    async def decode_blocks(self):
+        enrichers = self.enrichers
+        while True:
+            packets = await self.blocks.queue.get()
+            if packets is END:
+                break
+            self.blocks.items += len(packets)
+            self.packets += len(packets)
+            collector = Collector()
+            for pk in packets:
+                parse_gtp(pk, collector, self.sequencer, self.msgfilter)
+            messages = collector.messages
+            for enrich in enrichers:
+                kept = []
+                for name, data in messages:
+                    data = enrich(name, data)
+                    if data is not None:
+                        kept.append((name, data))
+                self.dropped += len(messages) - len(kept)
+                messages = kept
+            self.messages += len(messages)
+            for i in range(0, len(messages), self.batch_size):
+                batch = messages[i:i + self.batch_size]
+                for out in self.outputs:
+                    await out.put(batch)
+        for out in self.outputs:
+            await out.put(END)
+
+    async def write_sink(self, sink, stage):
+        # plain add() sinks run on their own thread so that file writes or a
+        # slow consumer do not stall the event loop and the source
+        send = getattr(sink, 'send', None)
+        executor = None
+        if send is None:
+            executor = ThreadPoolExecutor(1)
+            loop = asyncio.get_running_loop()
+        try:
+            while True:
+                batch = await stage.queue.get()
+                if batch is END:
+                    break
+                stage.items += len(batch)
+                if send is not None:
+                    await send(batch)
+                else:
+                    await loop.run_in_executor(executor, add_batch, sink, batch)
+            if hasattr(sink, 'aclose'):
+                await sink.aclose()
+            elif hasattr(sink, 'close'):
+                await loop.run_in_executor(executor, sink.close)
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=False)
+
+    async def report(self, interval, out):
+        while True:
+            await asyncio.sleep(interval)
+            out.write(json.dumps(self.metrics()) + '\n')
+
+    async def run(self, report_interval=0, report_out=sys.stderr):
+        self.started = time.time()
+        self.blocks = Stage('blocks', self.queue_size)
+        self.outputs = [Stage('%d:%s' % (i, type(s).__name__), self.queue_size)
+                        for i, s in enumerate(self.sinks)]
+        tasks = [asyncio.ensure_future(self.write_sink(s, o))
+                 for s, o in zip(self.sinks, self.outputs)]
+        tasks.append(asyncio.ensure_future(self.decode_blocks()))
+        source = asyncio.ensure_future(self.read_source())
+        reporter = None
+        if report_interval:
+            reporter = asyncio.ensure_future(self.report(report_interval, report_out))
+        try:
+            await asyncio.gather(source, *tasks)
+        finally:
+            for t in [source, reporter] + tasks:
+                if t is not None and not t.done():
+                    t.cancel()
+        return self.metrics()
+
+
+def run_pipeline(source, sinks, **kw):
+    report_interval = kw.pop('report_interval', 0)
+    return asyncio.run(Pipeline(source, sinks, **kw).run(report_interval))
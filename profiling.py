@@ -0,0 +1,87 @@
+import sys
+import json
+from time import perf_counter_ns
+
+STAGES = ('read', 'block', 'unpack', 'fields', 'scale', 'output')
+
+# the active Profiler, None when profiling is off; parse_gtp() and decode()
+# look it up once per packet
+profiler = None
+
+
+class Profiler():
+    # call counts and perf_counter_ns time per decode stage and message type,
+    # taken on one packet in `every`:
+    #   read    fetching the packet (pcap parsing or scapy dissection)
+    #   block   read_block() header and message splitting
+    #   unpack  struct unpacking into the message dict
+    #   fields  Instrument, packet header and sequence fields
+    #   scale   Timestamp and price scaling, latency
+    #   output  printing (json.dumps) or the sink
+    def __init__(self, every=100):
+        self.every = every
+        self.packets = 0
+        self.sampled = 0
+        self.active = False
+        self.last = None
+        self.started = perf_counter_ns()
+        self.stages = {}
+
+    def begin(self):
+        # a packet is about to be decoded
+        now = perf_counter_ns()
+        self.packets += 1
+        self.active = self.packets % self.every == 0
+        if self.active:
+            self.sampled += 1
+            if self.last is not None:
+                self.add('read', None, now - self.last)
+        return now
+
+    def end(self):
+        self.active = False
+        self.last = perf_counter_ns()
+
+    def add(self, stage, name, ns):
+        c = self.stages.get((stage, name))
+        if c is None:
+            c = self.stages[stage, name] = [0, 0]
+        c[0] += 1
+        c[1] += ns
+
+    def lap(self, stage, name, start):
+        # time since start goes to the stage, returns now for the next lap
+        now = perf_counter_ns()
+        c = self.stages.get((stage, name))
+        if c is None:
+            c = self.stages[stage, name] = [0, 0]
+        c[0] += 1
+        c[1] += now - start
+        return now
+
+    def report(self):
+        total = sum(ns for calls, ns in self.stages.values()) or 1
+        lines = [{'packets': self.packets, 'sampled': self.sampled, 'every': self.every,
+                  'elapsed': (perf_counter_ns() - self.started) / 10**9}]
+        for (stage, name), (calls, ns) in sorted(self.stages.items(),
+                                                 key=lambda i: (STAGES.index(i[0][0]), -i[1][1])):
+            lines.append({'stage': stage, 'MsgTypeName': name, 'calls': calls, 'ns': ns,
+                          'ns_per_call': ns / calls, 'share': ns / total})
+        return lines
+
+    def dump(self, out=sys.stderr):
+        for line in self.report():
+            out.write(json.dumps(line) + '\n')
+        out.flush()
+
+
+def enable(every=100):
+    global profiler
+    profiler = Profiler(every)
+    return profiler
+
+
+def disable():
+    global profiler
+    p, profiler = profiler, None
+    return p
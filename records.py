@@ -0,0 +1,155 @@
+from decimal import Decimal
+
+from gtp_parse import Decoders, read_block
+
+PRICE_EXPONENT = -8
+TIMESTAMP_EXPONENT = -9
+
+
+class PacketHeader():
+    # per packet data shared by reference by every record of the block
+    __slots__ = ('time', 'src', 'dst', 'len', 'group')
+
+    def __init__(self, time, src, dst, len, group):
+        self.time = time
+        self.src = src
+        self.dst = dst
+        self.len = len
+        self.group = group
+
+
+class Record():
+    # a decoded message holding the wire integers: prices are int64 scaled
+    # by 10**-8 and Timestamp is in nanoseconds, see `exponents`. value()
+    # and decimal() convert on demand; as_dict() gives decode()'s dict
+    __slots__ = ('header', 'sequence')
+    name = None
+    fields = ()
+    slots = {}
+    exponents = {}
+
+    @property
+    def EventName(self):
+        return self.header.time
+
+    @property
+    def src(self):
+        return self.header.src
+
+    @property
+    def dst(self):
+        return self.header.dst
+
+    @property
+    def len(self):
+        return self.header.len
+
+    @property
+    def MarketDataGroup(self):
+        return self.header.group
+
+    @property
+    def MsgTypeName(self):
+        return self.name
+
+    @property
+    def Sequence(self):
+        return self.sequence
+
+    def raw(self, name):
+        # the wire integer of a field by its serializer name
+        return getattr(self, self.slots[name])
+
+    def value(self, name):
+        # float of a scaled field, as decode() computes it
+        v = self.raw(name)
+        exp = self.exponents.get(name)
+        if exp is None or not v:
+            return v
+        return v / 10**-exp
+
+    def decimal(self, name):
+        v = self.raw(name)
+        exp = self.exponents.get(name)
+        if exp is None:
+            return v
+        return Decimal(v).scaleb(exp)
+
+    @property
+    def latency(self):
+        if 'Timestamp' not in self.exponents or self.header.time is None:
+            return None
+        return self.header.time - float(self.value('Timestamp'))
+
+    def as_dict(self):
+        data = {f: self.raw(f) for f in self.fields}
+        data['InstrumentLong'] = data.get('Instrument')
+        data['Instrument'] = self.Instrument
+        header = self.header
+        data['EventName'] = header.time
+        data['src'] = header.src
+        data['dst'] = header.dst
+        data['len'] = header.len
+        data['MsgTypeName'] = self.name
+        data['Sequence'] = self.sequence
+        data['MarketDataGroup'] = header.group
+        for f in self.exponents:
+            if data[f]:
+                data[f] = self.value(f)
+        if 'Timestamp' in data:
+            data['latency'] = self.latency
+        return data
+
+    def __repr__(self):
+        return '<%s seq=%d>' % (self.name, self.sequence)
+
+
+def symbol(self):
+    v = self.InstrumentLong
+    return v & 0xffffff if v else 0
+
+
+def no_symbol(self):
+    return 0
+
+
+def slot_name(field):
+    # the Instrument field is stored as InstrumentLong and Instrument is the
+    # symbol, like decode()'s dict; names that are not identifiers
+    # ('52wkTradeHigh') get a leading underscore
+    if field == 'Instrument':
+        return 'InstrumentLong'
+    return field if field.isidentifier() else '_' + field
+
+
+def build_record(decoder):
+    # __init__ takes header, sequence and the unpacked values in field order
+    slots = tuple(slot_name(f) for f in decoder.fields)
+    exponents = {decoder.fields[i]: PRICE_EXPONENT for i in decoder.prices}
+    if decoder.timestamp is not None:
+        exponents['Timestamp'] = TIMESTAMP_EXPONENT
+    args = ', '.join(slots)
+    body = ''.join('\n    self.%s = %s' % (s, s) for s in slots)
+    namespace = {}
+    exec('def __init__(self, header, sequence, %s):\n    self.header = header'
+         '\n    self.sequence = sequence%s' % (args, body), namespace)
+    attrs = {'__slots__': slots, '__init__': namespace['__init__'], 'name': decoder.name,
+             'fields': decoder.fields, 'slots': dict(zip(decoder.fields, slots)),
+             'exponents': exponents,
+             'Instrument': property(symbol if decoder.instrument is not None else no_symbol)}
+    return type(decoder.name + 'Record', (Record,), attrs)
+
+
+Records = {t: build_record(d) for t, d in Decoders.items()}
+
+
+def read_records(x, sequencer=None, msgfilter=None):
+    # like decode() but yields a Record per message instead of a dict
+    header = None
+    for m in read_block(x, sequencer, msgfilter):
+        if header is None:
+            ip = getattr(m, 'IPHeader', None)
+            header = PacketHeader(ip['time'], ip['src'], ip['dst'], ip['len'], m.MarketDataGroup) \
+                if ip is not None else PacketHeader(None, None, None, None, m.MarketDataGroup)
+        d = Decoders[m.MsgTypeByte]
+        yield Records[m.MsgTypeByte](header, m.SequenceMsg, *d.unpack_from(m.Block, m.Offset))
@@ -0,0 +1,134 @@
+import json
+import time
+import socket
+import argparse
+
+from pcap_reader import PcapReader
+from udp_receiver import parse_groups
+from latency import Histogram
+
+SPIN = 0.002
+
+
+def is_gtp(x):
+    # a GTP unit: 8 byte header whose BlockLength is the datagram size
+    return len(x) >= 8 and (x[0] | (x[1] << 8)) == len(x)
+
+
+class Replayer():
+    # re-sends the GTP payloads of a capture over UDP, to the packets'
+    # original destinations or to every one of `destinations` (two of them
+    # make an A/B line pair). Datagrams that are not GTP units, or not of
+    # the given MarketDataGroups / destination ports, are skipped. Packets
+    # go out at their capture spacing divided by `speed`; speed 0 sends as
+    # fast as possible. Send times are held by sleeping to within SPIN
+    # seconds of the target then spinning; their errors go to a Histogram
+    def __init__(self, destinations=None, speed=1.0, iface=None, ttl=1, groups=None, ports=None):
+        self.destinations = destinations
+        self.speed = speed
+        self.groups = set(ord(g) for g in groups) if groups else None
+        self.ports = set(ports) if ports else None
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+        self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+        if iface:
+            self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(iface))
+        self.packets = 0
+        self.bytes = 0
+        self.skipped = 0
+        self.errors = Histogram()
+        self.started = None
+        self.finished = None
+
+    def wait(self, target):
+        delay = target - time.perf_counter()
+        if delay > SPIN:
+            time.sleep(delay - SPIN)
+        while time.perf_counter() < target:
+            pass
+
+    def replay(self, packets, count=0):
+        sendto = self.sock.sendto
+        destinations = self.destinations
+        speed = self.speed
+        record = self.errors.record
+        groups = self.groups
+        ports = self.ports
+        first = None
+        start = time.perf_counter()
+        if self.started is None:
+            self.started = start
+        for p in packets:
+            x = p.load
+            if not is_gtp(x) or (groups is not None and x[3] not in groups) \
+               or (ports is not None and p.dport not in ports):
+                self.skipped += 1
+                continue
+            if speed:
+                if first is None:
+                    first = p.time
+                target = start + (p.time - first) / speed
+                self.wait(target)
+                record(abs(int((time.perf_counter() - target) * 10**9)))
+            if destinations is None:
+                sendto(p.load, (p.dst, p.dport))
+            else:
+                for d in destinations:
+                    sendto(p.load, d)
+            self.packets += 1
+            self.bytes += len(p.load)
+            if count and self.packets >= count:
+                break
+        self.finished = time.perf_counter()
+
+    def stats(self):
+        elapsed = (self.finished or time.perf_counter()) - (self.started or time.perf_counter())
+        errors = self.errors.summary()
+        return {'packets': self.packets, 'bytes': self.bytes, 'skipped': self.skipped,
+                'elapsed': elapsed,
+                'packets_per_sec': self.packets / elapsed if elapsed else None,
+                'mbit_per_sec': self.bytes * 8 / elapsed / 10**6 if elapsed else None,
+                'timing_error': None if not errors['count'] else {
+                    'mean': errors['mean'], 'p99': errors['p99'], 'max': errors['max']}}
+
+    def close(self):
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Replay the GTP packets of a capture over UDP')
+    parser.add_argument('path', help='pcap or pcapng capture file')
+    parser.add_argument('--to', metavar='HOST:PORT[,HOST:PORT]',
+                        help='send every packet to these destinations instead of its original one')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='multiple of the captured rate, 0 for as fast as possible')
+    parser.add_argument('--iface', help='address of the interface to send multicast on')
+    parser.add_argument('--ttl', type=int, default=1, help='multicast TTL')
+    parser.add_argument('--count', type=int, default=0, help='stop after this many packets')
+    parser.add_argument('--group', help='comma separated MarketDataGroups to replay')
+    parser.add_argument('--port', help='comma separated UDP destination ports to replay')
+    parser.add_argument('--loop', type=int, default=1, help='replay the capture this many times')
+    args = parser.parse_args(argv)
+    if args.speed < 0:
+        parser.error('--speed must not be negative')
+
+    destinations = parse_groups(args.to) if args.to else None
+    with Replayer(destinations, args.speed, args.iface, args.ttl,
+                  args.group.split(',') if args.group else None,
+                  [int(p) for p in args.port.split(',')] if args.port else None) as replayer:
+        for i in range(args.loop):
+            with PcapReader(args.path) as reader:
+                replayer.replay(reader, args.count)
+            if args.count and replayer.packets >= args.count:
+                break
+        print(json.dumps(replayer.stats()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+import sys
+import json
+
+WINDOW = 4096
+
+
+class Gap():
+    __slots__ = ('group', 'start', 'end', 'detected', 'resolved', 'recovered')
+
+    def __init__(self, group, start, end, detected):
+        self.group = group
+        self.start = start
+        self.end = end
+        self.detected = detected
+        self.resolved = None
+        self.recovered = None
+
+    def report(self):
+        return {'MarketDataGroup': self.group, 'Start': self.start, 'End': self.end,
+                'Missing': self.end - self.start, 'Detected': self.detected,
+                'Resolved': self.resolved, 'Recovered': self.recovered,
+                'Duration': None if self.resolved is None else self.resolved - self.detected}
+
+
+class GroupState():
+    # expected is the next sequence number after the contiguous delivered
+    # prefix; bit k of window is set when expected+k has been delivered
+    __slots__ = ('expected', 'window', 'gaps')
+
+    def __init__(self, expected):
+        self.expected = expected
+        self.window = 0
+        self.gaps = []
+
+
+class Sequencer():
+    # per MarketDataGroup arbitration of blocks arriving on one or more feed
+    # lines: every sequence number is passed downstream once, duplicates are
+    # dropped and holes are reported as gaps once they are either filled
+    # (recovered) or given up on after `timeout` seconds or `window`
+    # sequence numbers (lost)
+    def __init__(self, window=WINDOW, timeout=1.0):
+        self.size = window
+        self.timeout = timeout
+        self.groups = {}
+        self.callbacks = []
+        self.gaps = []
+        self.delivered = 0
+        self.duplicates = 0
+        self.lost = 0
+
+    def on_gap(self, callback):
+        # callback(Gap) when a gap is resolved, recovered or not
+        self.callbacks.append(callback)
+
+    def accept(self, group, seq, count, time=0.0):
+        # returns a bitmask over the block's messages (bit j for seq+j) of
+        # those not seen before; 0 means the whole block is a duplicate
+        state = self.groups.get(group)
+        if state is None:
+            state = self.groups[group] = GroupState(seq)
+        if state.gaps and time - state.gaps[0].detected > self.timeout:
+            self.skip(group, state, state.gaps[0].end, time)
+
+        rel = seq - state.expected
+        if rel + count > self.size:
+            self.skip(group, state, seq + count - self.size, time)
+            rel = seq - state.expected
+        if rel > 0 and (not state.gaps or state.gaps[-1].end < seq) \
+           and not (state.window >> rel) & 1:
+            self.open_gap(group, state, seq, time)
+        if count == 0:
+            return 0
+
+        if rel >= 0:
+            bits = ((1 << count) - 1) << rel
+            new = bits & ~state.window
+            mask = new >> rel
+        else:
+            bits = ((1 << (count + rel)) - 1) if count + rel > 0 else 0
+            new = bits & ~state.window
+            mask = new << -rel
+        self.duplicates += count - bin(mask).count('1')
+        if not new:
+            return 0
+        self.delivered += bin(new).count('1')
+        state.window |= new
+        self.advance(state, time)
+        return mask
+
+    def open_gap(self, group, state, seq, time):
+        start = state.expected
+        if state.gaps:
+            start = state.gaps[-1].end
+        # the hole runs from the last delivered number up to seq
+        for k in range(seq - state.expected - 1, -1, -1):
+            if (state.window >> k) & 1:
+                start = max(start, state.expected + k + 1)
+                break
+        if start < seq:
+            state.gaps.append(Gap(group, start, seq, time))
+
+    def advance(self, state, time):
+        w = state.window
+        t = (~w & (w + 1)).bit_length() - 1
+        if t:
+            state.window = w >> t
+            state.expected += t
+            while state.gaps and state.gaps[0].end <= state.expected:
+                self.resolve(state.gaps.pop(0), time, True)
+
+    def skip(self, group, state, expected, time):
+        # give up on everything below `expected`
+        if expected <= state.expected:
+            return
+        shift = expected - state.expected
+        missing = shift - bin(state.window & ((1 << shift) - 1)).count('1')
+        self.lost += missing
+        state.window >>= shift
+        state.expected = expected
+        while state.gaps and state.gaps[0].start < expected:
+            gap = state.gaps.pop(0)
+            if gap.end > expected:
+                state.gaps.insert(0, Gap(group, expected, gap.end, gap.detected))
+                gap.end = expected
+            self.resolve(gap, time, False)
+        self.advance(state, time)
+
+    def resolve(self, gap, time, recovered):
+        gap.resolved = time
+        gap.recovered = recovered
+        self.gaps.append(gap)
+        for callback in self.callbacks:
+            callback(gap)
+
+    def open_gaps(self):
+        return [g for state in self.groups.values() for g in state.gaps]
+
+    def state(self):
+        # JSON-able per group position, window and open gaps, for restore()
+        return {'groups': {g: {'expected': s.expected, 'window': s.window,
+                               'gaps': [[gap.start, gap.end, gap.detected] for gap in s.gaps]}
+                           for g, s in self.groups.items()},
+                'delivered': self.delivered, 'duplicates': self.duplicates, 'lost': self.lost}
+
+    def restore(self, state):
+        for g, s in state['groups'].items():
+            group = self.groups[g] = GroupState(s['expected'])
+            group.window = s['window']
+            group.gaps = [Gap(g, start, end, detected) for start, end, detected in s['gaps']]
+        self.delivered = state['delivered']
+        self.duplicates = state['duplicates']
+        self.lost = state['lost']
+        return self
+
+    def stats(self):
+        return {'Delivered': self.delivered, 'Duplicates': self.duplicates,
+                'Lost': self.lost, 'Gaps': len(self.gaps) + len(self.open_gaps()),
+                'Expected': {g: s.expected for g, s in self.groups.items()}}
+
+
+def print_gap(gap, out=sys.stderr):
+    out.write(json.dumps(gap.report()) + '\n')
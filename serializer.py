@@ -1,7 +1,6 @@
 import sys 
 from struct import Struct
 from collections import namedtuple
-from functools import partial
 import datetime
 
 class Serializer(Struct):
@@ -12,6 +11,8 @@ class Serializer(Struct):
         fmt = '<'
         for f in self.fields: fmt += f['fmt']
         Struct.__init__(self, fmt)
+        self.names = [f['name'] for f in self.fields]
+        self.index = {name: i for i, name in enumerate(self.names)}
 
         self.clean()
         self.header()
@@ -23,7 +24,9 @@ class Serializer(Struct):
         self.values = {}
         for f in self.fields:
             if 's' in f['fmt']:
-                self.values[f['name']] = ''
+                self.values[f['name']] = b''
+            elif f['fmt'] == 'c':
+                self.values[f['name']] = b'\x00'
             else:
                 self.values[f['name']] = 0
 
@@ -34,19 +37,11 @@ class Serializer(Struct):
         return Class._make(self.unpack(data))
 
     def serialize(self):
-        handler = self.pack
-        for f in self.fields:
-            handler = partial(handler, self.values[f['name']])
-
-        return handler()
+        values = self.values
+        return self.pack(*[values[name] for name in self.names])
 
     def populate(self, name, value):
-        field = {}
-        for f in self.fields:
-            if f['name'] == name:
-                field = f
-
-        if not field:
+        if name not in self.index:
             raise Exception('Invalid field [' + name + ']')
         if sys.version_info >= (3, 5) and type(value) is str:
             value = value.encode('utf-8')
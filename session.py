@@ -0,0 +1,191 @@
+import os
+import re
+import sys
+import glob
+import json
+import threading
+
+from pcap_reader import PcapReader, is_capture
+
+# tshark ring buffer names: <prefix>_<index>_<YYYYmmddHHMMSS>.pcap[ng]
+ROTATION = re.compile(r'_(\d+)_(\d{14})\.[^/\\]*$')
+READ_AHEAD = 8 * 2**20
+
+
+def rotation_key(path):
+    # (timestamp, index) of a tshark rotation, files without one sort by name
+    m = ROTATION.search(os.path.basename(path))
+    if m:
+        return (m.group(2), int(m.group(1)), path)
+    return ('', 0, path)
+
+
+def session_files(path):
+    # a directory, a glob pattern or one file, in rotation order
+    if os.path.isdir(path):
+        files = [os.path.join(path, f) for f in os.listdir(path)]
+    elif glob.has_magic(path):
+        files = glob.glob(path)
+    else:
+        return [path]
+    return sorted((f for f in files if os.path.isfile(f) and is_capture(f)), key=rotation_key)
+
+
+class Prefetcher(threading.Thread):
+    # reads a file through once so its pages are cached by the time the
+    # session gets to it
+    def __init__(self, path, chunk=READ_AHEAD):
+        threading.Thread.__init__(self, daemon=True)
+        self.path = path
+        self.chunk = chunk
+        self.stopped = False
+        self.start()
+
+    def run(self):
+        buf = bytearray(self.chunk)
+        try:
+            with open(self.path, 'rb', buffering=0) as f:
+                while not self.stopped and f.readinto(buf):
+                    pass
+        except OSError:
+            pass
+
+    def stop(self):
+        self.stopped = True
+        self.join()
+
+
+class Session():
+    # the packets of rotated capture files as one stream: files are read in
+    # rotation order while the next one is prefetched, and the position
+    # (file, record offset and that of the record after it, next
+    # SequenceNumber per MarketDataGroup, the sequencer state and the
+    # position() of every sink that has one: where an output file stands,
+    # or the state of a sink such as open bars) is written to `checkpoint`
+    # every `every` packets and at the end. A session given an existing
+    # checkpoint resumes at the record after the last packet it recorded,
+    # and its sinks seek() back to their outputs at that point.
+    #
+    # A GTP block is one UDP datagram and so one capture record; it cannot
+    # span two files. What carries across a rotation is the sequencing,
+    # which the shared sequencer and the per-group positions keep continuous
+    def __init__(self, files, checkpoint=None, sequencer=None, every=100000,
+                 sinks=(), read_ahead=READ_AHEAD):
+        self.files = list(files)
+        self.checkpoint = checkpoint
+        self.sequencer = sequencer
+        self.every = every
+        self.sinks = list(sinks)
+        self.read_ahead = read_ahead
+        self.file = None
+        self.offset = None
+        self.next = None
+        self.time = None
+        self.packets = 0
+        self.groups = {}
+        self.outputs = None
+        self.done = False
+        self.callbacks = []
+        if checkpoint and os.path.exists(checkpoint):
+            self.resume(checkpoint)
+
+    def on_checkpoint(self, callback):
+        # callback(session) after every checkpoint, e.g. to snapshot derived
+        # state at the same position; makes the session checkpoint every
+        # `every` packets even without a checkpoint file
+        self.callbacks.append(callback)
+
+    def resume(self, path):
+        with open(path) as f:
+            self.restore(json.load(f))
+
+    def restore(self, state):
+        if state['file'] is not None and state['file'] not in self.files:
+            raise Exception('Checkpoint file [' + state['file'] + '] is not part of the session')
+        self.file = state['file']
+        self.offset = state['offset']
+        self.next = state.get('next')
+        self.time = state['time']
+        self.packets = state['packets']
+        self.groups = state['groups']
+        self.done = state['done']
+        if self.sequencer is not None and state.get('sequencer'):
+            self.sequencer.restore(state['sequencer'])
+        self.outputs = state.get('outputs')
+        if self.outputs is not None:
+            if len(self.outputs) != len(self.sinks):
+                raise Exception('Checkpoint has %d outputs, the session %d sinks'
+                                % (len(self.outputs), len(self.sinks)))
+            for sink, position in zip(self.sinks, self.outputs):
+                if position is not None:
+                    sink.seek(position)
+
+    def state(self):
+        return {'file': self.file, 'offset': self.offset, 'next': self.next, 'time': self.time,
+                'packets': self.packets, 'groups': self.groups, 'done': self.done,
+                'sequencer': self.sequencer.state() if self.sequencer is not None else None,
+                'outputs': self.outputs}
+
+    def save(self):
+        # outputs are flushed first so that nothing before the recorded
+        # position is lost if the job dies after the checkpoint is written
+        for sink in self.sinks:
+            if hasattr(sink, 'flush'):
+                sink.flush()
+        sys.stdout.flush()
+        self.outputs = [sink.position() if hasattr(sink, 'position') else None
+                        for sink in self.sinks]
+        if self.checkpoint:
+            tmp = self.checkpoint + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(self.state(), f)
+            os.replace(tmp, self.checkpoint)
+        for callback in self.callbacks:
+            callback(self)
+
+    def __iter__(self):
+        if self.done:
+            return
+        first = 0
+        start = 0
+        exact = False
+        if self.file is not None:
+            first = self.files.index(self.file)
+            if self.next is not None:
+                start = self.next
+                exact = True
+            elif self.offset is not None:
+                # checkpoints without the next record offset resync to it
+                start = self.offset + 1
+        groups = self.groups
+        every = self.every if self.checkpoint or self.callbacks else 0
+        for i in range(first, len(self.files)):
+            path = self.files[i]
+            prefetch = Prefetcher(self.files[i + 1], self.read_ahead) if i + 1 < len(self.files) else None
+            try:
+                with PcapReader(path, start, exact=exact) as reader:
+                    for p in reader:
+                        yield p
+                        # the consumer is done with p
+                        self.file = path
+                        self.offset = p.offset
+                        self.next = p.end
+                        self.time = p.time
+                        self.packets += 1
+                        x = p.load
+                        if len(x) >= 8:
+                            groups[chr(x[3])] = (x[4] | (x[5] << 8) | (x[6] << 16) | (x[7] << 24)) + x[2]
+                        if every and self.packets % every == 0:
+                            self.save()
+            finally:
+                if prefetch is not None:
+                    prefetch.stop()
+            start = 0
+            exact = False
+            if i + 1 < len(self.files):
+                self.file = self.files[i + 1]
+                self.offset = None
+                self.next = None
+        self.done = True
+        if self.checkpoint or self.callbacks:
+            self.save()
@@ -0,0 +1,220 @@
+import os
+import re
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+from gtp_parse import Decoders
+from batch_decode import TypeBatch
+from bars import BAR_FIELDS
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    import pyarrow.ipc
+except ImportError:
+    pa = None
+
+FORMATS = ['parquet', 'arrow', 'npz']
+# <MsgTypeName>.<n><suffix> part files
+PART = re.compile(r'^(.+)\.(\d{5})(\.[a-z]+)$')
+
+# column layout per MsgTypeName, shared with the batch decoder
+Dtypes = {d.name: TypeBatch(d).dtype for d in Decoders.values()}
+Dtypes['Bar'] = Dtypes['VolumeBar'] = np.dtype(BAR_FIELDS)
+
+
+def column_defaults(dtype):
+    # what the batch decoder leaves in a column a message does not have
+    defaults = []
+    for f in dtype.names:
+        kind = dtype[f].kind
+        defaults.append(np.nan if kind == 'f' else b'' if kind == 'S' else '' if kind == 'U' else 0)
+    return defaults
+
+
+class ColumnSink(ABC):
+    # buffers decoded messages per message type and hands them to flush_type
+    # in row groups of row_group_size rows. With `parts` the output of a type
+    # is a series of <MsgTypeName>.<n><suffix> files, which is what lets a
+    # session checkpoint cut it: position() closes the current parts and a
+    # resume seek()s back to the part numbers it recorded
+    suffix = None
+
+    def __init__(self, directory, row_group_size=100000, parts=False):
+        self.directory = directory
+        self.row_group_size = row_group_size
+        self.parts = {} if parts else None
+        self.rows = {}
+        self.arrays = {}
+        self.pending = {}
+        self.written = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def add(self, name, data):
+        # one message dict as produced by gtp_parse.decode()
+        rows = self.rows.setdefault(name, [])
+        rows.append(data)
+        if len(rows) >= self.row_group_size:
+            self.flush_rows(name)
+
+    def write(self, name, array):
+        # a structured array as produced by BatchDecoder.decode()
+        self.arrays.setdefault(name, []).append(array)
+        self.pending[name] = self.pending.get(name, 0) + len(array)
+        if self.pending[name] >= self.row_group_size:
+            self.flush_arrays(name)
+
+    def write_batch(self, columns):
+        for name, array in columns.items():
+            self.write(name, array)
+
+    def flush_rows(self, name):
+        rows = self.rows.pop(name, None)
+        if rows:
+            # absent or None fields get the column default, so that rows
+            # match the batch decoder's columns
+            dtype = Dtypes[name]
+            fields = list(zip(dtype.names, column_defaults(dtype)))
+            values = []
+            for r in rows:
+                row = []
+                for f, default in fields:
+                    v = r.get(f)
+                    row.append(default if v is None else v)
+                values.append(tuple(row))
+            self.write(name, np.array(values, dtype=dtype))
+
+    def flush_arrays(self, name):
+        arrays = self.arrays.pop(name, None)
+        self.pending[name] = 0
+        if arrays:
+            array = arrays[0] if len(arrays) == 1 else np.concatenate(arrays)
+            self.flush_type(name, array)
+            self.written[name] = self.written.get(name, 0) + len(array)
+
+    def flush(self):
+        for name in list(self.rows):
+            self.flush_rows(name)
+        for name in list(self.arrays):
+            self.flush_arrays(name)
+
+    @abstractmethod
+    def flush_type(self, name, array):
+        pass
+
+    def part_path(self, name):
+        n = self.parts.get(name, 0)
+        self.parts[name] = n + 1
+        return os.path.join(self.directory, '%s.%05d%s' % (name, n, self.suffix))
+
+    def close_parts(self):
+        pass
+
+    def position(self):
+        # after flush(), at a checkpoint: the next part number per type, None
+        # without parts
+        if self.parts is None:
+            return None
+        self.close_parts()
+        return {'parts': dict(self.parts)}
+
+    def seek(self, position):
+        # on a resume: parts written after the checkpoint are removed and new
+        # ones numbered on from it
+        self.parts = dict(position['parts'])
+        for f in os.listdir(self.directory):
+            m = PART.match(f)
+            if m and m.group(3) == self.suffix and int(m.group(2)) >= self.parts.get(m.group(1), 0):
+                os.remove(os.path.join(self.directory, f))
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def arrow_table(array):
+    columns = {}
+    for f in array.dtype.names:
+        col = array[f]
+        if col.dtype.kind == 'S':
+            try:
+                col = col.astype('U')
+            except UnicodeDecodeError:
+                pass
+        columns[f] = pa.array(col)
+    return pa.table(columns)
+
+
+class ParquetSink(ColumnSink):
+    suffix = '.parquet'
+
+    def __init__(self, directory, row_group_size=100000, compression='zstd', parts=False):
+        if pa is None:
+            raise Exception('pyarrow is required for ' + self.suffix + ' output')
+        ColumnSink.__init__(self, directory, row_group_size, parts)
+        self.compression = compression
+        self.writers = {}
+
+    def path(self, name):
+        # of a new writer, a new part with parts
+        if self.parts is not None:
+            return self.part_path(name)
+        return os.path.join(self.directory, name + self.suffix)
+
+    def open_writer(self, name, schema):
+        return pq.ParquetWriter(self.path(name), schema, compression=self.compression)
+
+    def flush_type(self, name, array):
+        table = arrow_table(array)
+        writer = self.writers.get(name)
+        if writer is None:
+            writer = self.writers[name] = self.open_writer(name, table.schema)
+        writer.write_table(table)
+
+    def close_parts(self):
+        for writer in self.writers.values():
+            writer.close()
+        self.writers = {}
+
+    def close(self):
+        ColumnSink.close(self)
+        self.close_parts()
+
+
+class ArrowSink(ParquetSink):
+    suffix = '.arrow'
+
+    def open_writer(self, name, schema):
+        options = pa.ipc.IpcWriteOptions(compression=self.compression)
+        return pa.ipc.new_file(self.path(name), schema, options=options)
+
+
+class NpzSink(ColumnSink):
+    # npz files cannot be appended to, so every row group is its own file:
+    # <MsgTypeName>.<n>.npz with one array per column
+    suffix = '.npz'
+
+    def __init__(self, directory, row_group_size=100000):
+        ColumnSink.__init__(self, directory, row_group_size, parts=True)
+
+    def flush_type(self, name, array):
+        np.savez(self.part_path(name), **{f: array[f] for f in array.dtype.names})
+
+
+def open_sink(directory, format=None, row_group_size=100000, parts=False):
+    # parquet by default, npz when pyarrow is not installed
+    if format is None:
+        format = 'parquet' if pa is not None else 'npz'
+    if format == 'parquet':
+        return ParquetSink(directory, row_group_size, parts=parts)
+    if format == 'arrow':
+        return ArrowSink(directory, row_group_size, compression='lz4', parts=parts)
+    if format == 'npz':
+        return NpzSink(directory, row_group_size)
+    raise Exception('Invalid output format [' + format + ']')
@@ -0,0 +1,84 @@
+import os
+import sys
+import zlib
+import pickle
+
+MAGIC = b'GTPSNAP1'
+STATISTICS = ('Statistics', 'StatisticsSnapshot', 'StatisticsUpdate')
+
+
+class LatestStatistics():
+    # decode() sink keeping the last Statistics, StatisticsSnapshot and
+    # StatisticsUpdate message dict per Instrument
+    def __init__(self):
+        self.latest = {}
+
+    def add(self, name, data):
+        if name in STATISTICS:
+            self.latest[data['Instrument'], name] = data
+
+    def get(self, instrument, name='StatisticsSnapshot'):
+        return self.latest.get((instrument, name))
+
+    def state(self):
+        return dict(self.latest)
+
+    def restore(self, state):
+        self.latest = dict(state)
+        return self
+
+
+class Snapshotter():
+    # derived state (order books, instrument cache, latest statistics and the
+    # session position with its per-group sequence numbers) written to one
+    # zlib compressed pickle at every session checkpoint. restore() puts it
+    # all back so decoding resumes from the snapshot's capture position
+    # instead of replaying the day
+    def __init__(self, path, books=None, cache=None, statistics=None, level=1):
+        self.path = path
+        self.books = books
+        self.cache = cache
+        self.statistics = statistics
+        self.level = level
+        self.saved = 0
+
+    def parts(self):
+        return {'books': self.books, 'instruments': self.cache, 'statistics': self.statistics}
+
+    def save(self, session):
+        state = {'session': session.state()}
+        for name, part in self.parts().items():
+            state[name] = part.state() if part is not None else None
+        data = zlib.compress(pickle.dumps(state, pickle.HIGHEST_PROTOCOL), self.level)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(MAGIC)
+            f.write(data)
+        os.replace(tmp, self.path)
+        self.saved += 1
+
+    def load(self):
+        with open(self.path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise Exception('Not a snapshot file [' + self.path + ']')
+            return pickle.loads(zlib.decompress(f.read()))
+
+    def restore(self, session):
+        # returns False when there is no snapshot to restore from
+        if not os.path.exists(self.path):
+            return False
+        state = self.load()
+        for name, part in self.parts().items():
+            if part is not None and state.get(name) is not None:
+                part.restore(state[name])
+        session.restore(state['session'])
+        return True
+
+    def attach(self, session):
+        # restore if a snapshot exists, then snapshot at every checkpoint
+        restored = self.restore(session)
+        session.on_checkpoint(self.save)
+        if restored:
+            sys.stderr.write('restored %s at %s offset %s\n'
+                             % (self.path, session.file, session.offset))
+        return restored
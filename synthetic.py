@@ -0,0 +1,176 @@
+import sys
+import json
+import time
+import random
+import argparse
+from struct import Struct
+
+import serializer
+from gtp_parse import Decoders, PriceFlds
+from encoder import BlockEncoder
+
+PCAP_HEADER = Struct('<IHHiIII')
+RECORD_HEADER = Struct('<IIII')
+timestamp_field = Struct('<Q')
+
+# relative frequency of each message type in the default mix, roughly that
+# of a live order book feed; every decodable type appears
+DEFAULT_MIX = {'AddOrder': 30, 'AddOrderShort': 10, 'AddOrderMBP': 4, 'AddOrderShortMBP': 2,
+               'AddOrderIncremental': 4, 'ModifyOrder': 15, 'DeleteOrder': 20,
+               'Trade': 6, 'TradeCross': 1, 'TradeSummary': 1, 'TopOfBook': 3,
+               'StatisticsUpdate': 1, 'StatisticsSnapshot': 1, 'Statistics': 1,
+               'InstrumentStatus': 1, 'OrderBookClear': 1, 'SystemEvent': 1,
+               'InstrumentDirectory': 1, 'Announcements': 1}
+
+INT_RANGES = {'B': (0, 255), 'b': (-128, 127), 'H': (0, 65535), 'h': (-32768, 32767),
+              'L': (0, 2**32 - 1), 'Q': (0, 2**40)}
+LETTERS = b'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+
+def field_value(rnd, name, fmt, instruments):
+    if name == 'Side':
+        return rnd.choice('BS')
+    if fmt == 'c':
+        return chr(rnd.choice(LETTERS))
+    if fmt.endswith('s'):
+        return bytes(rnd.choice(LETTERS) for i in range(int(fmt[:-1])))
+    if name == 'Instrument':
+        return rnd.choice(instruments)
+    if name in PriceFlds:
+        return rnd.randint(1, 50000) * 10**6
+    if 'Size' in name:
+        return rnd.randint(1, 1000) * 10**8
+    low, high = INT_RANGES[fmt]
+    return rnd.randint(low, high)
+
+
+def message(tag, cls, rnd, instruments):
+    # one message through the Serializer populate/serialize path
+    s = cls()
+    for f in s.fields:
+        s.populate(f['name'], field_value(rnd, f['name'], f['fmt'], instruments))
+    s.populate('Length', s.size)
+    s.populate('MessageType', tag)
+    return s.serialize()
+
+
+class MessageTemplates():
+    # `variants` serialized messages per MessageType byte; messages are
+    # copies of a random variant with a fresh Timestamp written in place
+    def __init__(self, rnd, instruments, variants=64, types=None):
+        self.templates = {}
+        self.timestamp = {}
+        for t, d in Decoders.items():
+            if types is not None and d.name not in types:
+                continue
+            cls = getattr(serializer, d.name)
+            self.templates[t] = [message(chr(t), cls, rnd, instruments) for i in range(variants)]
+            fields = cls().fields
+            names = [f['name'] for f in fields]
+            if 'Timestamp' in names:
+                i = names.index('Timestamp')
+                self.timestamp[t] = Struct('<' + ''.join(f['fmt'] for f in fields[:i])).size
+
+
+def parse_mix(spec):
+    # 'AddOrder=5,Trade=1' -> {'AddOrder': 5, 'Trade': 1}
+    mix = {}
+    for item in spec.split(','):
+        name, _, weight = item.partition('=')
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def generate_blocks(packets, mix=None, groups='ABCD', max_messages=8, instruments=200,
+                    seed=1, start=None, rate=100000.0):
+    # yields (time, GTP block) for `packets` blocks of up to max_messages
+    # messages drawn from `mix`, each MarketDataGroup numbering its messages
+    # from 1. Capture times advance by 1/rate, Timestamps lag them by 20us
+    rnd = random.Random(seed)
+    mix = mix or DEFAULT_MIX
+    symbols = [rnd.randint(1, 2**24 - 1) | (rnd.randint(0, 255) << 32) for i in range(instruments)]
+    known = set(d.name for d in Decoders.values())
+    unknown = set(mix) - known
+    if unknown:
+        raise Exception('Invalid message type [' + ','.join(sorted(unknown)) + ']')
+    templates = MessageTemplates(rnd, symbols, types=set(mix))
+    tags = {d.name: t for t, d in Decoders.items()}
+    choices = [tags[name] for name in mix]
+    weights = [mix[name] for name in mix]
+    blocks = {g: BlockEncoder(g) for g in groups}
+    now = time.time() if start is None else start
+    for i in range(packets):
+        block = blocks[groups[i % len(groups)]]
+        buf = block.buf
+        ns = int((now - 0.00002) * 10**9)
+        for t in rnd.choices(choices, weights, k=rnd.randint(1, max_messages)):
+            off = block.offset
+            if not block.add_bytes(rnd.choice(templates.templates[t])):
+                break
+            if t in templates.timestamp:
+                timestamp_field.pack_into(buf, off + templates.timestamp[t], ns)
+        yield now, block.block()
+        now += 1.0 / rate
+
+
+def ip_checksum(header):
+    total = sum(header[i] << 8 | header[i + 1] for i in range(0, len(header), 2))
+    while total >> 16:
+        total = (total & 0xffff) + (total >> 16)
+    return ~total & 0xffff
+
+
+def udp_frame(load, src=b'\xc2\xa9\x047', dst=b'\xe0\x00\x00\x01', sport=1234, dport=5678):
+    # Ethernet + IPv4 + UDP (no UDP checksum) around a GTP block
+    ip = bytearray(b'\x45\x00' + (28 + len(load)).to_bytes(2, 'big') + b'\x00\x00\x40\x00\x40\x11\x00\x00'
+                   + src + dst)
+    ip[10:12] = ip_checksum(ip).to_bytes(2, 'big')
+    mac = b'\x01\x00\x5e' + dst[1:]
+    return (mac + b'\x02\x00\x00\x00\x00\x01' + b'\x08\x00' + bytes(ip)
+            + sport.to_bytes(2, 'big') + dport.to_bytes(2, 'big')
+            + (8 + len(load)).to_bytes(2, 'big') + b'\x00\x00' + load)
+
+
+def write_pcap(path, blocks, size=0):
+    # classic microsecond pcap of (time, block) pairs; stops after `size`
+    # bytes if given. Returns (packets, messages) written
+    packets = messages = 0
+    written = PCAP_HEADER.size
+    with open(path, 'wb') as f:
+        f.write(PCAP_HEADER.pack(0xa1b2c3d4, 2, 4, 0, 0, 65535, 1))
+        for t, block in blocks:
+            frame = udp_frame(block)
+            usec = int(round(t * 10**6))
+            f.write(RECORD_HEADER.pack(usec // 10**6, usec % 10**6, len(frame), len(frame)))
+            f.write(frame)
+            packets += 1
+            messages += block[2]
+            written += RECORD_HEADER.size + len(frame)
+            if size and written >= size:
+                break
+    return packets, messages
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Write a synthetic GTP capture')
+    parser.add_argument('path', help='pcap file to write')
+    parser.add_argument('--packets', type=int, default=10000, help='number of UDP packets')
+    parser.add_argument('--size', type=float, default=0, metavar='MB',
+                        help='stop once the file reaches this size instead')
+    parser.add_argument('--mix', help='message type weights, e.g. AddOrder=5,Trade=1 (default: all types)')
+    parser.add_argument('--groups', default='ABCD', help='MarketDataGroup characters')
+    parser.add_argument('--max-messages', type=int, default=8, help='messages per block at most')
+    parser.add_argument('--instruments', type=int, default=200, help='distinct instruments')
+    parser.add_argument('--rate', type=float, default=100000.0, help='packets per second of capture time')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    packets = args.packets if not args.size else sys.maxsize
+    blocks = generate_blocks(packets, parse_mix(args.mix) if args.mix else None, args.groups,
+                             args.max_messages, args.instruments, args.seed, rate=args.rate)
+    packets, messages = write_pcap(args.path, blocks, int(args.size * 2**20))
+    print(json.dumps({'path': args.path, 'packets': packets, 'messages': messages}))
+
+
+if __name__ == '__main__':
+    main()
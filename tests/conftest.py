@@ -0,0 +1,17 @@
+import os
+import sys
+
+import pytest
+
+# the modules live at the top of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from synthetic import generate_blocks, write_pcap  # noqa: E402
+
+
+@pytest.fixture
+def capture(tmp_path):
+    # a synthetic capture of every message type in four groups
+    path = str(tmp_path / 'synthetic.pcap')
+    write_pcap(path, generate_blocks(3000, seed=7, start=1.7e9))
+    return path
@@ -0,0 +1,157 @@
+import io
+import gzip
+import glob
+
+import numpy as np
+import pytest
+
+from bars import BarAggregator, BarAggregators
+from batch_decode import decode_capture
+from encoder import Encoders, BlockEncoder
+from gtp_parse import decode, parse_gtp
+from jsonl import JsonLinesSink
+from parallel import decode_parallel
+from pcap_reader import PcapReader, udp_packet, LINKTYPE_ETHERNET
+from pipeline import Collector
+from sinks import NpzSink
+from synthetic import generate_blocks, write_pcap, udp_frame
+
+START = 1.7e9
+
+
+def messages(path):
+    sink = Collector()
+    with PcapReader(path) as reader:
+        for p in reader:
+            decode(p, sink)
+    return sink.messages
+
+
+def test_round_trip():
+    block = BlockEncoder('B', sequence=41)
+    for name, fields in [('AddOrder', dict(OrderID=7, Side='S', Price=12305000000, Size=3 * 10**8,
+                                           Instrument=(5 << 32) | 42, OrderBookType=1,
+                                           Timestamp=1700000000123456789)),
+                         ('Trade', dict(Instrument=42, Price=10**8, ExecutedSize=2 * 10**8,
+                                        Timestamp=1700000000 * 10**9))]:
+        encoder = Encoders[name]
+        assert block.add(encoder, encoder.values(**fields))
+    sink = Collector()
+    decode(udp_packet(memoryview(udp_frame(block.block())), LINKTYPE_ETHERNET, 1700000000.5, 0), sink)
+    (name, add), (_, trade) = sink.messages
+    assert name == 'AddOrder'
+    assert (add['OrderID'], add['Side'], add['Price'], add['Size']) == (7, b'S', 123.05, 3.0)
+    assert (add['Instrument'], add['InstrumentLong']) == (42, (5 << 32) | 42)
+    assert add['Timestamp'] == 1700000000123456789 / 10**9
+    assert (add['MarketDataGroup'], add['Sequence'], trade['Sequence']) == ('B', 41, 42)
+    assert (trade['Price'], trade['ExecutedSize'], trade['latency']) == (1.0, 2.0, 0.5)
+
+
+def test_synthetic_capture_decodes(capture):
+    found = messages(capture)
+    assert len(found) > 3000
+    assert set(name for name, data in found) <= set(Encoders)
+    # every group numbers its messages from 1 without holes
+    last = {}
+    for name, data in found:
+        g = data['MarketDataGroup']
+        assert data['Sequence'] == last.get(g, 0) + 1
+        last[g] = data['Sequence']
+
+
+def read_npz(directory):
+    out = {}
+    for path in sorted(glob.glob(directory + '/*.npz')):
+        name = path.split('/')[-1].split('.')[0]
+        with np.load(path) as f:
+            out.setdefault(name, []).append({k: f[k] for k in f.files})
+    return {name: {k: np.concatenate([p[k] for p in parts]) for k in parts[0]}
+            for name, parts in out.items()}
+
+
+def test_batch_matches_per_message(capture, tmp_path):
+    with NpzSink(str(tmp_path / 'serial')) as sink:
+        for name, data in messages(capture):
+            sink.add(name, data)
+    with NpzSink(str(tmp_path / 'batch')) as sink:
+        for columns in decode_capture(capture, 1000):
+            sink.write_batch(columns)
+    serial, batch = read_npz(str(tmp_path / 'serial')), read_npz(str(tmp_path / 'batch'))
+    assert serial.keys() == batch.keys()
+    for name in serial:
+        for k, a in serial[name].items():
+            assert np.array_equal(a, batch[name][k], equal_nan=a.dtype.kind == 'f'), (name, k)
+
+
+def test_jobs_match_serial(capture):
+    out = io.StringIO()
+    sink = JsonLinesSink(out)
+    with PcapReader(capture) as reader:
+        for p in reader:
+            parse_gtp(p, sink)
+    sink.flush()
+    jobs = io.StringIO()
+    decode_parallel(capture, 3, 64 * 1024, out=jobs)
+    assert jobs.getvalue() == out.getvalue()
+
+
+def trade_bars(path, batch):
+    out = Collector()
+    bars = BarAggregators([BarAggregator(out, 0.005), BarAggregator(out, volume=2000)])
+    if batch:
+        for columns in decode_capture(path, batch):
+            bars.write_batch(columns)
+    else:
+        for name, data in messages(path):
+            bars.add(name, data)
+    bars.close()
+    return out.messages
+
+
+def test_batch_bars_match_per_message(tmp_path):
+    path = str(tmp_path / 'trades.pcap')
+    write_pcap(path, generate_blocks(3000, {'Trade': 3, 'TradeCross': 1, 'AddOrder': 2},
+                                     instruments=20, seed=3, start=START))
+    serial = trade_bars(path, 0)
+    assert len(serial) > 100
+    assert trade_bars(path, 700) == serial
+
+
+def test_late_trade_opens_new_bar():
+    # the second trade of instrument 1 is for a bar the trade of instrument 2
+    # already finished; the empty trade is skipped
+    trades = np.array([(1, 10.0, 1.0, 0.5, 0.0, 1), (2, 11.0, 2.0, 1.5, 0.1, 2),
+                       (1, 12.0, 3.0, 0.7, 0.2, 3), (1, 13.0, 0.0, 0.8, 0.3, 4),
+                       (2, 9.0, 1.0, 2.5, 0.4, 5)],
+                      dtype=[('Instrument', '<u8'), ('Price', '<f8'), ('ExecutedSize', '<f8'),
+                             ('Timestamp', '<f8'), ('EventName', '<f8'), ('Sequence', '<u8')])
+    serial, batch = Collector(), Collector()
+    bars = BarAggregator(serial, 1.0)
+    for row in trades:
+        bars.add('Trade', dict(zip(trades.dtype.names, row.tolist())))
+    bars.close()
+    bars = BarAggregator(batch, 1.0)
+    bars.write_batch({'Trade': trades[:3]})
+    bars.write_batch({'Trade': trades[3:]})
+    bars.close()
+    assert [(data['Instrument'], data['Bar'], data['Volume'], data['Trades'])
+            for name, data in serial.messages] == [(1, 0, 1.0, 1), (2, 1, 2.0, 1), (1, 0, 3.0, 1), (2, 2, 1.0, 1)]
+    assert batch.messages == serial.messages
+
+
+def packets(path):
+    with PcapReader(path) as reader:
+        return [(p.offset, p.end, p.time, bytes(p.load)) for p in reader]
+
+
+def test_compressed_parity(capture):
+    plain = packets(capture)
+    with open(capture, 'rb') as f:
+        data = f.read()
+    with gzip.open(capture + '.gz', 'wb') as f:
+        f.write(data)
+    assert packets(capture + '.gz') == plain
+    zstandard = pytest.importorskip('zstandard')
+    with open(capture + '.zst', 'wb') as f:
+        f.write(zstandard.ZstdCompressor().compress(data))
+    assert packets(capture + '.zst') == plain
@@ -0,0 +1,53 @@
+import io
+import json
+
+import numpy as np
+
+from batch_decode import decode_capture
+from latency import LatencyMonitor
+from test_decode import messages
+
+COLUMNS = np.dtype([('EventName', '<f8'), ('MarketDataGroup', 'S1'), ('latency', '<f8')])
+
+
+def sample(t, group='A', latency=0.001):
+    return {'EventName': float(t), 'MarketDataGroup': group, 'latency': latency}
+
+
+def counts(histograms):
+    return {key: h.count for key, h in histograms.items()}
+
+
+def test_every_slot_closing_is_reported():
+    out = io.StringIO()
+    monitor = LatencyMonitor(10, 1, out)
+    for t in (1, 2, 3, 11, 12, 21):
+        monitor.add('Trade', sample(t))
+    # each report covers the slot that just closed
+    assert [json.loads(line)['count'] for line in out.getvalue().splitlines()] == [3, 2]
+
+
+def test_batch_rotates_slot_by_slot():
+    serial, batch = LatencyMonitor(10, 2), LatencyMonitor(10, 2)
+    for t in (1, 11):
+        for name in ('Trade', 'AddOrder'):
+            serial.add(name, sample(t))
+    batch.write_batch({name: np.array([(1.0, b'A', 0.001), (11.0, b'A', 0.001)], dtype=COLUMNS)
+                       for name in ('Trade', 'AddOrder')})
+    for m in (serial, batch):
+        assert counts(m.current) == {('Trade', 'A'): 1, ('AddOrder', 'A'): 1}
+        assert [counts(h) for slot, h in m.history] == [{('Trade', 'A'): 1, ('AddOrder', 'A'): 1}]
+
+
+def test_batch_reports_match_per_message(capture):
+    out = io.StringIO()
+    serial = LatencyMonitor(0.004, 2, out)
+    for name, data in messages(capture):
+        serial.add(name, data)
+    batch_out = io.StringIO()
+    batch = LatencyMonitor(0.004, 2, batch_out)
+    for columns in decode_capture(capture, 500):
+        batch.write_batch(columns)
+    assert out.getvalue().count('\n') > 50
+    assert batch_out.getvalue() == out.getvalue()
+    assert batch.report(lifetime=True) == serial.report(lifetime=True)
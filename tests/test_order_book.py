@@ -0,0 +1,108 @@
+from encoder import Encoders, BlockEncoder
+from gtp_parse import decode
+from order_book import OrderBooks
+from pcap_reader import udp_packet, LINKTYPE_ETHERNET
+from synthetic import udp_frame
+
+SYMBOL = 123456
+PRICE = 10**8
+
+
+def packet(messages, time=1.0):
+    # one GTP block of (MsgTypeName, fields) as a decodable UDPPacket
+    block = BlockEncoder('A')
+    for name, fields in messages:
+        encoder = Encoders[name]
+        assert block.add(encoder, encoder.values(**fields))
+    return udp_packet(memoryview(udp_frame(block.block())), LINKTYPE_ETHERNET, time, 0)
+
+
+def add(oid, side, price, size, instrument=SYMBOL):
+    return ('AddOrder', dict(OrderID=oid, Side=side, Price=price * PRICE, Size=size * PRICE,
+                             Instrument=instrument, OrderBookType=1, Timestamp=10**9))
+
+
+def books_from(*messages):
+    books = OrderBooks()
+    decode(packet(messages), books)
+    return books
+
+
+def test_add_aggregates_levels():
+    books = books_from(add(1, 'B', 100, 5), add(2, 'B', 100, 3), add(3, 'B', 99, 1),
+                       add(4, 'S', 101, 2), add(5, 'S', 102, 7))
+    snap = books.snapshot(SYMBOL)
+    assert snap['Bids'] == [[100.0, 8.0, 2], [99.0, 1.0, 1]]
+    assert snap['Asks'] == [[101.0, 2.0, 1], [102.0, 7.0, 1]]
+    book = books.books[SYMBOL, 1]
+    assert book.best_bid() == (100.0, 8.0)
+    assert book.best_ask() == (101.0, 2.0)
+
+
+def test_modify_resizes_or_moves():
+    books = books_from(
+        add(1, 'B', 100, 5), add(2, 'B', 100, 3),
+        ('ModifyOrder', dict(OrderID=1, Price=100 * PRICE, Quantity=2 * PRICE, Instrument=SYMBOL,
+                             Side='B', OrderBookType=1)),
+        ('ModifyOrder', dict(OrderID=2, Price=98 * PRICE, Quantity=3 * PRICE, Instrument=SYMBOL,
+                             Side='B', OrderBookType=1)))
+    assert books.snapshot(SYMBOL)['Bids'] == [[100.0, 2.0, 1], [98.0, 3.0, 1]]
+
+
+def test_delete_removes_emptied_levels():
+    books = books_from(add(1, 'S', 101, 2), add(2, 'S', 102, 7),
+                       ('DeleteOrder', dict(OrderID=1, Instrument=SYMBOL, Side='S', OrderBookType=1)),
+                       ('DeleteOrder', dict(OrderID=99, Instrument=SYMBOL, Side='S', OrderBookType=1)))
+    assert books.snapshot(SYMBOL)['Asks'] == [[102.0, 7.0, 1]]
+    assert books.books[SYMBOL, 1].best_ask() == (102.0, 7.0)
+    assert 1 not in books.orders
+
+
+def test_clear_drops_only_that_books_orders():
+    books = books_from(add(1, 'B', 100, 5), add(2, 'S', 101, 2), add(3, 'B', 50, 1, instrument=777),
+                       ('OrderBookClear', dict(Instrument=SYMBOL, OrderBookType=1)))
+    snap = books.snapshot(SYMBOL)
+    assert snap['Bids'] == [] and snap['Asks'] == []
+    assert books.books[SYMBOL, 1].best_bid() is None
+    assert set(books.orders) == {3}
+    assert books.snapshot(777)['Bids'] == [[50.0, 1.0, 1]]
+
+
+def test_add_order_short_is_counted_unplaced():
+    books = books_from(('AddOrderShort', dict(OrderID=9, Price=PRICE, Size=PRICE)), add(1, 'B', 100, 5))
+    assert books.unplaced == 1
+    assert 9 not in books.orders
+
+
+def test_readd_of_removed_level():
+    books = OrderBooks()
+    for _ in range(100):
+        decode(packet([add(1, 'B', 100, 1), ('DeleteOrder', dict(OrderID=1, Instrument=SYMBOL,
+                                                                    Side='B', OrderBookType=1))]), books)
+    decode(packet([add(2, 'B', 99, 1)]), books)
+    book = books.books[SYMBOL, 1]
+    assert book.best_bid() == (99.0, 1.0)
+    assert books.snapshot(SYMBOL)['Bids'] == [[99.0, 1.0, 1]]
+
+
+def test_state_round_trip():
+    books = books_from(add(1, 'B', 100, 5), add(2, 'S', 101, 2), add(3, 'S', 103, 4))
+    restored = OrderBooks().restore(books.state())
+    assert restored.snapshots() == books.snapshots()
+    decode(packet([('DeleteOrder', dict(OrderID=2, Instrument=SYMBOL, Side='S', OrderBookType=1)),
+                   ('OrderBookClear', dict(Instrument=SYMBOL, OrderBookType=1))]), restored)
+    assert len(restored.orders) == 0
+
+
+def test_order_slots_are_reused():
+    books = books_from(add(1, 'B', 100, 5), add(2, 'B', 99, 1), add(3, 'S', 101, 2),
+                       add(4, 'B', 50, 1, instrument=777),
+                       ('DeleteOrder', dict(OrderID=2, Instrument=SYMBOL, Side='B', OrderBookType=1)),
+                       ('OrderBookClear', dict(Instrument=SYMBOL, OrderBookType=1)))
+    assert set(books.orders) == {4}
+    decode(packet([add(5, 'S', 105, 1), add(6, 'B', 95, 2), add(7, 'B', 96, 3)]), books)
+    # three freed slots taken again, none appended
+    assert len(books.orders.ids) == 4
+    assert books.snapshot(SYMBOL)['Bids'] == [[96.0, 3.0, 1], [95.0, 2.0, 1]]
+    decode(packet([('OrderBookClear', dict(Instrument=777, OrderBookType=1))]), books)
+    assert set(books.orders) == {5, 6, 7}
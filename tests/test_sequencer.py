@@ -0,0 +1,70 @@
+from sequencer import Sequencer
+
+
+def sequencer(**kw):
+    s = Sequencer(**kw)
+    gaps = []
+    s.on_gap(gaps.append)
+    return s, gaps
+
+
+def test_duplicates_are_dropped():
+    s, gaps = sequencer()
+    assert s.accept('A', 1, 3) == 0b111
+    assert s.accept('A', 1, 3) == 0
+    # a block overlapping the delivered ones passes only its new messages
+    assert s.accept('A', 3, 3) == 0b110
+    assert (s.delivered, s.duplicates, gaps) == (5, 4, [])
+    assert s.stats()['Expected'] == {'A': 6}
+
+
+def test_gap_filled_by_other_line():
+    s, gaps = sequencer()
+    assert s.accept('A', 1, 2, 0.0) == 0b11
+    assert s.accept('A', 5, 2, 0.1) == 0b11
+    assert [(g.start, g.end) for g in s.open_gaps()] == [(3, 5)]
+    assert s.accept('A', 3, 2, 0.2) == 0b11
+    assert [(g.start, g.end, g.recovered, g.resolved) for g in gaps] == [(3, 5, True, 0.2)]
+    assert s.open_gaps() == [] and s.lost == 0
+    assert s.stats()['Expected'] == {'A': 7}
+
+
+def test_gap_lost_after_timeout():
+    s, gaps = sequencer(timeout=1.0)
+    s.accept('A', 1, 1, 0.0)
+    s.accept('A', 3, 1, 0.5)
+    assert s.accept('A', 4, 1, 2.0) == 1
+    assert [(g.start, g.end, g.recovered) for g in gaps] == [(2, 3, False)]
+    assert s.lost == 1
+    # too late: the hole was given up on
+    assert s.accept('A', 2, 1, 2.1) == 0
+
+
+def test_gap_lost_beyond_window():
+    s, gaps = sequencer(window=16)
+    s.accept('A', 1, 1)
+    s.accept('A', 10, 1)
+    s.accept('A', 30, 1)
+    assert [(g.start, g.end, g.recovered) for g in gaps] == [(2, 10, False)]
+    assert s.lost == 8 + 4
+
+
+def test_groups_are_independent():
+    s, gaps = sequencer()
+    s.accept('A', 1, 2)
+    s.accept('B', 100, 1)
+    assert s.accept('B', 100, 1) == 0
+    assert s.accept('A', 3, 1) == 1
+    assert s.stats()['Expected'] == {'A': 4, 'B': 101}
+
+
+def test_state_round_trip():
+    s, gaps = sequencer()
+    s.accept('A', 1, 2, 0.0)
+    s.accept('A', 6, 1, 0.1)
+    restored, gaps = sequencer()
+    restored.restore(s.state())
+    assert restored.accept('A', 6, 1, 0.2) == 0
+    assert restored.accept('A', 3, 3, 0.3) == 0b111
+    assert [(g.start, g.end, g.recovered) for g in gaps] == [(3, 6, True)]
+    assert restored.stats()['Expected'] == {'A': 7}
@@ -0,0 +1,103 @@
+import json
+
+import numpy as np
+import pytest
+
+import pcap_reader
+from bars import BarAggregator, BarAggregators
+from conflate import Conflator
+from gtp_parse import parse_gtp, Tee
+from jsonl import JsonLinesSink, open_output
+from session import Session
+from sinks import NpzSink
+from synthetic import generate_blocks, write_pcap
+from test_decode import read_npz
+
+START = 1.7e9
+
+
+@pytest.fixture
+def files(tmp_path):
+    # two rotations of one feed
+    blocks = list(generate_blocks(1500, seed=11, start=START))
+    paths = []
+    for n, part in enumerate((blocks[:800], blocks[800:])):
+        path = str(tmp_path / ('feed_%05d_20240101000000.pcap' % n))
+        write_pcap(path, part)
+        paths.append(path)
+    return paths
+
+
+def run(files, out, columns, checkpoint, count=0, resume=False):
+    # a --json-out and --output session; count packets then stop as if killed
+    printer = JsonLinesSink(open_output(out, resume))
+    output = NpzSink(columns, 100)
+    session = Session(files, checkpoint, every=200, sinks=[output, printer])
+    for n, p in enumerate(session, 1):
+        parse_gtp(p, output)
+        parse_gtp(p, printer)
+        if n == count:
+            break
+    output.close()
+    printer.close()
+    return session
+
+
+def test_checkpoint_records_next_record(files, tmp_path):
+    checkpoint = str(tmp_path / 'ck.json')
+    run(files, str(tmp_path / 'a.jsonl'), str(tmp_path / 'a'), checkpoint, count=300)
+    with open(checkpoint) as f:
+        state = json.load(f)
+    assert state['packets'] == 200
+    with pcap_reader.PcapReader(files[0]) as reader:
+        offsets = [p.offset for p in reader]
+    assert state['next'] == offsets[offsets.index(state['offset']) + 1]
+
+
+def test_resume_keeps_output(files, tmp_path, monkeypatch):
+    full = run(files, str(tmp_path / 'full.jsonl'), str(tmp_path / 'full'), str(tmp_path / 'full.json'))
+    assert full.done and full.packets == 1500
+    out, columns, checkpoint = str(tmp_path / 'part.jsonl'), str(tmp_path / 'part'), str(tmp_path / 'ck.json')
+    # killed after 1100 packets, 100 past the last checkpoint and in the
+    # second file, then again one packet into the resumed run; resumes
+    # seek to the recorded record, never resync
+    run(files, out, columns, checkpoint, count=1100)
+    monkeypatch.setattr(pcap_reader, 'pcap_resync', None)
+    run(files, out, columns, checkpoint, count=1, resume=True)
+    resumed = run(files, out, columns, checkpoint, resume=True)
+    assert resumed.done and resumed.packets == 1500
+    with open(str(tmp_path / 'full.jsonl')) as a, open(out) as b:
+        assert a.read() == b.read()
+    a, b = read_npz(str(tmp_path / 'full')), read_npz(columns)
+    assert a.keys() == b.keys()
+    for name in a:
+        for k, x in a[name].items():
+            assert np.array_equal(x, b[name][k], equal_nan=x.dtype.kind == 'f'), (name, k)
+
+
+def run_derived(files, out, checkpoint, count=0, resume=False):
+    # bars and conflated BBOs, whose open bars and pending updates must
+    # carry over a checkpoint without being published by it
+    printer = JsonLinesSink(open_output(out, resume))
+    bars = BarAggregators([BarAggregator(printer, 0.002), BarAggregator(printer, volume=500)])
+    conflator = Conflator(printer, 0.001)
+    session = Session(files, checkpoint, every=200, sinks=[bars, conflator, printer])
+    sink = Tee([bars, conflator])
+    for n, p in enumerate(session, 1):
+        parse_gtp(p, sink)
+        if n == count:
+            break
+    sink.close()
+    printer.close()
+    return conflator.stats()
+
+
+def test_resume_keeps_bars_and_conflation(files, tmp_path):
+    full = run_derived(files, str(tmp_path / 'full.jsonl'), None)
+    out, checkpoint = str(tmp_path / 'part.jsonl'), str(tmp_path / 'ck.json')
+    run_derived(files, out, checkpoint, count=1100)
+    assert run_derived(files, out, checkpoint, resume=True) == full
+    with open(str(tmp_path / 'full.jsonl')) as a, open(out) as b:
+        lines = a.read()
+        assert lines.count('"MsgTypeName": "Bar"') > 10 and lines.count('"Source": ') > 10
+        assert b.read() == lines
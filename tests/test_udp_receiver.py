@@ -0,0 +1,40 @@
+import socket
+import time
+
+from gtp_parse import decode
+from pipeline import Collector
+from synthetic import generate_blocks
+from udp_receiver import MulticastReceiver
+
+
+def receive(receiver, count, timeout=5.0):
+    packets = []
+    deadline = time.time() + timeout
+    while len(packets) < count and time.time() < deadline:
+        packets.extend(receiver.receive(timeout=0.1))
+    return packets
+
+
+def test_loopback_blocks_decode():
+    blocks = [block for t, block in generate_blocks(50, groups='A', seed=5, start=1.7e9)]
+    with MulticastReceiver([('127.0.0.1', 0)], slots=64, slot_size=2048) as receiver:
+        address = receiver.address()[0]
+        sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            for block in blocks[:25]:
+                sender.sendto(block, address)
+            # a jumbo datagram is dropped, not handed on cut short
+            sender.sendto(b'\x00' * 4000, address)
+            for block in blocks[25:]:
+                sender.sendto(block, address)
+            packets = receive(receiver, len(blocks))
+        finally:
+            sender.close()
+        assert receiver.truncated == 1
+    assert [bytes(p.load) for p in packets] == blocks
+    assert all(p.len == len(p.load) + 28 and p.dport == address[1] for p in packets)
+    sink = Collector()
+    for p in packets:
+        decode(p, sink)
+    assert len(sink.messages) == sum(block[2] for block in blocks)
+    assert [data['Sequence'] for name, data in sink.messages] == list(range(1, len(sink.messages) + 1))
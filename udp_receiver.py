@@ -0,0 +1,112 @@
+import socket
+import selectors
+import time
+from struct import pack
+
+from pcap_reader import UDPPacket
+
+
+def parse_groups(spec):
+    # '239.1.1.1:5000,239.1.1.2:5000' -> [('239.1.1.1', 5000), ...]
+    groups = []
+    for g in spec.split(','):
+        host, port = g.rsplit(':', 1)
+        groups.append((host, int(port)))
+    return groups
+
+
+def is_multicast(host):
+    return 224 <= int(host.split('.')[0]) <= 239
+
+
+class MulticastReceiver():
+    # joins the GTP multicast groups (plain unicast addresses, e.g. loopback,
+    # are just bound) and drains every readable socket with recvfrom_into
+    # loops into a preallocated ring of fixed size slots. Packets are
+    # UDPPacket records whose load is a view of their ring slot, so they must
+    # be consumed before the ring wraps, i.e. within `slots` packets.
+    # Datagrams larger than a slot (jumbo frames) would arrive cut short:
+    # they are dropped and counted in `truncated`
+    def __init__(self, groups, iface='0.0.0.0', slots=8192, slot_size=2048,
+                 rcvbuf=64 * 2**20):
+        self.slots = slots
+        self.slot_size = slot_size
+        self.ring = bytearray(slots * slot_size)
+        self.view = memoryview(self.ring)
+        self.next = 0
+        self.truncated = 0
+        self.selector = selectors.DefaultSelector()
+        self.sockets = []
+        for group, port in groups:
+            s = self.open_socket(group, port, iface, rcvbuf)
+            self.sockets.append(s)
+            # the bound port, which port 0 leaves to the system
+            self.selector.register(s, selectors.EVENT_READ, (group, s.getsockname()[1]))
+
+    def open_socket(self, group, port, iface, rcvbuf):
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if hasattr(socket, 'SO_REUSEPORT'):
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+        if is_multicast(group):
+            try:
+                # binding the group address filters out other groups on Linux
+                s.bind((group, port))
+            except OSError:
+                s.bind(('', port))
+            mreq = pack('4s4s', socket.inet_aton(group), socket.inet_aton(iface))
+            s.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+        else:
+            s.bind((group, port))
+        s.setblocking(False)
+        return s
+
+    def address(self):
+        return [s.getsockname() for s in self.sockets]
+
+    def receive(self, timeout=None, batch=256):
+        # waits for data, then drains the ready sockets until they would
+        # block or `batch` packets have been read
+        packets = []
+        batch = min(batch, self.slots)
+        view = self.view
+        size = self.slot_size
+        for key, events in self.selector.select(timeout):
+            s = key.fileobj
+            group, port = key.data
+            while len(packets) < batch:
+                start = self.next * size
+                slot = view[start:start + size]
+                try:
+                    if hasattr(s, 'recvmsg_into'):
+                        n, ancdata, flags, addr = s.recvmsg_into([slot])
+                        cut = flags & socket.MSG_TRUNC
+                    else:
+                        n, addr = s.recvfrom_into(slot)
+                        cut = n == size
+                except BlockingIOError:
+                    break
+                if cut:
+                    self.truncated += 1
+                    continue
+                packets.append(UDPPacket(time.time(), addr[0], group, addr[1], port,
+                                         n + 28, 0, slot[:n], 0))
+                self.next = (self.next + 1) % self.slots
+        return packets
+
+    def __iter__(self):
+        while True:
+            for p in self.receive():
+                yield p
+
+    def close(self):
+        self.selector.close()
+        for s in self.sockets:
+            s.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,109 @@
+from struct import Struct
+
+import serializer
+from gtp_parse import Decoders, PriceFlds, read_block
+
+
+class MessageView():
+    # a message left in its block buffer: attributes unpack one field at the
+    # offset precomputed from the serializer field specs, scaled like
+    # decode() scales them, and materialize() builds decode()'s full dict.
+    # block is read_block()'s per-packet header (IPHeader, MarketDataGroup)
+    __slots__ = ('buf', 'offset', 'block', 'sequence')
+    name = None
+    fields = ()
+
+    def __init__(self, buf, offset, block=None, sequence=0):
+        self.buf = buf
+        self.offset = offset
+        self.block = block
+        self.sequence = sequence
+
+    def raw(self, name):
+        # the unscaled wire value of a field
+        return self.unpackers[name](self.buf, self.offset)[0]
+
+    def materialize(self):
+        values = self.struct.unpack_from(self.buf, self.offset)
+        data = dict(zip(self.fields, values))
+        instrument = data.get('Instrument')
+        data['InstrumentLong'] = instrument
+        data['Instrument'] = instrument & 0xffffff if instrument else 0
+        block = self.block
+        if block is not None and hasattr(block, 'IPHeader'):
+            data['EventName'] = block.IPHeader['time']
+            data['src'] = block.IPHeader['src']
+            data['dst'] = block.IPHeader['dst']
+            data['len'] = block.IPHeader['len']
+        data['MsgTypeName'] = self.name
+        data['Sequence'] = self.sequence
+        if block is not None:
+            data['MarketDataGroup'] = block.MarketDataGroup
+        if data.get('Timestamp'):
+            data['Timestamp'] = data['Timestamp'] / 10**9
+        for f in self.prices:
+            if data[f]:
+                data[f] = data[f] / 10**8
+        if block is not None and hasattr(block, 'IPHeader') and data.get('Timestamp') is not None:
+            data['latency'] = block.IPHeader['time'] - float(data['Timestamp'])
+        return data
+
+    def __repr__(self):
+        return '<%s seq=%d>' % (self.name, self.sequence)
+
+
+def field_getter(unpack_from, offset, scale):
+    if scale is None:
+        def get(self):
+            return unpack_from(self.buf, self.offset + offset)[0]
+    else:
+        def get(self):
+            v = unpack_from(self.buf, self.offset + offset)[0]
+            return v / scale if v else v
+    return property(get)
+
+
+def offset_unpacker(unpack_from, offset):
+    def unpack(buf, off):
+        return unpack_from(buf, off + offset)
+    return unpack
+
+
+def symbol_getter(unpack_from, offset):
+    def get(self):
+        v = unpack_from(self.buf, self.offset + offset)[0]
+        return v & 0xffffff
+    return property(get)
+
+
+def build_view(decoder):
+    specs = getattr(serializer, decoder.name)().fields
+    attrs = {'__slots__': (), 'name': decoder.name, 'fields': decoder.fields,
+             'struct': decoder.struct,
+             'prices': tuple(decoder.fields[i] for i in decoder.prices),
+             'unpackers': {}}
+    fmt = '<'
+    for f in specs:
+        offset = Struct(fmt).size
+        s = Struct('<' + f['fmt'])
+        fmt += f['fmt']
+        attrs['unpackers'][f['name']] = offset_unpacker(s.unpack_from, offset)
+        if f['name'] == 'Instrument':
+            attrs['Instrument'] = symbol_getter(s.unpack_from, offset)
+            attrs['InstrumentLong'] = field_getter(s.unpack_from, offset, None)
+        elif f['name'] == 'Timestamp':
+            attrs['Timestamp'] = field_getter(s.unpack_from, offset, 10**9)
+        elif f['name'] in PriceFlds:
+            attrs[f['name']] = field_getter(s.unpack_from, offset, 10**8)
+        else:
+            attrs[f['name']] = field_getter(s.unpack_from, offset, None)
+    return type(decoder.name + 'View', (MessageView,), attrs)
+
+
+Views = {t: build_view(d) for t, d in Decoders.items()}
+
+
+def read_views(x, sequencer=None, msgfilter=None):
+    # like decode() but yields a view per message instead of a dict
+    for m in read_block(x, sequencer, msgfilter):
+        yield Views[m.MsgTypeByte](m.Block, m.Offset, m, m.SequenceMsg)